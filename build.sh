@@ -17,9 +17,12 @@ pip install django-cors-headers==4.3.1
 pip install django-environ==0.11.2
 pip install celery==5.3.4
 pip install redis==5.0.1
+pip install numpy==1.26.2
+pip install scipy==1.11.4
 pip install channels==4.0.0
 pip install channels-redis==4.1.0
 pip install daphne==4.0.0
+pip install "uvicorn[standard]==0.24.0"
 pip install django-extensions==3.2.3
 pip install drf-spectacular==0.26.5
 pip install python-decouple==3.8
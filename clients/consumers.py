@@ -8,6 +8,15 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         self.user_id = self.scope['url_route']['kwargs']['user_id']
         self.room_group_name = f'notifications_{self.user_id}'
 
+        # Chacun ne peut écouter que ses propres notifications
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+        if str(user.id) != self.user_id and not user.is_staff:
+            await self.close(code=4403)
+            return
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
@@ -21,9 +21,8 @@ from datetime import datetime, timedelta
 from clients.models import Commande, ArticleCommande, Avis
 from django.core.paginator import Paginator
 
-from django.contrib.gis.geos import Point
 from decimal import Decimal
-from livraisons.models import Livraison
+from livraisons.geometrie import livraison_pour_commande
 
 def inscription_commercant(request):
     if request.method == 'POST':
@@ -740,37 +739,9 @@ def api_valider_commande(request, commande_id):
         commande.statut = 'validee'
         commande.save()
         
-        # Créer un point de livraison sécurisé - CORRECTION
-        adresse_livraison_point = None
-        if commande.latitude_livraison and commande.longitude_livraison:
-            try:
-                lat = float(commande.latitude_livraison)
-                lng = float(commande.longitude_livraison)
-                # Vérifier que les coordonnées ne sont pas nulles
-                if lat != 0 and lng != 0:
-                    adresse_livraison_point = Point(lng, lat, srid=4326)
-            except (ValueError, TypeError) as e:
-                print(f"Erreur création point livraison: {e}")
-        
-        # Créer un point boutique sécurisé - CORRECTION
-        boutique_point = None
-        if commercant.latitude and commercant.longitude:
-            try:
-                lat = float(commercant.latitude)
-                lng = float(commercant.longitude)
-                if lat != 0 and lng != 0:
-                    boutique_point = Point(lng, lat, srid=4326)
-            except (ValueError, TypeError) as e:
-                print(f"Erreur création point boutique: {e}")
-        
-        # Créer une livraison associée à cette commande
-        livraison = Livraison.objects.create(
-            commande=commande,
-            statut='attribuee',
-            cout_livraison=Decimal('500.00'),  # Coût de livraison par défaut
-            adresse_livraison_point=adresse_livraison_point,
-            boutique_point=boutique_point
-        )
+        # La livraison et ses points sont créés par le signal post_save de la
+        # commande ; on la récupère (ou la crée si le signal ne l'a pas fait)
+        livraison, _ = livraison_pour_commande(commande)
         
         return JsonResponse({
             'success': True,
@@ -816,8 +787,7 @@ def api_refuser_commande(request, commande_id):
         
         # Si une livraison existe, l'annuler aussi
         if hasattr(commande, 'livraison'):
-            commande.livraison.statut = 'annulee'
-            commande.livraison.save()
+            commande.livraison.annuler_livraison()
         
         return JsonResponse({
             'success': True,
@@ -895,10 +865,8 @@ def api_commande_prete(request, commande_id):
         commande.statut = 'prete'
         commande.save()
         
-        # Mettre à jour le statut de la livraison si elle existe
-        if hasattr(commande, 'livraison'):
-            commande.livraison.statut = 'attribuee'
-            commande.livraison.save()
+        # La livraison garde son état : attribuée tant qu'aucun livreur ne
+        # l'a acceptée, acceptée sinon
         
         return JsonResponse({
             'success': True,
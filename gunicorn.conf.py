@@ -0,0 +1,25 @@
+"""
+Configuration gunicorn : workers uvicorn servant tnv.asgi:application.
+
+Les connexions WebSocket restent ouvertes longtemps ; avec des workers
+asynchrones elles n'immobilisent pas un processus chacune. Sans REDIS_URL
+la couche Channels est en mémoire : un seul worker, sinon un abonné et
+l'ingestion des positions pourraient se trouver dans deux processus
+différents.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+if os.environ.get('REDIS_URL'):
+    workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+else:
+    workers = 1
+
+# Les workers asynchrones répondent aux battements de cœur même pendant
+# une connexion longue ; le délai ne concerne que les workers bloqués
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
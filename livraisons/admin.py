@@ -1,8 +1,12 @@
 from django.contrib import admin
 from django.contrib.gis.admin import OSMGeoAdmin
 from django.utils.html import format_html
-from django.db.models import Avg, Count
-from .models import Livreur, Livraison, PositionLivreur, EvaluationLivreur, NotificationLivreur
+from django.utils import timezone
+from datetime import timedelta
+from .models import (
+    Livreur, Livraison, LotLivraison, PositionLivreur, EvaluationLivreur, NotificationLivreur,
+    StatistiqueJournaliereLivreur
+)
 
 
 @admin.register(Livreur)
@@ -17,7 +21,10 @@ class LivreurAdmin(admin.ModelAdmin):
         'est_actif', 'date_inscription'
     ]
     search_fields = ['username', 'email', 'first_name', 'last_name', 'telephone']
-    readonly_fields = ['note_moyenne', 'nombre_livraisons', 'date_inscription']
+    readonly_fields = [
+        'note_moyenne', 'nombre_livraisons', 'revenus_total', 'nombre_evaluations',
+        'moyenne_ponctualite', 'moyenne_professionalisme', 'moyenne_securite', 'date_inscription'
+    ]
     
     fieldsets = (
         ('Informations personnelles', {
@@ -36,24 +43,19 @@ class LivreurAdmin(admin.ModelAdmin):
             'fields': ('position_actuelle', 'derniere_position_mise_a_jour')
         }),
         ('Statistiques', {
-            'fields': ('note_moyenne', 'nombre_livraisons', 'date_inscription'),
+            'fields': (
+                'note_moyenne', 'nombre_evaluations', 'moyenne_ponctualite',
+                'moyenne_professionalisme', 'moyenne_securite', 'nombre_livraisons',
+                'revenus_total', 'date_inscription'
+            ),
             'classes': ('collapse',)
         })
     )
     
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            avg_note=Avg('livraisons__evaluation__note'),
-            liv_count=Count('livraisons')
-        )
-    
+    # Les statistiques sont des agrégats stockés (voir statistiques.py) : rien à annoter
     def note_moyenne(self, obj):
-        return f"{obj.note_moyenne}/5" if obj.note_moyenne else "N/A"
+        return f"{obj.note_moyenne}/5" if obj.nombre_evaluations else "N/A"
     note_moyenne.short_description = "Note moyenne"
-    
-    def nombre_livraisons(self, obj):
-        return obj.livraisons.count()
-    nombre_livraisons.short_description = "Livraisons"
 
 
 @admin.register(Livraison)
@@ -76,7 +78,7 @@ class LivraisonAdmin(OSMGeoAdmin):
     
     fieldsets = (
         ('Informations générales', {
-            'fields': ('commande', 'livreur', 'statut')
+            'fields': ('commande', 'livreur', 'statut', 'lot')
         }),
         ('Dates', {
             'fields': (
@@ -101,16 +103,46 @@ class LivraisonAdmin(OSMGeoAdmin):
     default_zoom = 12
 
 
+class LivraisonLotInline(admin.TabularInline):
+    model = Livraison
+    fields = ['commande', 'livreur', 'statut']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(LotLivraison)
+class LotLivraisonAdmin(admin.ModelAdmin):
+    list_display = ['id', 'commercant', 'statut', 'livreur', 'date_creation', 'date_cloture']
+    list_filter = ['statut', 'date_creation']
+    search_fields = ['commercant__nom_boutique']
+    readonly_fields = ['date_creation', 'date_acceptation']
+    inlines = [LivraisonLotInline]
+
+
 @admin.register(PositionLivreur)
 class PositionLivreurAdmin(OSMGeoAdmin):
     list_display = ['livreur', 'timestamp', 'vitesse']
     list_filter = ['timestamp']
-    search_fields = ['livreur__username']
+    list_select_related = ['livreur__user']
+    search_fields = ['livreur__user__username']
     readonly_fields = ['timestamp']
+    # Pas de COUNT(*) sur toute la table à chaque affichage de la liste
+    show_full_result_count = False
     
     default_lon = 1.2225
     default_lat = 6.1319
     default_zoom = 12
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # Sans filtre de date, la liste se limite aux 7 derniers jours
+        # pour ne parcourir que les partitions récentes.
+        url_name = getattr(request.resolver_match, 'url_name', '') or ''
+        if url_name.endswith('_changelist') and not any(
+                cle.startswith('timestamp') for cle in request.GET):
+            queryset = queryset.filter(timestamp__gte=timezone.now() - timedelta(days=7))
+        return queryset
 
 
 @admin.register(EvaluationLivreur)
@@ -181,6 +213,20 @@ class NotificationLivreurAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('livreur')
 
 
+
+@admin.register(StatistiqueJournaliereLivreur)
+class StatistiqueJournaliereLivreurAdmin(admin.ModelAdmin):
+    list_display = [
+        'livreur', 'jour', 'nombre_livraisons', 'livraisons_terminees',
+        'revenus', 'distance_km', 'nombre_evaluations'
+    ]
+    list_filter = ['jour']
+    date_hierarchy = 'jour'
+    search_fields = ['livreur__user__username']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('livreur__user')
+
 # Personnalisation de l'interface admin
 admin.site.site_header = "Administration - Livraison Express"
 admin.site.site_title = "Livraison Express"
@@ -0,0 +1,170 @@
+"""
+Données de la carte interactive : emprise visible et regroupement des points.
+
+Les API de la carte reçoivent l'emprise affichée (``bbox=ouest,sud,est,nord``,
+au format de ``L.LatLngBounds.toBBoxString()``) et le niveau de zoom. Seuls
+les points de l'emprise sont lus ; aux zooms faibles, ils sont regroupés
+sur une grille fixe en pixels Web Mercator, si bien qu'une cellule pleine de
+boutiques ne coûte qu'une entité. La grille est ancrée sur le monde et non
+sur l'écran : les groupes ne changent pas quand on fait glisser la carte.
+
+Les réponses sont des FeatureCollection GeoJSON.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+
+TAILLE_TUILE = 256
+
+PARAMETRES_DEFAUT = {
+    # Côté d'une cellule de regroupement, en pixels à l'écran
+    'taille_cellule_px': 60,
+    # À partir de ce zoom, chaque point est renvoyé individuellement
+    'zoom_max_regroupement': 16,
+}
+
+
+def parametres():
+    return {**PARAMETRES_DEFAUT, **getattr(settings, 'TNV_CARTE', {})}
+
+
+def lire_emprise(donnees):
+    """
+    (emprise, zoom) d'une requête : emprise (ouest, sud, est, nord) ou None,
+    zoom entier ou None. ValueError si l'un des deux est mal formé.
+    """
+    emprise = None
+    if donnees.get('bbox'):
+        try:
+            ouest, sud, est, nord = (float(valeur) for valeur in donnees['bbox'].split(','))
+        except ValueError:
+            raise ValueError("Paramètre bbox invalide (attendu : ouest,sud,est,nord).")
+        if not (-180 <= ouest < est <= 180 and -90 <= sud < nord <= 90):
+            raise ValueError("Paramètre bbox hors limites.")
+        emprise = (ouest, sud, est, nord)
+
+    zoom = None
+    if donnees.get('zoom') not in (None, ''):
+        try:
+            zoom = int(donnees['zoom'])
+        except ValueError:
+            raise ValueError("Paramètre zoom invalide.")
+        if not 0 <= zoom <= 22:
+            raise ValueError("Paramètre zoom hors limites.")
+    return emprise, zoom
+
+
+def polygone(emprise):
+    """Polygone de l'emprise, pour les filtres ``__within`` sur les champs géographiques"""
+    return Polygon.from_bbox(emprise)
+
+
+def pixels(lats, lngs, zoom):
+    """Coordonnées en pixels Web Mercator au niveau de zoom donné"""
+    monde = TAILLE_TUILE * 2 ** zoom
+    lats = np.clip(np.asarray(lats, dtype=float), -85.05112878, 85.05112878)
+    lngs = np.asarray(lngs, dtype=float)
+    x = (lngs + 180.0) / 360.0 * monde
+    sin_lat = np.sin(np.radians(lats))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * monde
+    return x, y
+
+
+def _coordonnees(x, y, zoom):
+    monde = TAILLE_TUILE * 2 ** zoom
+    lng = x / monde * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / monde))))
+    return lat, lng
+
+
+def emprise_tuile(z, x, y, marge_px=0):
+    """Emprise (ouest, sud, est, nord) de la tuile z/x/y, élargie de ``marge_px``"""
+    nord, ouest = _coordonnees(x * TAILLE_TUILE - marge_px, y * TAILLE_TUILE - marge_px, z)
+    sud, est = _coordonnees((x + 1) * TAILLE_TUILE + marge_px, (y + 1) * TAILLE_TUILE + marge_px, z)
+    return (max(ouest, -180.0), max(sud, -85.05112878), min(est, 180.0), min(nord, 85.05112878))
+
+
+def regroupement_actif(zoom, params=None):
+    params = params or parametres()
+    return zoom is not None and zoom < params['zoom_max_regroupement']
+
+
+def emprise_alignee(emprise, zoom, params=None):
+    """
+    Emprise élargie aux bords des cellules de la grille, pour que les groupes
+    situés en bordure d'écran comptent tous leurs points.
+    """
+    params = params or parametres()
+    if emprise is None or not regroupement_actif(zoom, params):
+        return emprise
+    taille = params['taille_cellule_px']
+    ouest, sud, est, nord = emprise
+    # Le nord est en haut : y croît vers le sud
+    (x_min, x_max), (y_min, y_max) = pixels([nord, sud], [ouest, est], zoom)
+    x_min, y_min = math.floor(x_min / taille) * taille, math.floor(y_min / taille) * taille
+    x_max, y_max = math.ceil(x_max / taille) * taille, math.ceil(y_max / taille) * taille
+    nord, ouest = _coordonnees(x_min, y_min, zoom)
+    sud, est = _coordonnees(x_max, y_max, zoom)
+    return (max(ouest, -180.0), max(sud, -90.0), min(est, 180.0), min(nord, 90.0))
+
+
+def regrouper(points, zoom, params=None):
+    """
+    Regroupe des points (id, latitude, longitude) par cellule de grille.
+    Retourne (ids des points isolés, entités GeoJSON des groupes) ; sans
+    regroupement à ce zoom, tous les points sont isolés.
+    """
+    params = params or parametres()
+    points = [(identifiant, float(lat), float(lng)) for identifiant, lat, lng in points]
+    if not points or not regroupement_actif(zoom, params):
+        return [identifiant for identifiant, _, _ in points], []
+
+    ids = np.array([point[0] for point in points])
+    lats = np.array([point[1] for point in points])
+    lngs = np.array([point[2] for point in points])
+    x, y = pixels(lats, lngs, zoom)
+    taille = params['taille_cellule_px']
+    cellules = np.stack([np.floor(x / taille), np.floor(y / taille)], axis=1)
+    _, cellule_de, nombres = np.unique(cellules, axis=0, return_inverse=True, return_counts=True)
+    cellule_de = cellule_de.ravel()
+
+    isoles = ids[nombres[cellule_de] == 1].tolist()
+
+    n = len(nombres)
+    lat_moy = np.bincount(cellule_de, weights=lats, minlength=n) / nombres
+    lng_moy = np.bincount(cellule_de, weights=lngs, minlength=n) / nombres
+    sud, ouest = np.full(n, np.inf), np.full(n, np.inf)
+    nord, est = np.full(n, -np.inf), np.full(n, -np.inf)
+    np.minimum.at(sud, cellule_de, lats)
+    np.minimum.at(ouest, cellule_de, lngs)
+    np.maximum.at(nord, cellule_de, lats)
+    np.maximum.at(est, cellule_de, lngs)
+
+    groupes = [
+        entite(lat_moy[c], lng_moy[c], {
+            'cluster': True,
+            'nombre': int(nombres[c]),
+            'emprise': [round(float(ouest[c]), 6), round(float(sud[c]), 6),
+                        round(float(est[c]), 6), round(float(nord[c]), 6)],
+        })
+        for c in np.flatnonzero(nombres > 1)
+    ]
+    return isoles, groupes
+
+
+def entite(latitude, longitude, proprietes):
+    return {
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Point',
+            'coordinates': [round(float(longitude), 6), round(float(latitude), 6)],
+        },
+        'properties': proprietes,
+    }
+
+
+def collection(entites, **membres):
+    """FeatureCollection GeoJSON ; ``membres`` s'ajoutent au premier niveau"""
+    return {'type': 'FeatureCollection', 'features': entites, **membres}
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import time
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from .suivi import STATUTS_SUIVIS, nom_groupe
+
+
+class SuiviLivraisonConsumer(AsyncWebsocketConsumer):
+    """
+    Suivi en direct d'une livraison : position du livreur et changements de
+    statut, pour le client, le commerçant et le livreur concernés.
+
+    Les positions sont limitées côté serveur à un envoi par intervalle et par
+    abonné ; une position reçue pendant l'intervalle remplace la précédente
+    et part à la fin de celui-ci, si bien que la dernière position connue
+    est toujours transmise.
+    """
+
+    async def connect(self):
+        self.livraison_id = int(self.scope['url_route']['kwargs']['livraison_id'])
+        self.groupe = nom_groupe(self.livraison_id)
+        self.intervalle = getattr(settings, 'TNV_SUIVI_INTERVALLE_MIN_S', 2)
+        self.dernier_envoi = 0.0
+        self.en_attente = None
+        self.tache_differee = None
+
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        etat = await self._etat_initial(user)
+        if etat is None:
+            await self.close(code=4403)
+            return
+
+        await self.channel_layer.group_add(self.groupe, self.channel_name)
+        await self.accept()
+        await self.send(text_data=json.dumps(etat))
+
+    async def disconnect(self, close_code):
+        if self.tache_differee:
+            self.tache_differee.cancel()
+        if hasattr(self, 'groupe'):
+            await self.channel_layer.group_discard(self.groupe, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        # Canal en lecture seule : les positions arrivent par l'API d'ingestion
+        pass
+
+    async def position_livreur(self, event):
+        message = {
+            'type': 'position',
+            'latitude': event['latitude'],
+            'longitude': event['longitude'],
+            'timestamp': event['timestamp'],
+            'vitesse': event.get('vitesse'),
+        }
+        attente = self.dernier_envoi + self.intervalle - time.monotonic()
+        if attente <= 0:
+            await self._envoyer(message)
+            return
+        self.en_attente = message
+        if self.tache_differee is None or self.tache_differee.done():
+            self.tache_differee = asyncio.ensure_future(self._envoyer_differe(attente))
+
+    async def statut_livraison(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'statut',
+            'statut': event['statut'],
+            'statut_display': event['statut_display'],
+        }))
+        if event['statut'] not in STATUTS_SUIVIS:
+            await self.close()
+
+    async def arrivee_livraison(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'arrivee',
+            'zone': event['zone'],
+            'timestamp': event['timestamp'],
+        }))
+
+    async def eta_livraison(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'eta',
+            'duree_restante_s': event['duree_restante_s'],
+            'distance_restante_m': event['distance_restante_m'],
+            'arrivee_estimee': event['arrivee_estimee'],
+            'calculee_le': event['calculee_le'],
+        }))
+
+    async def _envoyer(self, message):
+        self.dernier_envoi = time.monotonic()
+        await self.send(text_data=json.dumps(message))
+
+    async def _envoyer_differe(self, attente):
+        await asyncio.sleep(attente)
+        message, self.en_attente = self.en_attente, None
+        if message is not None:
+            await self._envoyer(message)
+
+    @database_sync_to_async
+    def _etat_initial(self, user):
+        """Premier message de l'abonné, ou None s'il n'a pas accès à la livraison"""
+        from . import eta, tampon_positions
+        from .models import Livraison
+
+        livraison = Livraison.objects.select_related(
+            'livreur', 'commande__client', 'commande__commercant'
+        ).filter(id=self.livraison_id).first()
+        if livraison is None:
+            return None
+
+        commande = livraison.commande
+        autorises = {
+            livraison.livreur.user_id if livraison.livreur else None,
+            commande.client.user_id if commande.client else None,
+            commande.commercant.user_id if commande.commercant else None,
+        }
+        if user.id not in autorises and not user.is_staff:
+            return None
+
+        etat = {
+            'type': 'etat',
+            'statut': livraison.statut,
+            'statut_display': livraison.get_statut_display(),
+            'position': None,
+            'eta': eta.lire(livraison.id) if livraison.statut == 'en_cours' else None,
+        }
+        if livraison.livreur and livraison.statut in STATUTS_SUIVIS:
+            livreur = livraison.livreur
+            tampon_positions.appliquer(livreur)
+            if livreur.position_actuelle:
+                etat['position'] = {
+                    'latitude': livreur.position_actuelle.y,
+                    'longitude': livreur.position_actuelle.x,
+                    'timestamp': livreur.derniere_position_mise_a_jour.isoformat()
+                    if livreur.derniere_position_mise_a_jour else None,
+                }
+        return etat
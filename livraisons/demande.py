@@ -0,0 +1,184 @@
+"""
+Carte de la demande : où les commandes ont été passées récemment.
+
+Les points de livraison des commandes sont comptés par cellule hexagonale
+(grille axiale en mètres Web Mercator, ``taille_cellule_m`` du centre à un
+sommet) et par période de 15 minutes dans ``DemandeCellule``. Chaque
+commande créée incrémente sa cellule ; la commande ``agreger_demande``
+reconstruit les périodes closes à partir des commandes (reprise
+d'historique, réparation) et purge les périodes trop anciennes.
+
+La carte lit les cellules de l'emprise et les additionne sur la fenêtre
+demandée : son coût dépend du nombre de cellules visibles, pas du nombre
+de commandes.
+"""
+import math
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import carte
+from .models import DemandeCellule
+
+RAYON_TERRE = 6378137.0
+LATITUDE_MAX = 85.05112878
+
+PARAMETRES_DEFAUT = {
+    # Distance du centre d'une cellule à ses sommets, en mètres
+    'taille_cellule_m': 400,
+    # Fenêtre maximale de la carte, en heures
+    'heures_max': 24,
+    # Conservation des périodes, en jours
+    'retention_jours': 30,
+}
+
+
+def parametres():
+    return {**PARAMETRES_DEFAUT, **getattr(settings, 'TNV_DEMANDE', {})}
+
+
+def periode(instant):
+    """Début de la période de 15 minutes contenant cet instant"""
+    return instant.replace(minute=instant.minute - instant.minute % 15, second=0, microsecond=0)
+
+
+def cellule(latitude, longitude, taille):
+    """Coordonnées axiales (q, r) de la cellule contenant le point"""
+    latitude = max(min(float(latitude), LATITUDE_MAX), -LATITUDE_MAX)
+    x = RAYON_TERRE * math.radians(float(longitude))
+    y = RAYON_TERRE * math.log(math.tan(math.pi / 4 + math.radians(latitude) / 2))
+    q = (math.sqrt(3) / 3 * x - y / 3) / taille
+    r = (2 / 3 * y) / taille
+
+    # Arrondi en coordonnées cubiques (q + r + s = 0)
+    s = -q - r
+    q_arrondi, r_arrondi, s_arrondi = round(q), round(r), round(s)
+    ecart_q, ecart_r, ecart_s = abs(q_arrondi - q), abs(r_arrondi - r), abs(s_arrondi - s)
+    if ecart_q > ecart_r and ecart_q > ecart_s:
+        q_arrondi = -r_arrondi - s_arrondi
+    elif ecart_r > ecart_s:
+        r_arrondi = -q_arrondi - s_arrondi
+    return int(q_arrondi), int(r_arrondi)
+
+
+def centre(q, r, taille):
+    """(latitude, longitude) du centre de la cellule"""
+    x = taille * math.sqrt(3) * (q + r / 2)
+    y = taille * 1.5 * r
+    longitude = math.degrees(x / RAYON_TERRE)
+    latitude = math.degrees(2 * math.atan(math.exp(y / RAYON_TERRE)) - math.pi / 2)
+    return latitude, longitude
+
+
+def compter(commande):
+    """Ajoute une commande au compte de sa cellule et de sa période"""
+    if commande.point_livraison is None:
+        return
+    taille = parametres()['taille_cellule_m']
+    q, r = cellule(commande.point_livraison.y, commande.point_livraison.x, taille)
+    cle = {'taille': taille, 'q': q, 'r': r, 'periode': periode(commande.date_commande)}
+
+    if DemandeCellule.objects.filter(**cle).update(nombre=F('nombre') + 1):
+        return
+    latitude, longitude = centre(q, r, taille)
+    try:
+        with transaction.atomic():
+            DemandeCellule.objects.create(
+                centre=Point(longitude, latitude, srid=4326), nombre=1, **cle
+            )
+    except IntegrityError:
+        # Créée entre-temps par une commande concurrente
+        DemandeCellule.objects.filter(**cle).update(nombre=F('nombre') + 1)
+
+
+def reconstruire(depuis, jusque=None):
+    """
+    Recalcule les cellules des périodes closes entre ``depuis`` et
+    ``jusque`` (par défaut la période en cours, exclue : elle reste tenue
+    par les incréments). Retourne le nombre de cellules écrites.
+    """
+    from clients.models import Commande
+
+    taille = parametres()['taille_cellule_m']
+    debut = periode(depuis)
+    fin = min(periode(jusque or timezone.now()), periode(timezone.now()))
+    if debut >= fin:
+        return 0
+
+    commandes = Commande.objects.filter(
+        date_commande__gte=debut,
+        date_commande__lt=fin,
+        point_livraison__isnull=False,
+    ).values_list('point_livraison', 'date_commande')
+    comptes = Counter(
+        (*cellule(point.y, point.x, taille), periode(instant))
+        for point, instant in commandes.iterator()
+    )
+
+    cellules = []
+    for (q, r, debut_periode), nombre in comptes.items():
+        latitude, longitude = centre(q, r, taille)
+        cellules.append(DemandeCellule(
+            taille=taille, q=q, r=r, periode=debut_periode, nombre=nombre,
+            centre=Point(longitude, latitude, srid=4326),
+        ))
+    with transaction.atomic():
+        DemandeCellule.objects.filter(taille=taille, periode__gte=debut, periode__lt=fin).delete()
+        DemandeCellule.objects.bulk_create(cellules, batch_size=1000)
+    return len(cellules)
+
+
+def purger():
+    """Supprime les périodes plus anciennes que la durée de conservation"""
+    limite = timezone.now() - timedelta(days=parametres()['retention_jours'])
+    supprimees, _ = DemandeCellule.objects.filter(periode__lt=limite).delete()
+    return supprimees
+
+
+def lire_heures(donnees):
+    """Fenêtre ``heures`` d'une requête (1 par défaut). ValueError si invalide."""
+    try:
+        heures = float(donnees.get('heures') or 1)
+    except ValueError:
+        raise ValueError("Paramètre heures invalide.")
+    if not 0 < heures <= parametres()['heures_max']:
+        raise ValueError(f"Paramètre heures hors limites (maximum {parametres()['heures_max']}).")
+    return heures
+
+
+def entites(emprise, heures):
+    """
+    Entités GeoJSON (centre de chaque cellule) portant le nombre de
+    commandes des ``heures`` dernières heures, et leur maximum
+    """
+    params = parametres()
+    taille = params['taille_cellule_m']
+    cellules = DemandeCellule.objects.filter(
+        taille=taille,
+        periode__gte=periode(timezone.now() - timedelta(hours=heures)),
+    )
+    if emprise:
+        # Élargie d'une cellule : les hexagones à cheval sur le bord sont inclus
+        marge = math.degrees(taille / RAYON_TERRE)
+        ouest, sud, est, nord = emprise
+        cellules = cellules.filter(centre__within=carte.polygone((
+            max(ouest - marge, -180.0), max(sud - marge, -90.0),
+            min(est + marge, 180.0), min(nord + marge, 90.0),
+        )))
+
+    resultat = []
+    maximum = 0
+    for ligne in cellules.values('q', 'r').annotate(total=Sum('nombre')).order_by():
+        latitude, longitude = centre(ligne['q'], ligne['r'], taille)
+        maximum = max(maximum, ligne['total'])
+        resultat.append(carte.entite(latitude, longitude, {
+            'q': ligne['q'],
+            'r': ligne['r'],
+            'nombre': ligne['total'],
+        }))
+    return resultat, maximum
@@ -0,0 +1,368 @@
+"""
+Attribution globale des livraisons en attente aux livreurs disponibles.
+
+À chaque passage, toutes les livraisons sans livreur et tous les livreurs
+disponibles sont confrontés dans une matrice de coûts NumPy (distance
+jusqu'à la boutique, note du livreur, livraisons déjà en charge). Le
+couplage de coût minimal est calculé par ``scipy.optimize`` quand SciPy
+est installé, par un algorithme d'enchères (Bertsekas) sinon.
+
+Les attributions sont des propositions : le livreur les accepte comme
+aujourd'hui ; une proposition restée sans réponse est retirée au passage
+suivant et le livreur n'est plus proposé pour cette livraison.
+"""
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import routage
+from .distances import matrice
+
+PREFIXE_REFUS = 'tnv:dispatch:refus:'
+DUREE_REFUS = 3600
+STATUTS_EN_CHARGE = ['attribuee', 'acceptee', 'en_cours']
+
+PARAMETRES_DEFAUT = {
+    # Intervalle entre deux passages (secondes)
+    'intervalle_s': 15,
+    # Distance maximale livreur -> boutique (km)
+    'rayon_max_km': 10,
+    # Livraisons simultanées par livreur
+    'capacite': 2,
+    # Coût d'une étoile manquante, en km équivalents
+    'poids_note': 0.5,
+    # Coût d'une livraison déjà en charge, en km équivalents
+    'poids_charge': 1.0,
+    # Note retenue pour un livreur pas encore évalué
+    'note_defaut': 4.0,
+    # Délai d'acceptation d'une proposition (secondes)
+    'delai_proposition_s': 90,
+    # Distances par la route quand le graphe routier est disponible
+    'routage': True,
+}
+
+
+def parametres():
+    return {**PARAMETRES_DEFAUT, **getattr(settings, 'TNV_DISPATCH', {})}
+
+
+# Résolution du couplage
+
+def _enchere(benefices):
+    """
+    Enchères de Bertsekas (variante de Jacobi, avec réduction progressive
+    de epsilon) sur une matrice carrée de bénéfices entiers. Retourne pour
+    chaque ligne l'indice de la colonne attribuée. Optimal pour epsilon < 1/n.
+    """
+    n = benefices.shape[0]
+    if n == 1:
+        return np.zeros(1, dtype=int)
+    prix = np.zeros(n)
+    epsilon_final = 1.0 / (n + 1)
+    epsilon = max(float(np.ptp(benefices)) / 4, epsilon_final)
+    tout = np.arange(n)
+
+    while True:
+        affectation = np.full(n, -1)
+        proprietaire = np.full(n, -1)
+        while True:
+            libres = tout[affectation < 0]
+            if not len(libres):
+                break
+            valeurs = benefices[libres] - prix
+            lignes = np.arange(len(libres))
+            meilleurs = valeurs.argmax(axis=1)
+            v1 = valeurs[lignes, meilleurs]
+            valeurs[lignes, meilleurs] = -np.inf
+            v2 = valeurs.max(axis=1)
+            offres = prix[meilleurs] + (v1 - v2) + epsilon
+
+            # Pour chaque colonne disputée, la plus forte offre l'emporte
+            ordre = np.lexsort((-offres, meilleurs))
+            colonnes = meilleurs[ordre]
+            premiers = np.r_[True, colonnes[1:] != colonnes[:-1]]
+            gagnants = libres[ordre][premiers]
+            colonnes = colonnes[premiers]
+
+            anciens = proprietaire[colonnes]
+            affectation[anciens[anciens >= 0]] = -1
+            proprietaire[colonnes] = gagnants
+            affectation[gagnants] = colonnes
+            prix[colonnes] = offres[ordre][premiers]
+
+        if epsilon <= epsilon_final:
+            return affectation
+        epsilon = max(epsilon / 5, epsilon_final)
+
+
+def resoudre_par_encheres(couts):
+    """Couplage de coût minimal par enchères, sans dépendance à SciPy"""
+    n, m = couts.shape
+    # Coûts ramenés au mètre près pour des bénéfices entiers, puis matrice
+    # complétée en carré par des lignes ou colonnes fictives de bénéfice nul
+    taille = max(n, m)
+    benefices = np.zeros((taille, taille))
+    benefices[:n, :m] = np.rint((couts.max() - couts) * 1000) + 1
+    affectation = _enchere(benefices)
+    return [
+        (ligne, int(colonne))
+        for ligne, colonne in enumerate(affectation[:n].tolist())
+        if colonne < m
+    ]
+
+
+def resoudre(couts):
+    """
+    Couplage de coût minimal d'une matrice (n, m) quelconque. Retourne la
+    liste des couples (ligne, colonne) ; min(n, m) couples au total.
+    """
+    n, m = couts.shape
+    if not n or not m:
+        return []
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        return resoudre_par_encheres(couts)
+    lignes, colonnes = linear_sum_assignment(couts)
+    return list(zip(lignes.tolist(), colonnes.tolist()))
+
+
+def glouton(couts):
+    """Référence : chaque ligne prend tour à tour la colonne libre la moins chère"""
+    prises = np.zeros(couts.shape[1], dtype=bool)
+    couples = []
+    for ligne in range(couts.shape[0]):
+        valeurs = np.where(prises, np.inf, couts[ligne])
+        colonne = int(valeurs.argmin())
+        if np.isinf(valeurs[colonne]):
+            break
+        prises[colonne] = True
+        couples.append((ligne, colonne))
+    return couples
+
+
+# Construction du problème
+
+def matrice_couts(boutiques, livreurs, params=None, interdits=None):
+    """
+    Matrice des coûts livraisons x places de livreur.
+
+    ``boutiques`` : (lats, lngs) des boutiques. ``livreurs`` : (lats, lngs,
+    notes, charges). Chaque livreur offre ``capacite - charge`` places, la
+    k-ième coûtant k fois ``poids_charge`` de plus. ``interdits`` est un
+    ensemble de couples (indice livraison, indice livreur) exclus.
+
+    Retourne (couts, distances_m, places) où ``places[j]`` est l'indice du
+    livreur offrant la colonne j ; les couples impossibles valent +inf.
+    """
+    params = params or parametres()
+    b_lats, b_lngs = boutiques
+    l_lats, l_lngs, notes, charges = (np.asarray(v, dtype=float) for v in livreurs)
+
+    notes = np.where(notes > 0, notes, params['note_defaut'])
+    places, rangs = [], []
+    for indice, charge in enumerate(charges.astype(int)):
+        for rang in range(charge, params['capacite']):
+            places.append(indice)
+            rangs.append(rang)
+    places = np.asarray(places, dtype=int)
+    rangs = np.asarray(rangs, dtype=float)
+
+    distances = None
+    if params.get('routage'):
+        reseau = routage.graphe()
+        if reseau is not None:
+            # Distances par la route du livreur vers la boutique
+            _, distances = reseau.matrice((l_lats, l_lngs), (b_lats, b_lngs))
+            distances = distances.T
+    if distances is None:
+        distances = matrice(b_lats, b_lngs, l_lats, l_lngs)
+    couts = (
+        distances[:, places] / 1000 +
+        params['poids_note'] * (5 - notes[places]) +
+        params['poids_charge'] * rangs
+    )
+    couts[distances[:, places] > params['rayon_max_km'] * 1000] = np.inf
+    for livraison, livreur in interdits or ():
+        couts[livraison, places == livreur] = np.inf
+    return couts, distances, places
+
+
+def attribuer(couts, places, solveur=resoudre):
+    """
+    Résout le couplage et retourne les couples (livraison, livreur) possibles.
+    Les couples impossibles sont remplacés par un coût dominant avant
+    résolution, puis écartés.
+    """
+    if not couts.size:
+        return []
+    faisable = np.isfinite(couts)
+    if not faisable.any():
+        return []
+    # Retirer les lignes et colonnes sans aucun couple possible
+    lignes = np.flatnonzero(faisable.any(axis=1))
+    colonnes = np.flatnonzero(faisable.any(axis=0))
+    reduite = couts[np.ix_(lignes, colonnes)]
+    finie = np.isfinite(reduite)
+    reduite = np.where(finie, reduite, reduite[finie].max() * 2 + 1)
+    return [
+        (int(lignes[i]), int(places[colonnes[j]]))
+        for i, j in solveur(reduite)
+        if finie[i, j]
+    ]
+
+
+# Passage du dispatch
+
+def _cle_refus(livraison_id):
+    return f"{PREFIXE_REFUS}{livraison_id}"
+
+
+def liberer_propositions_expirees(params=None):
+    """
+    Retire les propositions restées sans réponse et mémorise le livreur
+    concerné pour ne plus le proposer sur cette livraison.
+    """
+    from .models import Livraison
+    params = params or parametres()
+    limite = timezone.now() - timedelta(seconds=params['delai_proposition_s'])
+    expirees = Livraison.objects.filter(
+        statut='attribuee',
+        livreur__isnull=False,
+        date_attribution__lt=limite,
+    )
+    couples = list(expirees.values_list('id', 'livreur_id'))
+    if not couples:
+        return 0
+    for livraison_id, livreur_id in couples:
+        refus = cache.get(_cle_refus(livraison_id)) or set()
+        refus.add(livreur_id)
+        cache.set(_cle_refus(livraison_id), refus, DUREE_REFUS)
+    return Livraison.objects.filter(
+        id__in=[livraison_id for livraison_id, _ in couples],
+        statut='attribuee',
+    ).update(livreur=None, date_modification=timezone.now())
+
+
+def _livreurs_disponibles():
+    from . import presence, tampon_positions
+    from .models import Livreur
+    livreurs = list(
+        Livreur.objects.filter(
+            # En ligne d'après les battements de cœur, pas d'après la colonne
+            id__in=presence.livreurs_en_ligne(),
+            est_actif=True,
+            est_disponible=True,
+            position_actuelle__isnull=False,
+        ).annotate(
+            charge=Count('livraisons', filter=Q(livraisons__statut__in=STATUTS_EN_CHARGE))
+        )
+    )
+    tampon_positions.appliquer(*livreurs)
+    return livreurs
+
+
+def dispatcher(params=None):
+    """
+    Passage complet : clôture les lots échus, libère les propositions
+    expirées, calcule le couplage optimal et propose chaque course retenue
+    (une livraison seule ou tout un lot) à son livreur.
+    Retourne les statistiques du passage.
+    """
+    from . import regroupement
+    from .models import NotificationLivreur
+    from .recherche import livraisons_en_attente
+
+    params = params or parametres()
+    debut = time.perf_counter()
+    regroupement.cloturer_lots_echus()
+    liberees = liberer_propositions_expirees(params)
+
+    # Une course par lot : les livraisons groupées vont au même livreur
+    courses = {}
+    for livraison in livraisons_en_attente().filter(boutique_point__isnull=False):
+        cle = ('lot', livraison.lot_id) if livraison.lot_id else ('livraison', livraison.id)
+        courses.setdefault(cle, []).append(livraison)
+    courses = list(courses.values())
+
+    livreurs = [
+        livreur for livreur in _livreurs_disponibles()
+        if livreur.charge < params['capacite']
+    ]
+    statistiques = {
+        'liberees': liberees,
+        'livraisons': sum(len(course) for course in courses),
+        'livreurs': len(livreurs),
+        'attribuees': 0,
+        'distance_totale_km': 0.0,
+    }
+    if not courses or not livreurs:
+        statistiques['duree_ms'] = round((time.perf_counter() - debut) * 1000, 1)
+        return statistiques
+
+    rang_livreur = {livreur.id: indice for indice, livreur in enumerate(livreurs)}
+    interdits = set()
+    refus = cache.get_many([_cle_refus(livraison.id) for course in courses for livraison in course])
+    for indice, course in enumerate(courses):
+        for livraison in course:
+            for livreur_id in refus.get(_cle_refus(livraison.id), ()):
+                if livreur_id in rang_livreur:
+                    interdits.add((indice, rang_livreur[livreur_id]))
+
+    couts, distances, places = matrice_couts(
+        (
+            [course[0].boutique_point.y for course in courses],
+            [course[0].boutique_point.x for course in courses],
+        ),
+        (
+            [livreur.position_actuelle.y for livreur in livreurs],
+            [livreur.position_actuelle.x for livreur in livreurs],
+            [float(livreur.note_moyenne) for livreur in livreurs],
+            [livreur.charge for livreur in livreurs],
+        ),
+        params,
+        interdits,
+    )
+    couples = attribuer(couts, places)
+
+    notifications = []
+    for i, j in couples:
+        course, livreur = courses[i], livreurs[j]
+        # Une livraison acceptée entre-temps par un autre livreur est ignorée
+        course = [livraison for livraison in course if livraison.assigner_livreur(livreur)]
+        if not course:
+            continue
+        distance_km = float(distances[i, j]) / 1000
+        statistiques['distance_totale_km'] += distance_km
+        statistiques['attribuees'] += len(course)
+        references = ', '.join(livraison.commande.reference for livraison in course)
+        if len(course) == 1:
+            titre = 'Livraison proposée'
+            message = f"La livraison {references} vous est proposée"
+        else:
+            titre = f'{len(course)} livraisons groupées proposées'
+            message = f"Les livraisons {references}, de la même boutique, vous sont proposées"
+        notifications.append(NotificationLivreur(
+            livreur=livreur,
+            type_notification='nouvelle_livraison',
+            titre=titre,
+            message=f"{message}, à {distance_km:.1f} km de votre position.",
+            donnees_supplementaires={
+                'livraison_id': course[0].id,
+                'livraison_ids': [livraison.id for livraison in course],
+                'lot_id': course[0].lot_id,
+                'commande_id': course[0].commande.id,
+                'distance_km': round(distance_km, 1),
+                'proposition': True,
+            }
+        ))
+    NotificationLivreur.objects.bulk_create(notifications)
+
+    statistiques['distance_totale_km'] = round(statistiques['distance_totale_km'], 2)
+    statistiques['duree_ms'] = round((time.perf_counter() - debut) * 1000, 1)
+    return statistiques
@@ -0,0 +1,60 @@
+"""
+Calcul de distances géodésiques (formule de haversine).
+
+Toutes les distances sont en mètres. Les fonctions vectorisées prennent des
+tableaux NumPy de latitudes et longitudes en degrés : classer 1 000
+livraisons par rapport à un livreur est un seul appel, pas 1 000 appels
+GEOS. À l'échelle d'une ville, l'écart avec l'ellipsoïde reste sous 0,5 %.
+"""
+import math
+
+import numpy as np
+
+RAYON_TERRE_M = 6371008.8
+
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Distance entre deux points (scalaires)"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * RAYON_TERRE_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_points(point1, point2):
+    """Distance entre deux Point GEOS (x = longitude, y = latitude), None si l'un manque"""
+    if point1 is None or point2 is None:
+        return None
+    return haversine_m(point1.y, point1.x, point2.y, point2.x)
+
+
+def _haversine(phi1, lambda1, phi2, lambda2):
+    a = (
+        np.sin((phi2 - phi1) / 2) ** 2 +
+        np.cos(phi1) * np.cos(phi2) * np.sin((lambda2 - lambda1) / 2) ** 2
+    )
+    return 2 * RAYON_TERRE_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def un_vers_plusieurs(lat, lng, lats, lngs):
+    """Distances d'un point vers n points : tableau de forme (n,)"""
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lngs = np.radians(np.asarray(lngs, dtype=float))
+    return _haversine(math.radians(lat), math.radians(lng), lats, lngs)
+
+
+def matrice(lats1, lngs1, lats2, lngs2):
+    """Distances de n points vers m points : tableau de forme (n, m)"""
+    lats1 = np.radians(np.asarray(lats1, dtype=float))[:, np.newaxis]
+    lngs1 = np.radians(np.asarray(lngs1, dtype=float))[:, np.newaxis]
+    lats2 = np.radians(np.asarray(lats2, dtype=float))[np.newaxis, :]
+    lngs2 = np.radians(np.asarray(lngs2, dtype=float))[np.newaxis, :]
+    return _haversine(lats1, lngs1, lats2, lngs2)
+
+
+def coordonnees(points):
+    """Tableaux (latitudes, longitudes) d'une liste de Point GEOS"""
+    lats = np.fromiter((p.y for p in points), dtype=float, count=len(points))
+    lngs = np.fromiter((p.x for p in points), dtype=float, count=len(points))
+    return lats, lngs
@@ -0,0 +1,153 @@
+"""
+Heure d'arrivée estimée des livraisons en cours, recalculée au fil des
+positions.
+
+À chaque lot de positions conservé par le filtre GPS (voir positions.py),
+le temps restant de chaque livraison en cours du livreur est recalculé
+vers son adresse de remise, dont les coordonnées sont déjà en cache (voir
+geofences.zones_actives). Le recalcul n'a lieu que si le livreur s'est
+déplacé d'au moins ``distance_min_m`` ou si l'estimation a plus de
+``intervalle_max_s`` ; il n'est diffusé aux abonnés du suivi que si
+l'arrivée estimée a bougé d'au moins ``ecart_min_s``.
+
+La durée part du trajet routier (ou de la distance à vol d'oiseau sans
+graphe) et se corrige par la vitesse observée du livreur, moyenne
+glissante des vitesses de ses derniers fixes, bornée autour de la vitesse
+du trajet pour qu'un arrêt au feu ne repousse pas l'arrivée à l'infini.
+
+Les estimations sont gardées dans le cache par livraison ; rien n'est
+écrit en base.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import geofences, routage, suivi
+from .distances import haversine_m
+
+PREFIXE = 'tnv:eta:livraison:'
+PREFIXE_VITESSE = 'tnv:eta:vitesse:'
+DUREE_CACHE = 3600
+# Vitesse en ville sans graphe routier (km/h), comme calculer_distance_et_duree
+VITESSE_DEFAUT_KMH = 30
+# Poids du dernier fix dans la moyenne glissante des vitesses
+LISSAGE_VITESSE = 0.3
+
+PARAMETRES_DEFAUT = {
+    # Déplacement minimal avant recalcul (mètres)
+    'distance_min_m': 100,
+    # Âge maximal d'une estimation (secondes)
+    'intervalle_max_s': 60,
+    # Écart d'arrivée estimée justifiant une diffusion (secondes)
+    'ecart_min_s': 30,
+    # Bornes de la vitesse observée, en fraction de la vitesse du trajet
+    'facteur_min': 0.5,
+    'facteur_max': 1.5,
+}
+
+
+def parametres():
+    return {**PARAMETRES_DEFAUT, **getattr(settings, 'TNV_ETA', {})}
+
+
+def _cle(livraison_id):
+    return f"{PREFIXE}{livraison_id}"
+
+
+def lire(livraison_id):
+    """Dernière estimation d'une livraison, ou None"""
+    estimation = cache.get(_cle(livraison_id))
+    if estimation is None:
+        return None
+    return {
+        'duree_restante_s': estimation['duree_restante_s'],
+        'distance_restante_m': estimation['distance_restante_m'],
+        'arrivee_estimee': estimation['arrivee_estimee'].isoformat(),
+        'calculee_le': estimation['calculee_le'].isoformat(),
+    }
+
+
+def _vitesse_observee(livreur_id, fixes):
+    """Moyenne glissante des vitesses des fixes (km/h), None sans mesure"""
+    cle = f"{PREFIXE_VITESSE}{livreur_id}"
+    vitesse = cache.get(cle)
+    mesures = [fix['vitesse'] for fix in fixes if fix.get('vitesse') is not None]
+    for mesure in mesures:
+        vitesse = mesure if vitesse is None else LISSAGE_VITESSE * mesure + (1 - LISSAGE_VITESSE) * vitesse
+    if mesures:
+        cache.set(cle, vitesse, DUREE_CACHE)
+    return vitesse
+
+
+def estimer(latitude, longitude, destination, vitesse_kmh=None, params=None):
+    """(distance_m, duree_s) restants jusqu'à ``destination`` (latitude, longitude)"""
+    params = params or parametres()
+    reseau = routage.graphe()
+    trajet = reseau.trajet(latitude, longitude, *destination) if reseau else None
+    if trajet is None:
+        distance = haversine_m(latitude, longitude, *destination)
+        trajet = (distance, distance / (VITESSE_DEFAUT_KMH / 3.6))
+    distance_m, duree_s = trajet
+    if vitesse_kmh is None or distance_m <= 0 or duree_s <= 0:
+        return distance_m, duree_s
+
+    vitesse_trajet = distance_m / duree_s
+    vitesse = min(max(vitesse_kmh / 3.6, params['facteur_min'] * vitesse_trajet),
+                  params['facteur_max'] * vitesse_trajet)
+    return distance_m, distance_m / vitesse
+
+
+def mettre_a_jour(livreur_id, fixes):
+    """
+    Recalcule l'arrivée estimée des livraisons en cours du livreur à partir
+    de ses derniers fixes lissés et diffuse les changements notables.
+    Retourne les identifiants des livraisons dont l'estimation a été diffusée.
+    """
+    if not fixes:
+        return []
+    destinations = [
+        (livraison_id, (latitude, longitude))
+        for livraison_id, zone, latitude, longitude, _ in geofences.zones_actives(livreur_id)
+        if zone == 'remise'
+    ]
+    vitesse = _vitesse_observee(livreur_id, fixes)
+    if not destinations:
+        return []
+
+    params = parametres()
+    dernier = fixes[-1]
+    maintenant = dernier['timestamp']
+    diffusees = []
+    for livraison_id, destination in destinations:
+        precedente = cache.get(_cle(livraison_id))
+        if precedente is not None:
+            deplacement = haversine_m(dernier['latitude'], dernier['longitude'], *precedente['position'])
+            age = (maintenant - precedente['calculee_le']).total_seconds()
+            if deplacement < params['distance_min_m'] and age < params['intervalle_max_s']:
+                continue
+
+        distance_m, duree_s = estimer(dernier['latitude'], dernier['longitude'], destination, vitesse, params)
+        estimation = {
+            'duree_restante_s': int(round(duree_s)),
+            'distance_restante_m': int(round(distance_m)),
+            'arrivee_estimee': maintenant + timedelta(seconds=duree_s),
+            'calculee_le': maintenant,
+            'position': (dernier['latitude'], dernier['longitude']),
+            'diffusee': precedente['diffusee'] if precedente else None,
+        }
+        diffuser = (
+            estimation['diffusee'] is None or
+            abs((estimation['arrivee_estimee'] - estimation['diffusee']).total_seconds()) >= params['ecart_min_s']
+        )
+        if diffuser:
+            estimation['diffusee'] = estimation['arrivee_estimee']
+        cache.set(_cle(livraison_id), estimation, DUREE_CACHE)
+        if diffuser:
+            suivi.publier_eta(livraison_id, lire(livraison_id))
+            diffusees.append(livraison_id)
+    return diffusees
+
+
+def oublier(livraison_id):
+    cache.delete(_cle(livraison_id))
@@ -0,0 +1,142 @@
+"""
+Filtrage des positions GPS avant leur enregistrement dans l'historique.
+
+Chaque fix est d'abord lissé par un filtre de Kalman simple (un état par
+livreur, la précision annoncée par le téléphone servant de bruit de
+mesure). Le fix lissé n'est ensuite conservé que si le livreur s'est
+suffisamment déplacé ou si assez de temps s'est écoulé depuis le dernier
+fix conservé. La vitesse est calculée entre deux fixes conservés.
+
+L'état du filtre est gardé dans le cache partagé entre deux lots.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .distances import haversine_m
+
+PREFIXE = 'tnv:filtre_gps:'
+DUREE_ETAT = 3600
+
+PARAMETRES_DEFAUT = {
+    # Déplacement minimal pour conserver un fix (mètres)
+    'distance_min_m': 15,
+    # Écart minimal entre deux fixes conservés (secondes)
+    'intervalle_min_s': 2,
+    # Au-delà, un fix est conservé même immobile (secondes)
+    'intervalle_max_s': 60,
+    # Fixes moins précis que ce seuil ignorés (mètres)
+    'precision_max_m': 100,
+    # Précision supposée quand le téléphone n'en fournit pas (mètres)
+    'precision_defaut_m': 15,
+    # Incertitude ajoutée par seconde écoulée (mètres / seconde)
+    'bruit_processus_m_s': 3,
+}
+
+
+def parametres():
+    return {**PARAMETRES_DEFAUT, **getattr(settings, 'TNV_FILTRE_GPS', {})}
+
+
+def _cle(livreur_id):
+    return f"{PREFIXE}{livreur_id}"
+
+
+class FiltreGPS:
+    """Lissage et décimation des fixes d'un livreur"""
+
+    def __init__(self, etat=None, params=None):
+        self.params = params or parametres()
+        etat = etat or {}
+        # Estimation lissée courante
+        self.lat = etat.get('lat')
+        self.lng = etat.get('lng')
+        self.variance = etat.get('variance')
+        self.timestamp = etat.get('timestamp')
+        # Dernier fix conservé dans l'historique : (lat, lng, timestamp)
+        self.garde = etat.get('garde')
+
+    def etat(self):
+        return {
+            'lat': self.lat,
+            'lng': self.lng,
+            'variance': self.variance,
+            'timestamp': self.timestamp,
+            'garde': self.garde,
+        }
+
+    def _lisser(self, fix):
+        precision = fix.get('precision') or self.params['precision_defaut_m']
+        mesure = precision ** 2
+        if self.variance is None or self.timestamp is None:
+            self.lat, self.lng, self.variance = fix['latitude'], fix['longitude'], mesure
+        else:
+            dt = max((fix['timestamp'] - self.timestamp).total_seconds(), 0)
+            self.variance += dt * self.params['bruit_processus_m_s'] ** 2
+            gain = self.variance / (self.variance + mesure)
+            self.lat += gain * (fix['latitude'] - self.lat)
+            self.lng += gain * (fix['longitude'] - self.lng)
+            self.variance *= (1 - gain)
+        self.timestamp = fix['timestamp']
+
+    def traiter(self, fix):
+        """
+        Lisse un fix. Retourne le fix lissé, avec sa vitesse (km/h), s'il doit
+        être conservé dans l'historique, None sinon.
+        """
+        precision = fix.get('precision')
+        if precision is not None and precision > self.params['precision_max_m']:
+            return None
+
+        self._lisser(fix)
+        lisse = {
+            'latitude': self.lat,
+            'longitude': self.lng,
+            'timestamp': fix['timestamp'],
+            'vitesse': None,
+        }
+
+        if self.garde is None:
+            self.garde = (self.lat, self.lng, fix['timestamp'])
+            return lisse
+
+        lat, lng, timestamp = self.garde
+        dt = (fix['timestamp'] - timestamp).total_seconds()
+        if dt < self.params['intervalle_min_s']:
+            return None
+        distance = haversine_m(lat, lng, self.lat, self.lng)
+        if distance < self.params['distance_min_m'] and dt < self.params['intervalle_max_s']:
+            return None
+
+        lisse['vitesse'] = round(distance / dt * 3.6, 1)
+        self.garde = (self.lat, self.lng, fix['timestamp'])
+        return lisse
+
+
+def filtrer(livreur_id, fixes, dernier_garde=None):
+    """
+    Applique le filtre d'un livreur à des fixes triés par timestamp.
+
+    ``dernier_garde`` (lat, lng, timestamp) amorce le filtre quand son état
+    n'est plus dans le cache. Retourne (fixes conservés, dernier fix lissé).
+    """
+    etat = cache.get(_cle(livreur_id))
+    if etat is None and dernier_garde is not None:
+        etat = {'garde': dernier_garde}
+    filtre = FiltreGPS(etat)
+
+    conserves = []
+    for fix in fixes:
+        lisse = filtre.traiter(fix)
+        if lisse is not None:
+            conserves.append(lisse)
+
+    cache.set(_cle(livreur_id), filtre.etat(), DUREE_ETAT)
+
+    courant = None
+    if filtre.timestamp is not None:
+        courant = {
+            'latitude': filtre.lat,
+            'longitude': filtre.lng,
+            'timestamp': filtre.timestamp,
+        }
+    return conserves, courant
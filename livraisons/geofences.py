@@ -0,0 +1,119 @@
+"""
+Zones d'arrivée (geofences) des livraisons actives d'un livreur.
+
+Une livraison acceptée a pour zone sa boutique : y arriver, c'est récupérer
+le colis, la livraison peut commencer. Une livraison en cours a pour zone
+son adresse de remise : elle peut être terminée. Les zones actives de
+chaque livreur sont gardées dans le cache et invalidées à chaque changement
+de statut, comme les livraisons suivies (voir suivi.py) ; évaluer un fix
+revient à un calcul de distance par livraison active, sans requête, ce qui
+permet de le faire pendant l'ingestion des positions.
+
+L'entrée dans une zone émet un événement, une seule fois par livraison et
+par zone : il est renvoyé au livreur dans la réponse de l'ingestion et
+publié aux abonnés du suivi. En mode automatique
+(``TNV_GEOFENCES['automatique']``), la transition est aussi appliquée par
+l'UPDATE conditionnel du modèle ; sinon l'application la propose au livreur.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from . import suivi
+from .distances import haversine_m
+
+PREFIXE = 'tnv:geofences:livreur:'
+PREFIXE_ENTREE = 'tnv:geofences:entree:'
+DUREE_CACHE = 300
+# Une entrée déjà signalée ne l'est plus pendant cette durée (secondes)
+DUREE_ENTREE = 12 * 3600
+
+PARAMETRES_DEFAUT = {
+    # Rayon des zones d'arrivée, en mètres
+    'rayon_m': 75,
+    # Appliquer les transitions sans attendre le livreur
+    'automatique': False,
+}
+
+# Statut de la livraison : (zone, action proposée à l'arrivée)
+ZONES = {
+    'acceptee': ('boutique', 'commencer'),
+    'en_cours': ('remise', 'terminer'),
+}
+
+
+def parametres():
+    return {**PARAMETRES_DEFAUT, **getattr(settings, 'TNV_GEOFENCES', {})}
+
+
+def _cle(livreur_id):
+    return f"{PREFIXE}{livreur_id}"
+
+
+def zones_actives(livreur_id):
+    """[(livraison_id, zone, latitude, longitude, action)] des livraisons acceptées ou en cours"""
+    from .models import Livraison
+    zones = cache.get(_cle(livreur_id))
+    if zones is None:
+        zones = []
+        livraisons = Livraison.objects.filter(
+            livreur_id=livreur_id,
+            statut__in=ZONES
+        ).values_list('id', 'statut', 'boutique_point', 'adresse_livraison_point')
+        for livraison_id, statut, boutique_point, adresse_point in livraisons:
+            zone, action = ZONES[statut]
+            point = boutique_point if zone == 'boutique' else adresse_point
+            if point is not None:
+                zones.append((livraison_id, zone, point.y, point.x, action))
+        cache.set(_cle(livreur_id), zones, DUREE_CACHE)
+    return zones
+
+
+def invalider(livreur_id):
+    cache.delete(_cle(livreur_id))
+
+
+def _appliquer(livreur_id, livraison_id, action):
+    from .models import Livraison
+    livraison = Livraison.objects.select_related('commande').filter(
+        id=livraison_id, livreur_id=livreur_id
+    ).first()
+    if livraison is None:
+        return False
+    if action == 'commencer':
+        return livraison.commencer_livraison()
+    return livraison.terminer_livraison()
+
+
+def evaluer(livreur_id, fixes):
+    """
+    Détecte les entrées dans les zones actives du livreur pour des fixes
+    lissés. Retourne les événements émis
+    [{'livraison_id', 'zone', 'action', 'distance_m', 'timestamp', 'appliquee'}].
+    """
+    zones = zones_actives(livreur_id)
+    if not zones or not fixes:
+        return []
+
+    params = parametres()
+    evenements = []
+    for fix in fixes:
+        for livraison_id, zone, latitude, longitude, action in zones:
+            distance = haversine_m(fix['latitude'], fix['longitude'], latitude, longitude)
+            if distance > params['rayon_m']:
+                continue
+            if not cache.add(f"{PREFIXE_ENTREE}{livraison_id}:{zone}", True, DUREE_ENTREE):
+                continue
+            evenements.append({
+                'livraison_id': livraison_id,
+                'zone': zone,
+                'action': action,
+                'distance_m': round(distance),
+                'timestamp': fix['timestamp'],
+                'appliquee': False,
+            })
+
+    for evenement in evenements:
+        if params['automatique']:
+            evenement['appliquee'] = _appliquer(livreur_id, evenement['livraison_id'], evenement['action'])
+        suivi.publier_arrivee(evenement['livraison_id'], evenement['zone'], evenement['timestamp'])
+    return evenements
@@ -0,0 +1,70 @@
+"""
+Points géographiques d'une livraison : adresse de remise et boutique.
+
+Ils sont calculés une fois, à la création de la livraison, à partir des
+coordonnées de la commande et du commerçant ; les lectures (carte,
+recherche, tuiles) n'écrivent jamais. Les livraisons plus anciennes sont
+complétées par la commande ``materialiser_points``.
+"""
+from decimal import Decimal
+
+from django.contrib.gis.geos import Point
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Livraison
+
+COUT_LIVRAISON_DEFAUT = Decimal('500.00')
+
+
+def point(latitude, longitude):
+    """Point WGS 84, ou None si les coordonnées sont absentes, nulles ou invalides"""
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if latitude == 0 or longitude == 0:
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return Point(longitude, latitude, srid=4326)
+
+
+def points_commande(commande):
+    """{'adresse_livraison_point': ..., 'boutique_point': ...} d'une commande"""
+    commercant = commande.commercant
+    return {
+        'adresse_livraison_point': point(commande.latitude_livraison, commande.longitude_livraison),
+        'boutique_point': point(commercant.latitude, commercant.longitude) if commercant else None,
+    }
+
+
+def completer_points(livraison):
+    """
+    Renseigne les points manquants d'une livraison sans l'enregistrer.
+    Retourne les champs modifiés.
+    """
+    modifies = []
+    for champ, valeur in points_commande(livraison.commande).items():
+        if getattr(livraison, champ) is None and valeur is not None:
+            setattr(livraison, champ, valeur)
+            modifies.append(champ)
+    return modifies
+
+
+def livraison_pour_commande(commande):
+    """
+    Livraison d'une commande validée, créée avec ses points si elle
+    n'existe pas encore. Retourne (livraison, creee).
+    """
+    with transaction.atomic():
+        return Livraison.objects.get_or_create(
+            commande=commande,
+            defaults={
+                'statut': 'attribuee',
+                'date_attribution': timezone.now(),
+                'cout_livraison': COUT_LIVRAISON_DEFAUT,
+                'instructions_speciales': commande.instructions_livraison,
+                **points_commande(commande),
+            }
+        )
@@ -0,0 +1,195 @@
+"""
+Index spatial en mémoire des livreurs en ligne et disponibles.
+
+Les positions sont rangées dans une grille de cellules de taille fixe
+(en degrés). La recherche des k livreurs les plus proches dans un rayon ne
+parcourt que les cellules couvrant ce rayon, sans requête PostGIS.
+
+L'index est propre à chaque processus : il est reconstruit depuis la base
+au premier accès, tenu à jour par les signaux du modèle Livreur, et
+confronté périodiquement à la base pour rattraper les mises à jour faites
+par les autres processus.
+"""
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from . import presence
+from .distances import un_vers_plusieurs
+
+KM_PAR_DEGRE = 111.32
+
+
+def livreur_indexable(livreur):
+    """
+    Un livreur figure dans l'index s'il est actif, disponible, localisé et
+    en ligne (d'après ses battements de cœur, voir presence.py)
+    """
+    return bool(
+        livreur.est_actif and livreur.est_disponible and
+        livreur.position_actuelle and presence.est_en_ligne(livreur.id)
+    )
+
+
+class GrilleLivreurs:
+    """Grille de cellules livreur_id -> (latitude, longitude)"""
+
+    def __init__(self, taille_cellule_km=1.0, intervalle_verification=300):
+        self.taille = taille_cellule_km / KM_PAR_DEGRE
+        self.intervalle_verification = intervalle_verification
+        self._positions = {}
+        self._cellules = defaultdict(set)
+        self._verrou = threading.RLock()
+        self._initialisee = False
+        self._derniere_verification = 0.0
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, livreur_id):
+        return livreur_id in self._positions
+
+    def _cellule(self, lat, lng):
+        return (math.floor(lat / self.taille), math.floor(lng / self.taille))
+
+    def mettre_a_jour(self, livreur_id, lat, lng):
+        """Insère ou déplace un livreur"""
+        with self._verrou:
+            ancienne = self._positions.get(livreur_id)
+            nouvelle_cellule = self._cellule(lat, lng)
+            if ancienne is not None:
+                ancienne_cellule = self._cellule(*ancienne)
+                if ancienne_cellule != nouvelle_cellule:
+                    self._retirer_de_cellule(livreur_id, ancienne_cellule)
+            self._positions[livreur_id] = (lat, lng)
+            self._cellules[nouvelle_cellule].add(livreur_id)
+
+    def retirer(self, livreur_id):
+        with self._verrou:
+            ancienne = self._positions.pop(livreur_id, None)
+            if ancienne is not None:
+                self._retirer_de_cellule(livreur_id, self._cellule(*ancienne))
+
+    def _retirer_de_cellule(self, livreur_id, cellule):
+        membres = self._cellules.get(cellule)
+        if membres is not None:
+            membres.discard(livreur_id)
+            if not membres:
+                del self._cellules[cellule]
+
+    def synchroniser_livreur(self, livreur):
+        """Reflète l'état d'un livreur (après sauvegarde) dans l'index"""
+        if livreur_indexable(livreur):
+            self.mettre_a_jour(livreur.id, livreur.position_actuelle.y, livreur.position_actuelle.x)
+        else:
+            self.retirer(livreur.id)
+
+    def proches(self, lat, lng, rayon_km=10, k=5):
+        """
+        Retourne au plus k couples (livreur_id, distance_m) dans le rayon,
+        triés par distance croissante.
+        """
+        self._assurer_a_jour()
+        n_lat = math.ceil((rayon_km / KM_PAR_DEGRE) / self.taille)
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        n_lng = math.ceil((rayon_km / (KM_PAR_DEGRE * cos_lat)) / self.taille)
+        c_lat, c_lng = self._cellule(lat, lng)
+        rayon_m = rayon_km * 1000
+
+        ids, lats, lngs = [], [], []
+        with self._verrou:
+            for i in range(c_lat - n_lat, c_lat + n_lat + 1):
+                for j in range(c_lng - n_lng, c_lng + n_lng + 1):
+                    membres = self._cellules.get((i, j))
+                    if not membres:
+                        continue
+                    for livreur_id in membres:
+                        p_lat, p_lng = self._positions[livreur_id]
+                        ids.append(livreur_id)
+                        lats.append(p_lat)
+                        lngs.append(p_lng)
+
+        # Les livreurs dont le battement a expiré depuis leur indexation sont écartés
+        presents = presence.en_ligne(ids)
+        if len(presents) < len(ids):
+            for livreur_id in set(ids) - presents:
+                self.retirer(livreur_id)
+            gardes = [indice for indice, livreur_id in enumerate(ids) if livreur_id in presents]
+            ids = [ids[indice] for indice in gardes]
+            lats = [lats[indice] for indice in gardes]
+            lngs = [lngs[indice] for indice in gardes]
+
+        if not ids:
+            return []
+        distances = un_vers_plusieurs(lat, lng, lats, lngs)
+        ordre = distances.argsort()[:k]
+        return [
+            (ids[indice], float(distances[indice]))
+            for indice in ordre
+            if distances[indice] <= rayon_m
+        ]
+
+    def _livreurs_en_base(self):
+        from . import tampon_positions
+        from .models import Livreur
+        en_base = {
+            livreur_id: (position.y, position.x)
+            for livreur_id, position in Livreur.objects.filter(
+                id__in=presence.livreurs_en_ligne(),
+                est_actif=True,
+                est_disponible=True,
+                position_actuelle__isnull=False
+            ).values_list('id', 'position_actuelle')
+        }
+        # Les positions pas encore écrites en base sont dans le tampon
+        for livreur_id, (lat, lng, _) in tampon_positions.positions(en_base).items():
+            en_base[livreur_id] = (lat, lng)
+        return en_base
+
+    def reconstruire(self):
+        """Recharge entièrement l'index depuis la base"""
+        positions = self._livreurs_en_base()
+        with self._verrou:
+            self._positions = {}
+            self._cellules = defaultdict(set)
+            for livreur_id, (lat, lng) in positions.items():
+                self.mettre_a_jour(livreur_id, lat, lng)
+            self._initialisee = True
+            self._derniere_verification = time.monotonic()
+
+    def verifier_coherence(self, corriger=True):
+        """
+        Compare l'index à la base. Retourne les écarts trouvés
+        (manquants, en_trop, deplaces) et les corrige si demandé.
+        """
+        en_base = self._livreurs_en_base()
+        with self._verrou:
+            en_index = dict(self._positions)
+        manquants = [i for i in en_base if i not in en_index]
+        en_trop = [i for i in en_index if i not in en_base]
+        deplaces = [
+            i for i in en_base
+            if i in en_index and en_base[i] != en_index[i]
+        ]
+        if corriger:
+            for livreur_id in en_trop:
+                self.retirer(livreur_id)
+            for livreur_id in manquants + deplaces:
+                self.mettre_a_jour(livreur_id, *en_base[livreur_id])
+            self._derniere_verification = time.monotonic()
+        return {'manquants': manquants, 'en_trop': en_trop, 'deplaces': deplaces}
+
+    def _assurer_a_jour(self):
+        if not self._initialisee:
+            self.reconstruire()
+        elif time.monotonic() - self._derniere_verification > self.intervalle_verification:
+            self.verifier_coherence(corriger=True)
+
+
+grille_livreurs = GrilleLivreurs(
+    taille_cellule_km=getattr(settings, 'TNV_INDEX_LIVREURS_CELLULE_KM', 1.0),
+    intervalle_verification=getattr(settings, 'TNV_INDEX_LIVREURS_VERIFICATION_S', 300),
+)
@@ -0,0 +1,47 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from livraisons import demande
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruit la carte de la demande (commandes par cellule hexagonale "
+        "et par quart d'heure) à partir des commandes, et purge les périodes anciennes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--heures', type=float, default=2,
+            help="Périodes closes à reconstruire, en heures (défaut : 2)"
+        )
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help="Reconstruire en continu"
+        )
+        parser.add_argument(
+            '--intervalle', type=int, default=900,
+            help="Intervalle entre deux passages en secondes (défaut : 900)"
+        )
+
+    def _agreger(self, heures):
+        cellules = demande.reconstruire(timezone.now() - timedelta(hours=heures))
+        supprimees = demande.purger()
+        self.stdout.write(f"{cellules} cellule(s) reconstruite(s), {supprimees} cellule(s) ancienne(s) purgée(s).")
+
+    def handle(self, *args, **options):
+        if not options['boucle']:
+            self._agreger(options['heures'])
+            return
+
+        self.stdout.write(f"Reconstruction toutes les {options['intervalle']} s (Ctrl+C pour arrêter).")
+        try:
+            while True:
+                self._agreger(options['heures'])
+                time.sleep(options['intervalle'])
+        except KeyboardInterrupt:
+            pass
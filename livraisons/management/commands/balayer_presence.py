@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from livraisons import presence
+
+
+class Command(BaseCommand):
+    help = (
+        "Recopie la présence des livreurs (battements de cœur) dans "
+        "Livreur.est_en_ligne : les livreurs sans battement récent passent hors ligne"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help="Balayer en continu"
+        )
+        parser.add_argument(
+            '--intervalle', type=int, default=30,
+            help="Intervalle entre deux balayages en secondes (défaut : 30)"
+        )
+
+    def _balayer(self, silencieux=False):
+        connectes, deconnectes = presence.balayer()
+        if not silencieux or connectes or deconnectes:
+            self.stdout.write(f"{connectes} livreur(s) en ligne, {deconnectes} passé(s) hors ligne.")
+
+    def handle(self, *args, **options):
+        if not options['boucle']:
+            self._balayer()
+            return
+
+        self.stdout.write(f"Balayage toutes les {options['intervalle']} s (Ctrl+C pour arrêter).")
+        try:
+            while True:
+                self._balayer(silencieux=True)
+                time.sleep(options['intervalle'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from livraisons import dispatch
+
+# Centre de Lomé
+CENTRE = (6.1375, 1.2125)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare l'attribution optimale à l'attribution gloutonne (premier "
+        "arrivé) sur des livraisons et livreurs tirés au hasard autour de Lomé"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--livraisons', type=int, default=1000)
+        parser.add_argument('--livreurs', type=int, default=500)
+        parser.add_argument(
+            '--etalement-km', type=float, default=5.0,
+            help="Écart-type de la dispersion autour du centre (défaut : 5 km)"
+        )
+        parser.add_argument('--graine', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generateur = np.random.default_rng(options['graine'])
+        etalement = options['etalement_km'] / 111.32
+
+        def points(nombre):
+            return (
+                CENTRE[0] + generateur.normal(0, etalement, nombre),
+                CENTRE[1] + generateur.normal(0, etalement, nombre),
+            )
+
+        n, m = options['livraisons'], options['livreurs']
+        boutiques = points(n)
+        l_lats, l_lngs = points(m)
+        livreurs = (
+            l_lats, l_lngs,
+            generateur.uniform(3, 5, m).round(2),
+            generateur.integers(0, 2, m),
+        )
+        # Points tirés au hasard : distances à vol d'oiseau, sans graphe routier
+        params = {**dispatch.parametres(), 'routage': False}
+
+        debut = time.perf_counter()
+        couts, distances, places = dispatch.matrice_couts(boutiques, livreurs, params)
+        duree_matrice = (time.perf_counter() - debut) * 1000
+        self.stdout.write(
+            f"{n} livraisons x {m} livreurs ({couts.shape[1]} places), "
+            f"matrice construite en {duree_matrice:.0f} ms"
+        )
+
+        solveurs = [('Couplage optimal', dispatch.resoudre), ('Glouton', dispatch.glouton)]
+        try:
+            import scipy  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            solveurs.insert(1, ('Enchères (sans SciPy)', dispatch.resoudre_par_encheres))
+
+        for nom, solveur in solveurs:
+            debut = time.perf_counter()
+            couples = dispatch.attribuer(couts, places, solveur)
+            duree = (time.perf_counter() - debut) * 1000
+            total = sum(float(distances[i, j]) for i, j in couples) / 1000
+            moyenne = total / len(couples) if couples else 0
+            self.stdout.write(
+                f"{nom:<24} {len(couples):>5} attribuées  "
+                f"distance totale {total:>9.1f} km  moyenne {moyenne:5.2f} km  "
+                f"résolution {duree:>7.0f} ms"
+            )
+
@@ -0,0 +1,51 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from livraisons import tournees
+
+# Au-delà, la solution exacte devient trop longue à calculer
+ARRETS_MAX_EXACT = 12
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le temps de calcul et la qualité de l'ordonnancement des "
+        "arrêts sur des tournées tirées au hasard autour de Lomé"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--arrets', type=int, nargs='+', default=[5, 10, 20],
+            help="Nombres d'arrêts à tester (défaut : 5 10 20)"
+        )
+        parser.add_argument('--instances', type=int, default=20)
+        parser.add_argument('--graine', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generateur = np.random.default_rng(options['graine'])
+        self.stdout.write(
+            f"{'Arrêts':>6}  {'Temps moyen':>11}  {'Temps max':>9}  "
+            f"{'Écart / optimum':>17}  {'Gain / ordre naïf':>17}"
+        )
+        for nombre in options['arrets']:
+            temps, ecarts, gains = [], [], []
+            for _ in range(options['instances']):
+                durees, demandes = tournees.instance_aleatoire(nombre, generateur)
+                debut = time.perf_counter()
+                sequence = tournees.optimiser(durees, demandes)
+                temps.append((time.perf_counter() - debut) * 1000)
+
+                cout = tournees.cout_sequence(sequence, durees)
+                naif = tournees.cout_sequence(tournees.sequence_naive(demandes), durees)
+                gains.append(1 - cout / naif)
+                if nombre <= ARRETS_MAX_EXACT:
+                    optimum = tournees.cout_sequence(tournees.sequence_exacte(durees, demandes), durees)
+                    ecarts.append(cout / optimum - 1)
+
+            ecart = f"{np.mean(ecarts) * 100:16.2f}%" if ecarts else f"{'-':>17}"
+            self.stdout.write(
+                f"{nombre:>6}  {np.mean(temps):>8.1f} ms  {max(temps):>6.1f} ms  "
+                f"{ecart}  {np.mean(gains) * 100:16.1f}%"
+            )
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from livraisons import dispatch
+
+
+class Command(BaseCommand):
+    help = "Attribue les livraisons en attente aux livreurs disponibles par couplage de coût minimal"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help="Relancer l'attribution en continu"
+        )
+        parser.add_argument(
+            '--intervalle', type=int, default=None,
+            help="Intervalle entre deux passages en secondes (défaut : TNV_DISPATCH['intervalle_s'])"
+        )
+
+    def handle(self, *args, **options):
+        params = dispatch.parametres()
+        if not options['boucle']:
+            self._afficher(dispatch.dispatcher(params))
+            return
+
+        intervalle = options['intervalle'] or params['intervalle_s']
+        self.stdout.write(f"Attribution toutes les {intervalle} s (Ctrl+C pour arrêter).")
+        try:
+            while True:
+                statistiques = dispatch.dispatcher(params)
+                if statistiques['attribuees'] or statistiques['liberees']:
+                    self._afficher(statistiques)
+                time.sleep(intervalle)
+        except KeyboardInterrupt:
+            pass
+
+    def _afficher(self, statistiques):
+        self.stdout.write(
+            f"{statistiques['attribuees']} livraison(s) proposée(s) sur {statistiques['livraisons']} "
+            f"en attente, {statistiques['livreurs']} livreur(s) disponible(s), "
+            f"{statistiques['liberees']} proposition(s) expirée(s) ; "
+            f"distance totale {statistiques['distance_totale_km']} km en {statistiques['duree_ms']} ms."
+        )
@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from livraisons import partitions
+from livraisons.models import PositionLivreur
+
+
+class Command(BaseCommand):
+    help = (
+        "Crée les partitions mensuelles à venir de l'historique des positions "
+        "et supprime ou archive celles qui dépassent la durée de rétention"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mois-avance', type=int, default=3,
+            help="Nombre de mois futurs pour lesquels créer une partition (défaut : 3)"
+        )
+        parser.add_argument(
+            '--retention', type=int, default=None,
+            help="Durée de rétention en jours (défaut : TNV_RETENTION_POSITIONS_JOURS)"
+        )
+        parser.add_argument(
+            '--archiver', action='store_true',
+            help="Déplacer les partitions expirées dans le schéma d'archives au lieu de les supprimer"
+        )
+        parser.add_argument(
+            '--simulation', action='store_true',
+            help="Afficher les opérations sans les exécuter"
+        )
+
+    def handle(self, *args, **options):
+        retention = options['retention']
+        if retention is None:
+            retention = partitions.retention_jours()
+
+        if not partitions.est_partitionnee(connection):
+            self._purger_table_simple(retention, options['simulation'])
+            return
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if options['simulation']:
+                existantes = partitions.partitions_mensuelles(cursor)
+                self.stdout.write(f"Partitions existantes : {', '.join(sorted(existantes.values())) or 'aucune'}")
+            else:
+                for nom in partitions.creer_partitions_futures(cursor, options['mois_avance']):
+                    self.stdout.write(f"Partition créée : {nom}")
+
+            action = 'archivée' if options['archiver'] else 'supprimée'
+            for nom in partitions.partitions_expirees(cursor, retention):
+                if not options['simulation']:
+                    partitions.retirer_partition(cursor, nom, archiver=options['archiver'])
+                self.stdout.write(f"Partition {action} : {nom}")
+
+    def _purger_table_simple(self, retention, simulation, taille_lot=5000):
+        """Sans partitionnement : suppression des lignes expirées par lots"""
+        limite = timezone.now() - timedelta(days=retention)
+        expirees = PositionLivreur.objects.filter(timestamp__lt=limite)
+        if simulation:
+            self.stdout.write(f"{expirees.count()} position(s) à supprimer.")
+            return
+
+        total = 0
+        while True:
+            ids = list(expirees.values_list('pk', flat=True)[:taille_lot])
+            if not ids:
+                break
+            PositionLivreur.objects.filter(pk__in=ids).delete()
+            total += len(ids)
+        self.stdout.write(f"{total} position(s) supprimée(s).")
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from livraisons.geometrie import completer_points
+from livraisons.models import Livraison
+
+
+class Command(BaseCommand):
+    help = (
+        "Complète, par lots, les points (adresse de remise, boutique) des "
+        "livraisons créées avant leur calcul à la création"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--taille-lot', type=int, default=500,
+            help="Nombre de livraisons lues et écrites par lot (défaut : 500)"
+        )
+        parser.add_argument(
+            '--simulation',
+            action='store_true',
+            help="Compter les livraisons à compléter sans rien écrire"
+        )
+
+    def handle(self, *args, **options):
+        incompletes = Livraison.objects.filter(
+            Q(adresse_livraison_point__isnull=True) | Q(boutique_point__isnull=True)
+        ).select_related('commande', 'commande__commercant__user').order_by('id')
+
+        dernier_id, lues, completees = 0, 0, 0
+        while True:
+            lot = list(incompletes.filter(id__gt=dernier_id)[:options['taille_lot']])
+            if not lot:
+                break
+            dernier_id = lot[-1].id
+            lues += len(lot)
+
+            modifiees, champs = [], {'date_modification'}
+            maintenant = timezone.now()
+            for livraison in lot:
+                modifies = completer_points(livraison)
+                if modifies:
+                    livraison.date_modification = maintenant
+                    modifiees.append(livraison)
+                    champs.update(modifies)
+            completees += len(modifiees)
+
+            # bulk_update n'envoie pas de signaux : aucune notification n'est créée
+            if modifiees and not options['simulation']:
+                Livraison.objects.bulk_update(modifiees, sorted(champs))
+            self.stdout.write(f"{lues} livraison(s) lue(s), {completees} complétée(s)…")
+
+        verbe = "à compléter" if options['simulation'] else "complétée(s)"
+        self.stdout.write(self.style.SUCCESS(
+            f"{completees} livraison(s) {verbe} sur {lues} sans point."
+        ))
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from livraisons import routage
+
+
+class Command(BaseCommand):
+    help = (
+        "Prépare le graphe routier hors ligne (contraction hiérarchique) "
+        "à partir d'un extrait OpenStreetMap de la zone desservie"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichier_osm', help="Extrait OSM au format XML (.osm, .osm.gz ou .osm.bz2)")
+        parser.add_argument(
+            '--sortie', default=None,
+            help="Fichier .npz produit (défaut : TNV_ROUTAGE_GRAPHE)"
+        )
+
+    def handle(self, *args, **options):
+        sortie = options['sortie'] or getattr(settings, 'TNV_ROUTAGE_GRAPHE', None)
+        if not sortie:
+            raise CommandError("Indiquez --sortie ou définissez TNV_ROUTAGE_GRAPHE.")
+
+        debut = time.perf_counter()
+        try:
+            dimensions = routage.preparer(options['fichier_osm'], sortie)
+        except (OSError, KeyError) as e:
+            raise CommandError(f"Lecture de l'extrait impossible : {e}")
+        duree = time.perf_counter() - debut
+
+        self.stdout.write(
+            f"{dimensions['noeuds']} nœuds, {dimensions['arcs']} arcs, "
+            f"{dimensions['aretes']} arêtes après contraction ; "
+            f"graphe enregistré dans {sortie} en {duree:.0f} s."
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from livraisons import statistiques
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcule en bloc les agrégats des livreurs (livraisons, revenus, "
+        "évaluations) et signale les écarts avec les valeurs tenues à jour"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--corriger',
+            action='store_true',
+            help="Réécrire les agrégats des livreurs en écart"
+        )
+
+    def handle(self, *args, **options):
+        ecarts = statistiques.reconcilier(corriger=options['corriger'])
+        for livreur_id, differences in sorted(ecarts.items()):
+            detail = ", ".join(
+                f"{champ} {stocke} -> {attendu}" for champ, (stocke, attendu) in differences.items()
+            )
+            self.stdout.write(f"Livreur {livreur_id} : {detail}")
+
+        if not ecarts:
+            self.stdout.write(self.style.SUCCESS("Aucun écart."))
+        elif options['corriger']:
+            self.stdout.write(self.style.SUCCESS(f"{len(ecarts)} livreur(s) corrigé(s)."))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"{len(ecarts)} livreur(s) en écart (relancer avec --corriger pour corriger)."
+            ))
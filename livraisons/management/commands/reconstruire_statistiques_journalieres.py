@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from livraisons import statistiques
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconstruit les statistiques journalières des livreurs à partir de "
+        "l'historique des livraisons et des évaluations"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--jours', type=int, default=None,
+            help="Ne reconstruire que les N derniers jours (défaut : tout l'historique)"
+        )
+
+    def handle(self, *args, **options):
+        depuis = None
+        if options['jours'] is not None:
+            depuis = timezone.localdate() - timedelta(days=options['jours'] - 1)
+        nombre = statistiques.reconstruire_journees(depuis)
+        self.stdout.write(self.style.SUCCESS(f"{nombre} journée(s) de livreur reconstruite(s)."))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from livraisons import regroupement
+
+
+class Command(BaseCommand):
+    help = (
+        "Clôture les lots de livraisons dont la fenêtre de regroupement est "
+        "écoulée et notifie les livreurs proches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help="Clôturer les lots en continu"
+        )
+        parser.add_argument(
+            '--intervalle', type=int, default=5,
+            help="Intervalle entre deux passages en secondes (défaut : 5)"
+        )
+
+    def handle(self, *args, **options):
+        if not options['boucle']:
+            nombre = regroupement.cloturer_lots_echus()
+            self.stdout.write(f"{nombre} lot(s) rendu(s) disponible(s).")
+            return
+
+        self.stdout.write(f"Clôture des lots toutes les {options['intervalle']} s (Ctrl+C pour arrêter).")
+        try:
+            while True:
+                nombre = regroupement.cloturer_lots_echus()
+                if nombre:
+                    self.stdout.write(f"{nombre} lot(s) rendu(s) disponible(s).")
+                time.sleep(options['intervalle'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from livraisons import tampon_positions
+
+
+class Command(BaseCommand):
+    help = "Écrit en base les positions des livreurs conservées dans le tampon"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--boucle',
+            action='store_true',
+            help="Vider le tampon en continu, à l'intervalle TNV_TAMPON_POSITIONS_INTERVALLE"
+        )
+
+    def handle(self, *args, **options):
+        if not options['boucle']:
+            nombre = tampon_positions.vider()
+            self.stdout.write(f"{nombre} position(s) écrite(s) en base.")
+            return
+
+        intervalle = tampon_positions.intervalle_vidage()
+        self.stdout.write(f"Vidage du tampon toutes les {intervalle} s (Ctrl+C pour arrêter).")
+        try:
+            while True:
+                nombre = tampon_positions.vider()
+                if nombre:
+                    self.stdout.write(f"{nombre} position(s) écrite(s) en base.")
+                time.sleep(intervalle)
+        except KeyboardInterrupt:
+            tampon_positions.vider()
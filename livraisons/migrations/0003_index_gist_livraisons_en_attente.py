@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def creer_index(apps, schema_editor):
+    # Index GiST partiel limité aux livraisons en attente : la recherche KNN
+    # ne parcourt que le pool ouvert. SpatiaLite garde son index R*Tree.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS livraisons_attente_boutique_gist "
+        "ON livraisons_livraison USING gist (boutique_point) "
+        "WHERE livreur_id IS NULL AND statut = 'attribuee'"
+    )
+
+
+def supprimer_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS livraisons_attente_boutique_gist")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraisons', '0002_alter_livreur_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(creer_index, supprimer_index),
+    ]
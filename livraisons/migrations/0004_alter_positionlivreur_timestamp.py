@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraisons', '0003_index_gist_livraisons_en_attente'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='positionlivreur',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Timestamp'),
+        ),
+    ]
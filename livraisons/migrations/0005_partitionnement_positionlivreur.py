@@ -0,0 +1,106 @@
+from django.db import migrations
+from django.utils import timezone
+
+from livraisons.partitions import (
+    PARTITION_DEFAUT, TABLE, creer_partition, creer_partitions_futures,
+    debut_mois, mois_suivant,
+)
+
+ANCIENNE = f'{TABLE}_ancienne'
+SEQUENCE = f'{TABLE}_id_seq_partitions'
+
+
+def partitionner(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        # SpatiaLite : table simple, index ordinaire sur le timestamp
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {TABLE}_timestamp_idx ON {TABLE} ("timestamp")'
+        )
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE')
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {ANCIENNE}')
+        cursor.execute(f'CREATE SEQUENCE {SEQUENCE}')
+        cursor.execute(f'''
+            CREATE TABLE {TABLE} (
+                id bigint NOT NULL DEFAULT nextval('{SEQUENCE}'),
+                position geometry(Point, 4326) NOT NULL,
+                "timestamp" timestamp with time zone NOT NULL,
+                vitesse double precision NULL,
+                livreur_id bigint NOT NULL
+                    REFERENCES livraisons_livreur (id) DEFERRABLE INITIALLY DEFERRED,
+                CONSTRAINT {TABLE}_partitions_pkey PRIMARY KEY (id, "timestamp")
+            ) PARTITION BY RANGE ("timestamp")
+        ''')
+        cursor.execute(f'ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id')
+        cursor.execute(f'CREATE TABLE {PARTITION_DEFAUT} PARTITION OF {TABLE} DEFAULT')
+
+        # Une partition par mois couvert par l'historique existant
+        cursor.execute(f'SELECT min("timestamp"), max("timestamp") FROM {ANCIENNE}')
+        premier, dernier = cursor.fetchone()
+        if premier is not None:
+            mois = debut_mois(timezone.localtime(premier).date())
+            while mois <= timezone.localtime(dernier).date():
+                creer_partition(cursor, mois)
+                mois = mois_suivant(mois)
+        creer_partitions_futures(cursor)
+
+        cursor.execute(f'''
+            INSERT INTO {TABLE} (id, position, "timestamp", vitesse, livreur_id)
+            SELECT id, position, "timestamp", vitesse, livreur_id FROM {ANCIENNE}
+        ''')
+        cursor.execute(f"SELECT setval('{SEQUENCE}', coalesce(max(id), 0) + 1, false) FROM {TABLE}")
+        cursor.execute(f'DROP TABLE {ANCIENNE}')
+
+        # Index créés sur la table mère, hérités par chaque partition
+        cursor.execute(f'CREATE INDEX livraisons__livreur_654541_idx ON {TABLE} (livreur_id, "timestamp")')
+        cursor.execute(f'CREATE INDEX {TABLE}_position_id ON {TABLE} USING gist (position)')
+        cursor.execute(f'CREATE INDEX {TABLE}_timestamp_brin ON {TABLE} USING brin ("timestamp")')
+
+
+def departitionner(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {TABLE}_timestamp_idx')
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {ANCIENNE}')
+        cursor.execute(f'''
+            CREATE TABLE {TABLE} (
+                id bigint NOT NULL PRIMARY KEY GENERATED BY DEFAULT AS IDENTITY,
+                position geometry(Point, 4326) NOT NULL,
+                "timestamp" timestamp with time zone NOT NULL,
+                vitesse double precision NULL,
+                livreur_id bigint NOT NULL
+                    REFERENCES livraisons_livreur (id) DEFERRABLE INITIALLY DEFERRED
+            )
+        ''')
+        cursor.execute(f'''
+            INSERT INTO {TABLE} (id, position, "timestamp", vitesse, livreur_id)
+            SELECT id, position, "timestamp", vitesse, livreur_id FROM {ANCIENNE}
+        ''')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), coalesce(max(id), 0) + 1, false) "
+            f"FROM {TABLE}"
+        )
+        cursor.execute(f'DROP TABLE {ANCIENNE} CASCADE')
+        cursor.execute(f'CREATE INDEX livraisons__livreur_654541_idx ON {TABLE} (livreur_id, "timestamp")')
+        cursor.execute(f'CREATE INDEX {TABLE}_livreur_id ON {TABLE} (livreur_id)')
+        cursor.execute(f'CREATE INDEX {TABLE}_position_id ON {TABLE} USING gist (position)')
+
+
+class Migration(migrations.Migration):
+
+    # Le verrou et la copie doivent se faire dans une seule transaction
+    atomic = True
+
+    dependencies = [
+        ('livraisons', '0004_alter_positionlivreur_timestamp'),
+    ]
+
+    operations = [
+        migrations.RunPython(partitionner, departitionner),
+    ]
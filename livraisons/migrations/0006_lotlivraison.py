@@ -0,0 +1,36 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commercants', '0002_initial'),
+        ('livraisons', '0005_partitionnement_positionlivreur'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LotLivraison',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('statut', models.CharField(choices=[('ouvert', 'En cours de regroupement'), ('disponible', 'Disponible'), ('accepte', 'Accepté'), ('annule', 'Annulé')], default='ouvert', max_length=20, verbose_name='Statut du lot')),
+                ('date_creation', models.DateTimeField(auto_now_add=True, verbose_name='Date de création')),
+                ('date_cloture', models.DateTimeField(verbose_name='Fin de la fenêtre de regroupement')),
+                ('date_acceptation', models.DateTimeField(blank=True, null=True, verbose_name="Date d'acceptation")),
+                ('commercant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lots_livraison', to='commercants.commercant', verbose_name='Boutique')),
+                ('livreur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lots', to='livraisons.livreur', verbose_name='Livreur')),
+            ],
+            options={
+                'verbose_name': 'Lot de livraisons',
+                'verbose_name_plural': 'Lots de livraisons',
+                'ordering': ['-date_creation'],
+                'indexes': [models.Index(fields=['statut', 'date_cloture'], name='livraisons_lot_statut_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='livraison',
+            name='lot',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='livraisons', to='livraisons.lotlivraison', verbose_name='Lot de livraisons'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraisons', '0006_lotlivraison'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='livraison',
+            name='date_modification',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Date de dernière modification'),
+            preserve_default=False,
+        ),
+    ]
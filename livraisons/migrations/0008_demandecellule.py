@@ -0,0 +1,31 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraisons', '0007_livraison_date_modification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandeCellule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taille', models.PositiveIntegerField(verbose_name='Rayon de la cellule (m)')),
+                ('q', models.IntegerField(verbose_name='Colonne (coordonnée axiale q)')),
+                ('r', models.IntegerField(verbose_name='Ligne (coordonnée axiale r)')),
+                ('periode', models.DateTimeField(verbose_name='Début de la période')),
+                ('centre', django.contrib.gis.db.models.fields.PointField(srid=4326, verbose_name='Centre de la cellule')),
+                ('nombre', models.PositiveIntegerField(default=0, verbose_name='Nombre de commandes')),
+            ],
+            options={
+                'verbose_name': 'Demande par cellule',
+                'verbose_name_plural': 'Demande par cellule',
+                'ordering': ['-periode'],
+                'indexes': [models.Index(fields=['taille', 'periode'], name='livraisons_demande_periode_idx')],
+                'constraints': [models.UniqueConstraint(fields=('taille', 'q', 'r', 'periode'), name='livraisons_demande_cellule_unique')],
+            },
+        ),
+    ]
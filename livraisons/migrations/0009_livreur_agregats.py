@@ -0,0 +1,80 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def calculer_agregats(apps, schema_editor):
+    """Agrégats initiaux, recalculés depuis les livraisons et les évaluations"""
+    Livreur = apps.get_model('livraisons', 'Livreur')
+    Livraison = apps.get_model('livraisons', 'Livraison')
+    EvaluationLivreur = apps.get_model('livraisons', 'EvaluationLivreur')
+
+    livraisons = Livraison.objects.filter(
+        statut='terminee', livreur__isnull=False
+    ).values('livreur_id').annotate(nombre=Count('id'), revenus=Sum('cout_livraison')).order_by()
+    for ligne in livraisons:
+        Livreur.objects.filter(id=ligne['livreur_id']).update(
+            nombre_livraisons=ligne['nombre'],
+            revenus_total=ligne['revenus'] or Decimal('0.00'),
+        )
+
+    evaluations = EvaluationLivreur.objects.filter(
+        livraison__livreur__isnull=False
+    ).values('livraison__livreur_id').annotate(
+        nombre=Count('id'),
+        notes=Sum('note'),
+        ponctualite=Sum('ponctualite'),
+        professionalisme=Sum('professionalisme'),
+        securite=Sum('securite'),
+    ).order_by()
+    for ligne in evaluations:
+        Livreur.objects.filter(id=ligne['livraison__livreur_id']).update(
+            nombre_evaluations=ligne['nombre'],
+            somme_notes=ligne['notes'],
+            somme_ponctualite=ligne['ponctualite'],
+            somme_professionalisme=ligne['professionalisme'],
+            somme_securite=ligne['securite'],
+            note_moyenne=round(Decimal(ligne['notes']) / ligne['nombre'], 2),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraisons', '0008_demandecellule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='livreur',
+            name='nombre_evaluations',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='livreur',
+            name='somme_notes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='livreur',
+            name='somme_ponctualite',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='livreur',
+            name='somme_professionalisme',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='livreur',
+            name='somme_securite',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='livreur',
+            name='revenus_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(calculer_agregats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def calculer_journees(apps, schema_editor):
+    """Journées initiales, recalculées depuis l'historique des livraisons et des évaluations"""
+    Livraison = apps.get_model('livraisons', 'Livraison')
+    EvaluationLivreur = apps.get_model('livraisons', 'EvaluationLivreur')
+    StatistiqueJournaliereLivreur = apps.get_model('livraisons', 'StatistiqueJournaliereLivreur')
+
+    journees = {}
+
+    def _journee(livreur_id, jour):
+        if (livreur_id, jour) not in journees:
+            journees[livreur_id, jour] = StatistiqueJournaliereLivreur(livreur_id=livreur_id, jour=jour)
+        return journees[livreur_id, jour]
+
+    acceptees = Livraison.objects.filter(
+        livreur__isnull=False, date_acceptation__isnull=False
+    ).annotate(jour=TruncDate('date_acceptation')).values(
+        'livreur_id', 'jour'
+    ).annotate(nombre=Count('id')).order_by()
+    for ligne in acceptees:
+        _journee(ligne['livreur_id'], ligne['jour']).nombre_livraisons = ligne['nombre']
+
+    terminees = Livraison.objects.filter(
+        livreur__isnull=False, statut='terminee', date_fin_livraison__isnull=False
+    ).annotate(jour=TruncDate('date_fin_livraison')).values(
+        'livreur_id', 'jour'
+    ).annotate(
+        nombre=Count('id'), revenus=Sum('cout_livraison'), distance=Sum('distance_estimee')
+    ).order_by()
+    for ligne in terminees:
+        journee = _journee(ligne['livreur_id'], ligne['jour'])
+        journee.livraisons_terminees = ligne['nombre']
+        journee.revenus = ligne['revenus'] or Decimal('0.00')
+        journee.distance_km = ligne['distance'] or 0
+
+    evaluations = EvaluationLivreur.objects.filter(
+        livraison__livreur__isnull=False
+    ).annotate(jour=TruncDate('date_evaluation')).values(
+        'livraison__livreur_id', 'jour'
+    ).annotate(nombre=Count('id'), notes=Sum('note')).order_by()
+    for ligne in evaluations:
+        journee = _journee(ligne['livraison__livreur_id'], ligne['jour'])
+        journee.nombre_evaluations = ligne['nombre']
+        journee.somme_notes = ligne['notes']
+
+    StatistiqueJournaliereLivreur.objects.bulk_create(journees.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('livraisons', '0009_livreur_agregats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatistiqueJournaliereLivreur',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour', models.DateField(verbose_name='Jour')),
+                ('nombre_livraisons', models.PositiveIntegerField(default=0, verbose_name='Livraisons acceptées')),
+                ('livraisons_terminees', models.PositiveIntegerField(default=0, verbose_name='Livraisons terminées')),
+                ('revenus', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Revenus')),
+                ('distance_km', models.FloatField(default=0, verbose_name='Distance des livraisons terminées (km)')),
+                ('nombre_evaluations', models.PositiveIntegerField(default=0)),
+                ('somme_notes', models.PositiveIntegerField(default=0)),
+                ('livreur', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statistiques_journalieres', to='livraisons.livreur')),
+            ],
+            options={
+                'verbose_name': 'Statistique journalière du livreur',
+                'verbose_name_plural': 'Statistiques journalières des livreurs',
+                'ordering': ['-jour'],
+                'constraints': [models.UniqueConstraint(fields=('livreur', 'jour'), name='livraisons_statistique_jour_unique')],
+            },
+        ),
+        migrations.RunPython(calculer_journees, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,19 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+from django.dispatch import Signal
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.contrib.gis.db import models as gis_models
-from django.contrib.gis.geos import Point
 from decimal import Decimal
 
+from .distances import distance_points
+from .routage import trajet_points
+
+# Envoyé après chaque changement d'état d'une livraison fait par UPDATE
+# conditionnel (qui ne déclenche pas post_save) ; mêmes arguments que post_save
+transition_livraison = Signal()
+
 User = get_user_model()
 
 class Livreur(models.Model):
@@ -37,6 +46,13 @@ class Livreur(models.Model):
     derniere_position_mise_a_jour = models.DateTimeField(null=True, blank=True)
     note_moyenne = models.DecimalField(max_digits=3, decimal_places=2, default=0.00)
     nombre_livraisons = models.PositiveIntegerField(default=0)
+    # Agrégats tenus à jour par des UPDATE F() (voir statistiques.py pour la réconciliation)
+    nombre_evaluations = models.PositiveIntegerField(default=0)
+    somme_notes = models.PositiveIntegerField(default=0)
+    somme_ponctualite = models.PositiveIntegerField(default=0)
+    somme_professionalisme = models.PositiveIntegerField(default=0)
+    somme_securite = models.PositiveIntegerField(default=0)
+    revenus_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     date_inscription = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
@@ -62,39 +78,71 @@ class Livreur(models.Model):
     @property
     def telephone(self):
         return self.user.telephone
+    
+    def _moyenne(self, somme):
+        return round(somme / self.nombre_evaluations, 2) if self.nombre_evaluations else None
+    
+    @property
+    def moyenne_ponctualite(self):
+        return self._moyenne(self.somme_ponctualite)
+    
+    @property
+    def moyenne_professionalisme(self):
+        return self._moyenne(self.somme_professionalisme)
+    
+    @property
+    def moyenne_securite(self):
+        return self._moyenne(self.somme_securite)
 
     
-    def mettre_a_jour_position(self, latitude, longitude):
+    def mettre_a_jour_position(self, latitude, longitude, timestamp=None):
         """Met à jour la position actuelle du livreur"""
+        from .positions import ingerer_positions
         try:
             # S'assurer que les coordonnées sont valides
             if latitude and longitude:
-                self.position_actuelle = Point(float(longitude), float(latitude))
-                self.derniere_position_mise_a_jour = timezone.now()
-                self.save()
-                
-                # Enregistrer dans l'historique des positions
-                PositionLivreur.objects.create(
-                    livreur=self,
-                    position=self.position_actuelle
-                )
+                # Position courante et historique en un seul passage
+                ingerer_positions(self, [{
+                    'latitude': float(latitude),
+                    'longitude': float(longitude),
+                    'timestamp': timestamp or timezone.now(),
+                }])
                 return True
         except (ValueError, TypeError) as e:
             print(f"Erreur lors de la mise à jour de la position: {e}")
             return False
     
+    @classmethod
+    def mettre_a_jour_evaluations(cls, livreur_id, ecart_nombre, ecarts):
+        """
+        Ajoute ``ecart_nombre`` évaluations et les écarts de chaque critère
+        ({'note', 'ponctualite', 'professionalisme', 'securite'}) aux
+        agrégats du livreur, note moyenne comprise, en un seul UPDATE
+        """
+        nombre = F('nombre_evaluations') + ecart_nombre
+        somme_notes = F('somme_notes') + ecarts['note']
+        cls.objects.filter(id=livreur_id).update(
+            nombre_evaluations=nombre,
+            somme_notes=somme_notes,
+            somme_ponctualite=F('somme_ponctualite') + ecarts['ponctualite'],
+            somme_professionalisme=F('somme_professionalisme') + ecarts['professionalisme'],
+            somme_securite=F('somme_securite') + ecarts['securite'],
+            # Les expressions lisent les valeurs d'avant l'UPDATE
+            note_moyenne=Coalesce(
+                Round(
+                    Cast(
+                        Cast(somme_notes, models.FloatField()) / NullIf(nombre, 0),
+                        models.DecimalField(max_digits=12, decimal_places=4)
+                    ),
+                    2
+                ),
+                Decimal('0.00')
+            ),
+        )
+    
     def calculer_distance(self, point_destination):
-        """Calcule la distance entre la position actuelle et un point de destination"""
-        if not self.position_actuelle or not point_destination:
-            return None
-        
-        try:
-            # Calculer la distance en mètres
-            distance = self.position_actuelle.distance(point_destination) * 100000  # Conversion approximative en mètres
-            return distance
-        except Exception as e:
-            print(f"Erreur lors du calcul de distance: {e}")
-            return None
+        """Calcule la distance (en mètres) entre la position actuelle et un point de destination"""
+        return distance_points(self.position_actuelle, point_destination)
     
     def est_dans_rayon(self, point_destination, rayon_km=10):
         """Vérifie si le livreur est dans un rayon donné d'un point de destination"""
@@ -104,6 +152,89 @@ class Livreur(models.Model):
         
         return distance <= (rayon_km * 1000)  # Conversion en mètres
 
+class LotLivraison(models.Model):
+    """Livraisons d'une même boutique regroupées en une seule course"""
+    STATUT_CHOICES = [
+        ('ouvert', 'En cours de regroupement'),
+        ('disponible', 'Disponible'),
+        ('accepte', 'Accepté'),
+        ('annule', 'Annulé'),
+    ]
+    
+    commercant = models.ForeignKey(
+        'commercants.Commercant',
+        on_delete=models.CASCADE,
+        related_name='lots_livraison',
+        verbose_name="Boutique"
+    )
+    livreur = models.ForeignKey(
+        Livreur,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='lots',
+        verbose_name="Livreur"
+    )
+    statut = models.CharField(
+        max_length=20,
+        choices=STATUT_CHOICES,
+        default='ouvert',
+        verbose_name="Statut du lot"
+    )
+    date_creation = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Date de création"
+    )
+    date_cloture = models.DateTimeField(
+        verbose_name="Fin de la fenêtre de regroupement"
+    )
+    date_acceptation = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Date d'acceptation"
+    )
+    
+    class Meta:
+        verbose_name = "Lot de livraisons"
+        verbose_name_plural = "Lots de livraisons"
+        ordering = ['-date_creation']
+        indexes = [
+            models.Index(fields=['statut', 'date_cloture'], name='livraisons_lot_statut_idx')
+        ]
+    
+    def __str__(self):
+        return f"Lot {self.id} - {self.commercant.nom_boutique}"
+    
+    def accepter(self, livreur):
+        """
+        Attribue au livreur toutes les livraisons du lot encore libres ou qui
+        lui sont proposées. Le lot n'est accepté qu'une fois : un livreur
+        arrivé second reçoit une liste vide. Si aucune livraison n'a pu être
+        prise, le lot redevient disponible.
+        """
+        maintenant = timezone.now()
+        if not LotLivraison.objects.filter(id=self.id, statut='disponible').update(
+            livreur=livreur, statut='accepte', date_acceptation=maintenant
+        ):
+            return []
+        self.livreur = livreur
+        self.statut = 'accepte'
+        self.date_acceptation = maintenant
+        candidates = self.livraisons.filter(
+            models.Q(livreur__isnull=True) | models.Q(livreur=livreur),
+            statut='attribuee'
+        )
+        acceptees = [livraison for livraison in candidates if livraison.accepter_livraison(livreur)]
+        if not acceptees:
+            # Toutes prises ou proposées à d'autres : ne pas laisser un lot vide à ce livreur
+            LotLivraison.objects.filter(id=self.id, livreur=livreur, statut='accepte').update(
+                livreur=None, statut='disponible', date_acceptation=None
+            )
+            self.livreur = None
+            self.statut = 'disponible'
+            self.date_acceptation = None
+        return acceptees
+
 class Livraison(models.Model):
     STATUT_CHOICES = [
         ('attribuee', 'Attribuée'),
@@ -128,6 +259,14 @@ class Livraison(models.Model):
         related_name='livraisons',
         verbose_name="Livreur assigné"
     )
+    lot = models.ForeignKey(
+        LotLivraison,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='livraisons',
+        verbose_name="Lot de livraisons"
+    )
     statut = models.CharField(
         max_length=20,
         choices=STATUT_CHOICES,
@@ -196,6 +335,13 @@ class Livraison(models.Model):
         blank=True,
         verbose_name="Signature du client"
     )
+    # Curseur de synchronisation des listes (voir synchro.py) ; les mises à
+    # jour par .update() doivent le renseigner explicitement
+    date_modification = models.DateTimeField(
+        auto_now=True,
+        db_index=True,
+        verbose_name="Date de dernière modification"
+    )
     
     class Meta:
         verbose_name = "Livraison"
@@ -205,65 +351,126 @@ class Livraison(models.Model):
     def __str__(self):
         return f"Livraison {self.id} - Commande {self.commande.reference}"
     
+    def _transition(self, *conditions, **valeurs):
+        """
+        Applique ``valeurs`` par un seul UPDATE conditionnel, sans verrou ni
+        lecture préalable. Retourne True si cette requête a fait la
+        transition, False si la livraison n'était plus dans l'état attendu
+        (un autre livreur ou une autre requête est passé avant).
+        """
+        valeurs['date_modification'] = timezone.now()
+        if not Livraison.objects.filter(*conditions, id=self.id).update(**valeurs):
+            return False
+        # Relire les seules colonnes modifiées (dont les expressions comme Coalesce)
+        self.refresh_from_db(fields=['livreur' if champ == 'livreur_id' else champ for champ in valeurs])
+        transition_livraison.send(sender=Livraison, instance=self, created=False)
+        return True
+    
     def assigner_livreur(self, livreur):
-        """Assigne un livreur à cette livraison"""
-        self.livreur = livreur
-        self.date_attribution = timezone.now()
-        self.statut = 'attribuee'
-        self.save()
+        """Propose cette livraison libre à un livreur ; retourne True si elle l'était encore"""
+        return self._transition(
+            models.Q(livreur__isnull=True, statut='attribuee'),
+            livreur_id=livreur.id,
+            date_attribution=timezone.now(),
+        )
     
-    def accepter_livraison(self):
-        """Marque la livraison comme acceptée par le livreur"""
-        if self.statut == 'attribuee':
-            self.statut = 'acceptee'
-            self.date_acceptation = timezone.now()
-            self.save()
+    def accepter_livraison(self, livreur=None):
+        """
+        Marque la livraison comme acceptée, par ``livreur`` si elle est libre
+        ou lui est proposée (par le livreur déjà assigné sinon). Retourne
+        True si l'acceptation a eu lieu.
+        """
+        livreur_id = livreur.id if livreur else self.livreur_id
+        if livreur_id is None:
+            return False
+        maintenant = timezone.now()
+        return self._transition(
+            models.Q(livreur__isnull=True) | models.Q(livreur_id=livreur_id),
+            models.Q(statut='attribuee'),
+            livreur_id=livreur_id,
+            statut='acceptee',
+            date_attribution=Coalesce(F('date_attribution'), maintenant),
+            date_acceptation=maintenant,
+        )
     
     def commencer_livraison(self):
-        """Marque le début de la livraison"""
-        if self.statut == 'acceptee':
-            self.statut = 'en_cours'
-            self.date_debut_livraison = timezone.now()
-            self.save()
+        """Marque le début de la livraison ; retourne True si elle était acceptée"""
+        return self._transition(
+            models.Q(statut='acceptee', livreur_id=self.livreur_id),
+            statut='en_cours',
+            date_debut_livraison=timezone.now(),
+        )
     
     def terminer_livraison(self):
-        """Marque la livraison comme terminée"""
-        if self.statut == 'en_cours':
-            self.statut = 'terminee'
-            self.date_fin_livraison = timezone.now()
+        """
+        Marque la livraison comme terminée ; retourne True si elle était en
+        cours. La transition, la commande et les statistiques sont validées
+        ensemble ; les abonnés du suivi ne sont prévenus qu'après la
+        validation (voir signals.diffuser_statut_livraison).
+        """
+        with transaction.atomic():
+            if not self._transition(
+                models.Q(statut='en_cours', livreur_id=self.livreur_id),
+                statut='terminee',
+                date_fin_livraison=timezone.now(),
+            ):
+                return False
             
             # Mettre à jour le statut de la commande
             self.commande.statut = 'livree'
-            self.commande.save()
+            self.commande.save(update_fields=['statut', 'date_modification'])
             
             # Mettre à jour les statistiques du livreur
-            if self.livreur:
-                self.livreur.nombre_livraisons += 1
-                self.livreur.save()
-            
-            self.save()
+            if self.livreur_id:
+                Livreur.objects.filter(id=self.livreur_id).update(
+                    nombre_livraisons=F('nombre_livraisons') + 1,
+                    revenus_total=F('revenus_total') + self.cout_livraison,
+                )
+        return True
     
     def annuler_livraison(self):
-        """Annule la livraison"""
-        self.statut = 'annulee'
-        self.save()
+        """Annule la livraison si elle n'est pas déjà close ; retourne True si c'est fait"""
+        return self._transition(
+            models.Q(statut__in=['attribuee', 'acceptee', 'en_cours']),
+            statut='annulee',
+        )
     
     def calculer_distance_et_duree(self, point_depart=None):
-        """Calcule la distance et la durée estimées de la livraison"""
+        """
+        Calcule la distance et la durée estimées de la livraison, par la
+        route quand le graphe routier est disponible. Depuis la position du
+        livreur, le trajet passe par la boutique tant que le colis n'a pas
+        été récupéré. Seules les colonnes de l'estimation sont écrites, par
+        UPDATE (sans post_save) : une transition concurrente n'est pas écrasée.
+        """
+        etapes = []
         if not point_depart and self.livreur and self.livreur.position_actuelle:
             point_depart = self.livreur.position_actuelle
+            if self.statut in ('attribuee', 'acceptee') and self.boutique_point:
+                etapes.append(self.boutique_point)
         elif not point_depart and self.boutique_point:
             point_depart = self.boutique_point
         
         if point_depart and self.adresse_livraison_point:
-            # Calcul de la distance en km
-            distance_km = point_depart.distance(self.adresse_livraison_point) * 111.32  # Conversion approximative
-            self.distance_estimee = round(distance_km, 2)
+            etapes = [point_depart] + etapes + [self.adresse_livraison_point]
+            distance_m = duree_s = 0
+            for depart, arrivee in zip(etapes, etapes[1:]):
+                trajet = trajet_points(depart, arrivee)
+                if trajet is None:
+                    # Sans graphe routier : vol d'oiseau à 30 km/h de moyenne en ville
+                    distance = distance_points(depart, arrivee)
+                    trajet = (distance, distance / (30 / 3.6))
+                distance_m += trajet[0]
+                duree_s += trajet[1]
             
-            # Estimation de la durée (basée sur une vitesse moyenne de 30 km/h en ville)
-            vitesse_moyenne = 30  # km/h
-            self.duree_estimee = int((distance_km / vitesse_moyenne) * 60)  # en minutes
-            self.save()
+            self.distance_estimee = round(distance_m / 1000, 2)
+            self.duree_estimee = int(round(duree_s / 60))  # en minutes
+            self.date_modification = timezone.now()
+            Livraison.objects.filter(id=self.id).update(
+                distance_estimee=self.distance_estimee,
+                duree_estimee=self.duree_estimee,
+                date_modification=self.date_modification,
+            )
 
 class PositionLivreur(models.Model):
     """Historique des positions du livreur pour le suivi en temps réel"""
@@ -274,7 +481,7 @@ class PositionLivreur(models.Model):
     )
     position = gis_models.PointField(verbose_name="Position")
     timestamp = models.DateTimeField(
-        auto_now_add=True,
+        default=timezone.now,
         verbose_name="Timestamp"
     )
     vitesse = models.FloatField(
@@ -333,16 +540,90 @@ class EvaluationLivreur(models.Model):
     def __str__(self):
         return f"Évaluation de {self.livraison.livreur.username} - {self.note}/5"
     
+    CRITERES = ('note', 'ponctualite', 'professionalisme', 'securite')
+    
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        
-        # Mettre à jour la note moyenne du livreur
-        livreur = self.livraison.livreur
-        evaluations = EvaluationLivreur.objects.filter(livraison__livreur=livreur)
-        if evaluations.exists():
-            moyenne = evaluations.aggregate(models.Avg('note'))['note__avg']
-            livreur.note_moyenne = round(moyenne, 2)
-            livreur.save()
+        """
+        Enregistre l'évaluation et reporte la différence sur les agrégats du
+        livreur, dans la même transaction, sans relire ses autres évaluations
+        """
+        from . import statistiques
+        with transaction.atomic():
+            precedente = None
+            if not self._state.adding:
+                precedente = EvaluationLivreur.objects.filter(id=self.id).values(*self.CRITERES).first()
+            super().save(*args, **kwargs)
+            
+            ecarts = {critere: getattr(self, critere) - (precedente or {}).get(critere, 0)
+                      for critere in self.CRITERES}
+            livreur_id = Livraison.objects.filter(id=self.livraison_id).values_list('livreur_id', flat=True).first()
+            if livreur_id:
+                Livreur.mettre_a_jour_evaluations(livreur_id, 0 if precedente else 1, ecarts)
+                statistiques.noter_evaluation(
+                    livreur_id, self.date_evaluation, 0 if precedente else 1, ecarts['note']
+                )
+    
+    def delete(self, *args, **kwargs):
+        from . import statistiques
+        with transaction.atomic():
+            livreur_id = self.livraison.livreur_id
+            resultat = super().delete(*args, **kwargs)
+            if livreur_id:
+                Livreur.mettre_a_jour_evaluations(
+                    livreur_id, -1, {critere: -getattr(self, critere) for critere in self.CRITERES}
+                )
+                statistiques.noter_evaluation(livreur_id, self.date_evaluation, -1, -self.note)
+            return resultat
+
+class StatistiqueJournaliereLivreur(models.Model):
+    """
+    Activité d'un livreur sur une journée, tenue à jour aux changements de
+    statut et aux évaluations (voir statistiques.py)
+    """
+    livreur = models.ForeignKey(
+        Livreur,
+        on_delete=models.CASCADE,
+        related_name='statistiques_journalieres'
+    )
+    jour = models.DateField(verbose_name="Jour")
+    nombre_livraisons = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Livraisons acceptées"
+    )
+    livraisons_terminees = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Livraisons terminées"
+    )
+    revenus = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        verbose_name="Revenus"
+    )
+    distance_km = models.FloatField(
+        default=0,
+        verbose_name="Distance des livraisons terminées (km)"
+    )
+    nombre_evaluations = models.PositiveIntegerField(default=0)
+    somme_notes = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Statistique journalière du livreur"
+        verbose_name_plural = "Statistiques journalières des livreurs"
+        ordering = ['-jour']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['livreur', 'jour'],
+                name='livraisons_statistique_jour_unique'
+            )
+        ]
+    
+    def __str__(self):
+        return f"{self.livreur.username} - {self.jour}"
+    
+    @property
+    def note_moyenne(self):
+        return round(self.somme_notes / self.nombre_evaluations, 2) if self.nombre_evaluations else None
 
 class NotificationLivreur(models.Model):
     """Notifications pour les livreurs"""
@@ -396,4 +677,42 @@ class NotificationLivreur(models.Model):
     def marquer_comme_lue(self):
         """Marque la notification comme lue"""
         self.est_lue = True
-        self.save()
\ No newline at end of file
+        self.save()
+
+class DemandeCellule(models.Model):
+    """
+    Nombre de commandes passées dans une cellule hexagonale pendant une
+    période de 15 minutes (voir demande.py)
+    """
+    taille = models.PositiveIntegerField(
+        verbose_name="Rayon de la cellule (m)"
+    )
+    q = models.IntegerField(verbose_name="Colonne (coordonnée axiale q)")
+    r = models.IntegerField(verbose_name="Ligne (coordonnée axiale r)")
+    periode = models.DateTimeField(
+        verbose_name="Début de la période"
+    )
+    centre = gis_models.PointField(
+        verbose_name="Centre de la cellule"
+    )
+    nombre = models.PositiveIntegerField(
+        default=0,
+        verbose_name="Nombre de commandes"
+    )
+    
+    class Meta:
+        verbose_name = "Demande par cellule"
+        verbose_name_plural = "Demande par cellule"
+        ordering = ['-periode']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['taille', 'q', 'r', 'periode'],
+                name='livraisons_demande_cellule_unique'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['taille', 'periode'], name='livraisons_demande_periode_idx')
+        ]
+    
+    def __str__(self):
+        return f"Cellule ({self.q}, {self.r}) - {self.periode:%d/%m %H:%M} : {self.nombre}"
@@ -0,0 +1,123 @@
+"""
+Partitionnement mensuel de l'historique des positions (PostgreSQL).
+
+La table ``livraisons_positionlivreur`` est partitionnée par intervalle sur
+``timestamp``, une partition par mois, plus une partition par défaut pour
+les positions hors des mois créés. Sous SpatiaLite la table reste simple et
+la rétention se fait par suppression des lignes expirées.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+TABLE = 'livraisons_positionlivreur'
+PARTITION_DEFAUT = f'{TABLE}_defaut'
+SCHEMA_ARCHIVES = 'archives'
+
+
+def retention_jours():
+    return getattr(settings, 'TNV_RETENTION_POSITIONS_JOURS', 90)
+
+
+def debut_mois(jour):
+    return date(jour.year, jour.month, 1)
+
+
+def mois_suivant(mois):
+    if mois.month == 12:
+        return date(mois.year + 1, 1, 1)
+    return date(mois.year, mois.month + 1, 1)
+
+
+def nom_partition(mois):
+    return f"{TABLE}_{mois:%Y%m}"
+
+
+def _borne(mois):
+    """Début du mois dans le fuseau du projet, en littéral SQL"""
+    return timezone.make_aware(datetime.combine(mois, time.min)).isoformat()
+
+
+def est_partitionnee(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+            [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def partitions_mensuelles(cursor):
+    """Retourne {mois: nom} des partitions mensuelles attachées"""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s",
+        [TABLE]
+    )
+    partitions = {}
+    for (nom,) in cursor.fetchall():
+        suffixe = nom[len(TABLE) + 1:]
+        if len(suffixe) == 6 and suffixe.isdigit():
+            partitions[date(int(suffixe[:4]), int(suffixe[4:]), 1)] = nom
+    return partitions
+
+
+def creer_partition(cursor, mois):
+    """
+    Crée la partition d'un mois. Les lignes du mois déjà tombées dans la
+    partition par défaut y sont déplacées avant l'attachement.
+    """
+    nom = nom_partition(mois)
+    debut, fin = _borne(mois), _borne(mois_suivant(mois))
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{nom}" '
+        f'(LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+    )
+    cursor.execute(
+        f'WITH deplacees AS (DELETE FROM "{PARTITION_DEFAUT}" '
+        f'WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+        f'INSERT INTO "{nom}" SELECT * FROM deplacees',
+        [debut, fin]
+    )
+    cursor.execute(
+        f'ALTER TABLE {TABLE} ATTACH PARTITION "{nom}" '
+        f"FOR VALUES FROM ('{debut}') TO ('{fin}')"
+    )
+    return nom
+
+
+def creer_partitions_futures(cursor, mois_avance=3, aujourd_hui=None):
+    """Garantit l'existence des partitions du mois courant et des mois suivants"""
+    mois = debut_mois(aujourd_hui or timezone.localdate())
+    existantes = partitions_mensuelles(cursor)
+    creees = []
+    for _ in range(mois_avance + 1):
+        if mois not in existantes:
+            creees.append(creer_partition(cursor, mois))
+        mois = mois_suivant(mois)
+    return creees
+
+
+def partitions_expirees(cursor, retention=None, aujourd_hui=None):
+    """Partitions dont tout le mois est antérieur à la limite de rétention"""
+    retention = retention_jours() if retention is None else retention
+    limite = (aujourd_hui or timezone.localdate()) - timedelta(days=retention)
+    return [
+        nom for mois, nom in sorted(partitions_mensuelles(cursor).items())
+        if mois_suivant(mois) <= limite
+    ]
+
+
+def retirer_partition(cursor, nom, archiver=False):
+    """Détache une partition puis la supprime ou la range dans le schéma d'archives"""
+    cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION "{nom}"')
+    if archiver:
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA_ARCHIVES}')
+        cursor.execute(f'ALTER TABLE "{nom}" SET SCHEMA {SCHEMA_ARCHIVES}')
+    else:
+        cursor.execute(f'DROP TABLE "{nom}"')
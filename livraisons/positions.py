@@ -0,0 +1,150 @@
+"""
+Ingestion des positions GPS des livreurs.
+
+Les applications mobiles envoient leurs positions par lots horodatés. Un
+lot, une fois filtré (voir filtre_gps), produit au plus une insertion
+groupée dans l'historique ; la position courante passe par le tampon
+d'écriture différée (voir tampon_positions), quelle que soit la fréquence
+d'échantillonnage du GPS.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import eta, geofences, presence, suivi, tampon_positions
+from .filtre_gps import filtrer
+from .index_spatial import grille_livreurs
+from .models import PositionLivreur
+
+TAILLE_MAX_LOT = 500
+# Tolérance sur l'horloge des téléphones
+DECALAGE_FUTUR_MAX = timedelta(minutes=2)
+
+
+def _parser_timestamp(valeur, maintenant):
+    """Accepte un timestamp en millisecondes (Geolocation API) ou une date ISO 8601"""
+    if valeur in (None, ''):
+        return maintenant
+    if isinstance(valeur, (int, float)):
+        horodatage = datetime.fromtimestamp(valeur / 1000, tz=dt_timezone.utc)
+    else:
+        horodatage = parse_datetime(str(valeur))
+        if horodatage is None:
+            raise ValueError(f"Timestamp invalide: {valeur}")
+        if timezone.is_naive(horodatage):
+            horodatage = timezone.make_aware(horodatage)
+    if horodatage > maintenant + DECALAGE_FUTUR_MAX:
+        return maintenant
+    return horodatage
+
+
+def parser_fixes(positions):
+    """
+    Convertit la liste reçue du client en fixes normalisés
+    {'latitude', 'longitude', 'timestamp', 'precision'}. Les entrées invalides sont ignorées.
+    """
+    if not isinstance(positions, list):
+        raise ValueError("Le champ 'positions' doit être une liste.")
+    if len(positions) > TAILLE_MAX_LOT:
+        raise ValueError(f"Lot trop volumineux (maximum {TAILLE_MAX_LOT} positions).")
+
+    maintenant = timezone.now()
+    fixes = []
+    for position in positions:
+        try:
+            latitude = float(position['latitude'])
+            longitude = float(position['longitude'])
+            timestamp = _parser_timestamp(position.get('timestamp'), maintenant)
+        except (KeyError, TypeError, ValueError, AttributeError, OverflowError, OSError):
+            continue
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            continue
+        fixes.append({
+            'latitude': latitude,
+            'longitude': longitude,
+            'timestamp': timestamp,
+            'precision': _parser_precision(position.get('precision', position.get('accuracy'))),
+        })
+    return fixes
+
+
+def _parser_precision(valeur):
+    """Précision annoncée par le téléphone, en mètres (None si absente)"""
+    try:
+        precision = float(valeur)
+    except (TypeError, ValueError):
+        return None
+    return precision if precision >= 0 else None
+
+
+def _dedoublonner(fixes, dernier_timestamp):
+    """Trie par timestamp client et écarte les doublons et les fixes déjà reçus"""
+    par_timestamp = {}
+    for fix in fixes:
+        if dernier_timestamp is not None and fix['timestamp'] <= dernier_timestamp:
+            continue
+        par_timestamp[fix['timestamp']] = fix
+    return [par_timestamp[t] for t in sorted(par_timestamp)]
+
+
+def ingerer_positions(livreur, fixes):
+    """
+    Enregistre un lot de fixes pour un livreur.
+
+    Les fixes sont lissés et décimés (voir filtre_gps) avant l'insertion dans
+    l'historique ; la position courante suit le dernier fix lissé.
+    Retourne un dictionnaire avec le nombre de fixes reçus et enregistrés,
+    et les arrivées détectées dans les zones des livraisons actives (voir geofences).
+    """
+    dernier = PositionLivreur.objects.filter(
+        livreur=livreur
+    ).order_by('-timestamp').values_list('timestamp', 'position').first()
+    dernier_timestamp, dernier_garde = None, None
+    if dernier:
+        dernier_timestamp = dernier[0]
+        dernier_garde = (dernier[1].y, dernier[1].x, dernier[0])
+
+    nouveaux = _dedoublonner(fixes, dernier_timestamp)
+    conserves, courant = filtrer(livreur.id, nouveaux, dernier_garde)
+    resultat = {'recues': len(fixes), 'enregistrees': len(conserves)}
+
+    if conserves:
+        PositionLivreur.objects.bulk_create([
+            PositionLivreur(
+                livreur=livreur,
+                position=Point(fix['longitude'], fix['latitude'], srid=4326),
+                timestamp=fix['timestamp'],
+                vitesse=fix['vitesse'],
+            )
+            for fix in conserves
+        ])
+
+    # Une position reçue vaut battement de cœur
+    presence.prolonger(livreur.id)
+
+    # La position courante est écrite en base par le vidage périodique du tampon
+    if courant and tampon_positions.enregistrer(
+            livreur.id, courant['latitude'], courant['longitude'], courant['timestamp']):
+        livreur.position_actuelle = Point(courant['longitude'], courant['latitude'], srid=4326)
+        livreur.derniere_position_mise_a_jour = courant['timestamp']
+        grille_livreurs.synchroniser_livreur(livreur)
+
+    # Diffusion aux abonnés des livraisons en cours, seulement sur un vrai déplacement
+    if conserves:
+        dernier_conserve = conserves[-1]
+        suivi.publier_position(
+            livreur.id,
+            dernier_conserve['latitude'],
+            dernier_conserve['longitude'],
+            dernier_conserve['timestamp'],
+            dernier_conserve['vitesse'],
+        )
+        eta.mettre_a_jour(livreur.id, conserves)
+
+    # Arrivée à la boutique ou à l'adresse de remise des livraisons actives
+    resultat['geofences'] = geofences.evaluer(livreur.id, conserves + ([courant] if courant else []))
+
+    tampon_positions.vider_si_necessaire()
+    return resultat
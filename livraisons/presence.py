@@ -0,0 +1,97 @@
+"""
+Présence des livreurs : en ligne tant que leurs battements de cœur arrivent.
+
+Chaque battement (``api/presence/``, ou toute position reçue) repousse
+l'expiration d'une entrée du cache partagé ; un livreur dont l'application
+est fermée disparaît de lui-même à l'expiration, sans écriture en base.
+Le dispatch et l'index spatial consultent ce registre plutôt que la
+colonne ``Livreur.est_en_ligne``, qui n'est recopiée qu'en bloc par le
+balayage périodique (commande ``balayer_presence``, et au fil des
+battements au plus une fois par intervalle).
+
+Les livreurs connus forment un ensemble partagé (voir registre.py), mis à
+jour sans relecture-réécriture : un battement concurrent d'un balayage
+n'est jamais perdu.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import registre
+
+PREFIXE = 'tnv:presence:'
+CLE_LIVREURS = 'tnv:presence:ensemble_livreurs'
+CLE_VERROU = 'tnv:presence:balayage'
+# Intervalle minimal entre deux balayages déclenchés par des battements (secondes)
+INTERVALLE_BALAYAGE = 30
+
+
+def duree():
+    """Durée de vie d'un battement (secondes)"""
+    return getattr(settings, 'TNV_PRESENCE_TTL_S', 90)
+
+
+def _cle(livreur_id):
+    return f"{PREFIXE}{livreur_id}"
+
+
+def battement(livreur_id):
+    """Marque le livreur en ligne pour la durée d'un battement"""
+    # L'entrée d'abord, l'identifiant ensuite (voir registre.retirer_absents)
+    cache.set(_cle(livreur_id), timezone.now(), duree())
+    registre.ajouter(CLE_LIVREURS, livreur_id)
+
+
+def prolonger(livreur_id):
+    """
+    Repousse l'expiration d'un livreur déjà en ligne (une position reçue vaut
+    battement) ; sans effet pour un livreur qui s'est mis hors ligne.
+    """
+    return cache.touch(_cle(livreur_id), duree())
+
+
+def deconnecter(livreur_id):
+    cache.delete(_cle(livreur_id))
+
+
+def en_ligne(livreur_ids):
+    """Parmi ces livreurs, ceux dont le dernier battement n'a pas expiré"""
+    livreur_ids = list(livreur_ids)
+    presents = cache.get_many([_cle(livreur_id) for livreur_id in livreur_ids])
+    return {livreur_id for livreur_id in livreur_ids if _cle(livreur_id) in presents}
+
+
+def est_en_ligne(livreur_id):
+    return cache.get(_cle(livreur_id)) is not None
+
+
+def livreurs_en_ligne():
+    """Tous les livreurs en ligne"""
+    return en_ligne(registre.membres(CLE_LIVREURS))
+
+
+def balayer():
+    """
+    Recopie la présence dans ``Livreur.est_en_ligne`` en deux UPDATE et
+    oublie les livreurs expirés. Retourne (passés en ligne, passés hors ligne).
+    """
+    from .index_spatial import grille_livreurs
+    from .models import Livreur
+
+    connus = registre.membres(CLE_LIVREURS)
+    presents = en_ligne(connus)
+    registre.retirer_absents(CLE_LIVREURS, connus - presents, en_ligne)
+
+    connectes = Livreur.objects.filter(id__in=presents, est_en_ligne=False).update(est_en_ligne=True)
+    absents = Livreur.objects.filter(est_en_ligne=True).exclude(id__in=presents)
+    for livreur_id in absents.values_list('id', flat=True):
+        grille_livreurs.retirer(livreur_id)
+    deconnectes = absents.update(est_en_ligne=False)
+    return connectes, deconnectes
+
+
+def balayer_si_necessaire():
+    """Balayage au plus une fois par intervalle, tous processus confondus"""
+    if cache.add(CLE_VERROU, True, INTERVALLE_BALAYAGE):
+        return balayer()
+    return None
@@ -0,0 +1,178 @@
+"""
+Recherche des livraisons disponibles les plus proches d'un livreur.
+
+Le tri est fait par la base de données : opérateur KNN ``<->`` servi par
+l'index GiST de ``boutique_point`` sous PostGIS, ``ST_Distance`` sous
+SpatiaLite en développement. Le coût d'une recherche dépend de la taille
+de la page demandée et non du nombre de livraisons en attente.
+"""
+import math
+
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.db.models.functions import GeoFunc
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import Distance
+from django.db.models import FloatField, Q, Value
+
+from .distances import coordonnees, un_vers_plusieurs
+from .models import Livraison
+
+RAYON_KM_DEFAUT = 10
+RAYON_KM_MAX = 50
+LIMITE_DEFAUT = 20
+LIMITE_MAX = 100
+KM_PAR_DEGRE = 111.32
+
+
+class DistanceTri(GeoFunc):
+    """Distance planaire (en degrés) utilisée comme clé de tri KNN"""
+    function = 'ST_Distance'
+    output_field = FloatField()
+    geom_param_pos = (0, 1)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        # L'opérateur <-> permet à PostgreSQL de parcourir l'index GiST
+        # dans l'ordre des distances au lieu de trier toute la table.
+        return super().as_sql(
+            compiler, connection,
+            template='(%(expressions)s)', arg_joiner=' <-> ',
+            **extra_context
+        )
+
+
+def livraisons_en_attente():
+    """Livraisons sans livreur, en attente d'acceptation, hors lots encore en regroupement"""
+    return Livraison.objects.filter(
+        livreur__isnull=True,
+        statut='attribuee'
+    ).exclude(
+        lot__statut='ouvert'
+    ).select_related('commande', 'commande__client', 'commande__commercant')
+
+
+def encoder_curseur(tri, livraison_id):
+    return f"{tri!r}:{livraison_id}"
+
+
+def decoder_curseur(curseur):
+    """Retourne (tri, id) ou None si le curseur est absent ou invalide"""
+    if not curseur:
+        return None
+    try:
+        tri, livraison_id = curseur.rsplit(':', 1)
+        return float(tri), int(livraison_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def _entier_borne(valeur, defaut, minimum, maximum):
+    try:
+        valeur = int(valeur)
+    except (TypeError, ValueError):
+        return defaut
+    return max(minimum, min(valeur, maximum))
+
+
+def _reel_borne(valeur, defaut, minimum, maximum):
+    try:
+        valeur = float(valeur)
+    except (TypeError, ValueError):
+        return defaut
+    if math.isnan(valeur):
+        return defaut
+    return max(minimum, min(valeur, maximum))
+
+
+def parametres_recherche(params):
+    """Extrait rayon, limite et curseur des paramètres GET"""
+    return {
+        'rayon_km': _reel_borne(params.get('rayon'), RAYON_KM_DEFAUT, 0.1, RAYON_KM_MAX),
+        'limite': _entier_borne(params.get('limite'), LIMITE_DEFAUT, 1, LIMITE_MAX),
+        'curseur': params.get('curseur') or None,
+    }
+
+
+def emprise_rayon(point, rayon_km):
+    """Rectangle englobant le cercle de rayon donné autour du point"""
+    delta_lat = rayon_km / KM_PAR_DEGRE
+    cos_lat = max(math.cos(math.radians(point.y)), 0.01)
+    delta_lng = rayon_km / (KM_PAR_DEGRE * cos_lat)
+    emprise = Polygon.from_bbox((
+        point.x - delta_lng, point.y - delta_lat,
+        point.x + delta_lng, point.y + delta_lat,
+    ))
+    emprise.srid = 4326
+    return emprise
+
+
+def _point_wgs84(point):
+    if point.srid is None:
+        return Point(point.x, point.y, srid=4326)
+    return point
+
+
+def livraisons_dans_rayon(point, rayon_km=RAYON_KM_DEFAUT):
+    """Livraisons disponibles dont la boutique est dans le rayon (toutes sans position)"""
+    livraisons = livraisons_en_attente()
+    if point is None:
+        return livraisons
+    point = _point_wgs84(point)
+    return livraisons.filter(
+        # Filtre rectangulaire servi par l'index, puis distance exacte
+        boutique_point__contained=emprise_rayon(point, rayon_km),
+        boutique_point__distance_lte=(point, Distance(km=rayon_km)),
+    )
+
+
+def annoter_distances(livraisons, point):
+    """Distances exactes à la boutique, en un seul calcul vectorisé"""
+    if not livraisons or point is None:
+        return
+    lats, lngs = coordonnees([livraison.boutique_point for livraison in livraisons])
+    distances = un_vers_plusieurs(point.y, point.x, lats, lngs)
+    for livraison, distance in zip(livraisons, distances):
+        livraison.distance_metres = float(distance)
+        livraison.distance_km = float(distance) / 1000
+
+
+def livraisons_proches(point, rayon_km=RAYON_KM_DEFAUT, limite=LIMITE_DEFAUT, curseur=None):
+    """
+    Retourne une page de livraisons disponibles triées par distance à la
+    boutique, et le curseur de la page suivante (None s'il n'y en a plus).
+
+    Sans position, les livraisons sont paginées par identifiant.
+    """
+    livraisons = livraisons_dans_rayon(point, rayon_km)
+    position = decoder_curseur(curseur)
+
+    if point is None:
+        if position:
+            livraisons = livraisons.filter(id__gt=position[1])
+        page = list(livraisons.order_by('id')[:limite + 1])
+        suivant = None
+        if len(page) > limite:
+            page = page[:limite]
+            suivant = encoder_curseur(0.0, page[-1].id)
+        return page, suivant
+
+    point = _point_wgs84(point)
+    geom = Value(point, output_field=GeometryField(srid=4326))
+
+    livraisons = livraisons.annotate(
+        distance_tri=DistanceTri('boutique_point', geom),
+    )
+
+    if position:
+        tri, dernier_id = position
+        livraisons = livraisons.filter(
+            Q(distance_tri__gt=tri) | Q(distance_tri=tri, id__gt=dernier_id)
+        )
+
+    page = list(livraisons.order_by('distance_tri', 'id')[:limite + 1])
+    suivant = None
+    if len(page) > limite:
+        page = page[:limite]
+        suivant = encoder_curseur(page[-1].distance_tri, page[-1].id)
+
+    annoter_distances(page, point)
+    return page, suivant
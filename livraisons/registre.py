@@ -0,0 +1,76 @@
+"""
+Ensembles d'identifiants partagés entre processus (livreurs ayant une
+position en tampon, livreurs en ligne, livraisons supprimées...).
+
+Avec le cache Redis, chaque ensemble est un SET Redis : ajouts et retraits
+sont atomiques (SADD/SREM), deux processus ne s'écrasent jamais. Avec le
+cache mémoire local (développement, un seul processus), l'ensemble est une
+valeur du cache protégée par un verrou.
+
+Les identifiants sont des entiers. Un retrait ne doit porter que sur des
+identifiants dont l'entrée associée a été constatée absente ; l'appelant
+revérifie ensuite ces entrées (voir ``retirer_absents``), car un autre
+processus peut les avoir recréées entre-temps.
+"""
+import threading
+
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+_verrou = threading.Lock()
+
+
+def _redis(cle):
+    """(client Redis, clé complète) si le cache par défaut est Redis, (None, None) sinon"""
+    cache = caches['default']
+    if not isinstance(cache, RedisCache):
+        return None, None
+    return cache._cache.get_client(write=True), cache.make_key(cle)
+
+
+def ajouter(cle, *identifiants):
+    if not identifiants:
+        return
+    client, cle_complete = _redis(cle)
+    if client is not None:
+        client.sadd(cle_complete, *identifiants)
+        return
+    cache = caches['default']
+    with _verrou:
+        cache.set(cle, (cache.get(cle) or set()) | set(identifiants), None)
+
+
+def retirer(cle, identifiants):
+    identifiants = list(identifiants)
+    if not identifiants:
+        return
+    client, cle_complete = _redis(cle)
+    if client is not None:
+        client.srem(cle_complete, *identifiants)
+        return
+    cache = caches['default']
+    with _verrou:
+        cache.set(cle, (cache.get(cle) or set()) - set(identifiants), None)
+
+
+def membres(cle):
+    client, cle_complete = _redis(cle)
+    if client is not None:
+        return {int(identifiant) for identifiant in client.smembers(cle_complete)}
+    return set(caches['default'].get(cle) or set())
+
+
+def retirer_absents(cle, identifiants, presents):
+    """
+    Retire ``identifiants`` de l'ensemble, puis remet ceux que ``presents``
+    (fonction : identifiants -> sous-ensemble encore valide) retrouve : une
+    entrée recréée par un autre processus pendant le retrait n'est pas perdue,
+    celui-ci écrivant toujours son entrée avant d'ajouter l'identifiant.
+    """
+    identifiants = set(identifiants)
+    if not identifiants:
+        return
+    retirer(cle, identifiants)
+    revenus = presents(identifiants)
+    if revenus:
+        ajouter(cle, *revenus)
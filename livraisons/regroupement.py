@@ -0,0 +1,165 @@
+"""
+Regroupement des commandes d'une même boutique en une seule course.
+
+Une livraison nouvellement créée n'est pas proposée tout de suite : elle
+rejoint le lot ouvert de sa boutique dont les adresses de remise sont les
+plus proches de la sienne, ou ouvre un nouveau lot. À la fin de la fenêtre
+de regroupement (ou dès que le lot est plein), le lot devient disponible et
+les livreurs proches reçoivent une seule notification pour l'ensemble.
+
+Les lots échus sont clôturés par la commande ``regrouper_livraisons`` et,
+au fil de l'eau, par les requêtes qui consultent les livraisons disponibles.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .distances import un_vers_plusieurs
+from .index_spatial import grille_livreurs
+from .models import LotLivraison, NotificationLivreur
+
+CLE_VERROU = 'tnv:regroupement:cloture'
+# Intervalle minimal entre deux clôtures déclenchées par des requêtes (secondes)
+INTERVALLE_CLOTURE = 5
+
+PARAMETRES_DEFAUT = {
+    # Durée pendant laquelle un lot accueille de nouvelles livraisons (secondes)
+    'fenetre_s': 120,
+    # Distance maximale entre les adresses de remise d'un même lot (km)
+    'rayon_km': 2.0,
+    # Nombre maximal de livraisons par lot
+    'taille_max': 4,
+}
+
+
+def parametres():
+    return {**PARAMETRES_DEFAUT, **getattr(settings, 'TNV_REGROUPEMENT', {})}
+
+
+def _distance_au_lot(lot, point):
+    """(plus grande distance en m entre le point et les remises du lot, nombre de remises)"""
+    remises = [
+        remise for remise in lot.livraisons.values_list('adresse_livraison_point', flat=True)
+        if remise is not None
+    ]
+    if not remises:
+        return None
+    distances = un_vers_plusieurs(
+        point.y, point.x,
+        [remise.y for remise in remises], [remise.x for remise in remises]
+    )
+    return float(distances.max()), len(remises)
+
+
+def ajouter(livraison):
+    """
+    Range une nouvelle livraison dans un lot de sa boutique. Sans fenêtre
+    de regroupement, ou sans boutique ni adresse de remise, la livraison est
+    proposée seule immédiatement. Retourne le lot, ou None.
+    """
+    params = parametres()
+    commercant = livraison.commande.commercant
+    if params['fenetre_s'] <= 0 or commercant is None or livraison.adresse_livraison_point is None:
+        notifier_livraisons([livraison])
+        return None
+
+    maintenant = timezone.now()
+    plein = False
+    with transaction.atomic():
+        ouverts = LotLivraison.objects.select_for_update().filter(
+            commercant=commercant,
+            statut='ouvert',
+            date_cloture__gt=maintenant,
+        )
+        choisi, plus_proche = None, None
+        for lot in ouverts:
+            mesure = _distance_au_lot(lot, livraison.adresse_livraison_point)
+            if mesure is None:
+                continue
+            distance, taille = mesure
+            if taille >= params['taille_max'] or distance > params['rayon_km'] * 1000:
+                continue
+            if plus_proche is None or distance < plus_proche:
+                choisi, plus_proche = lot, distance
+                plein = taille + 1 >= params['taille_max']
+
+        if choisi is None:
+            choisi = LotLivraison.objects.create(
+                commercant=commercant,
+                date_cloture=maintenant + timedelta(seconds=params['fenetre_s']),
+            )
+            plein = params['taille_max'] <= 1
+
+        livraison.lot = choisi
+        livraison.save(update_fields=['lot', 'date_modification'])
+
+    if plein:
+        cloturer(choisi)
+    cloturer_si_necessaire()
+    return choisi
+
+
+def cloturer(lot):
+    """Rend un lot disponible et notifie les livreurs, une seule fois par lot"""
+    if not LotLivraison.objects.filter(id=lot.id, statut='ouvert').update(statut='disponible'):
+        # Déjà clôturé par un autre processus
+        return False
+    lot.statut = 'disponible'
+    # Les livraisons du lot entrent dans les listes des livreurs
+    lot.livraisons.update(date_modification=timezone.now())
+    livraisons = list(
+        lot.livraisons.filter(livreur__isnull=True, statut='attribuee').select_related('commande')
+    )
+    notifier_livraisons(livraisons, lot)
+    return True
+
+
+def cloturer_lots_echus():
+    """Clôture les lots dont la fenêtre de regroupement est écoulée. Retourne leur nombre."""
+    echus = LotLivraison.objects.filter(statut='ouvert', date_cloture__lte=timezone.now())
+    return sum(1 for lot in echus.select_related('commercant') if cloturer(lot))
+
+
+def cloturer_si_necessaire():
+    """Clôture les lots échus au plus une fois par intervalle, tous processus confondus"""
+    if cache.add(CLE_VERROU, True, INTERVALLE_CLOTURE):
+        return cloturer_lots_echus()
+    return 0
+
+
+def notifier_livraisons(livraisons, lot=None):
+    """
+    Notifie les livreurs disponibles les plus proches de la boutique :
+    une notification pour tout le lot plutôt qu'une par commande.
+    """
+    if not livraisons:
+        return
+    if len(livraisons) == 1:
+        from .signals import notifier_livreurs_proches
+        notifier_livreurs_proches(livraisons[0])
+        return
+
+    boutique_point = livraisons[0].boutique_point
+    if not boutique_point:
+        return
+    livreurs_proches = grille_livreurs.proches(boutique_point.y, boutique_point.x, rayon_km=10, k=5)
+    references = ', '.join(livraison.commande.reference for livraison in livraisons)
+    NotificationLivreur.objects.bulk_create([
+        NotificationLivreur(
+            livreur_id=livreur_id,
+            type_notification='nouvelle_livraison',
+            titre=f'{len(livraisons)} livraisons groupées disponibles',
+            message=f"{len(livraisons)} commandes à récupérer dans la même boutique près de "
+                    f"votre position : {references}",
+            donnees_supplementaires={
+                'lot_id': lot.id if lot else None,
+                'livraison_ids': [livraison.id for livraison in livraisons],
+                'livraison_id': livraisons[0].id,
+                'distance_km': round(distance / 1000, 1)
+            }
+        )
+        for livreur_id, distance in livreurs_proches
+    ])
@@ -0,0 +1,441 @@
+"""
+Calcul d'itinéraires routiers hors ligne sur un extrait OpenStreetMap.
+
+Le réseau routier de la zone desservie est lu une fois depuis un fichier
+``.osm`` (XML, éventuellement compressé en ``.gz`` ou ``.bz2``), puis
+prétraité par contraction hiérarchique (commande ``preparer_routage``) et
+enregistré dans un fichier ``.npz`` compact. Une requête n'explore ensuite
+que les arcs « montants » de la hiérarchie depuis le départ et l'arrivée :
+quelques centaines de nœuds au lieu de tout le graphe, soit quelques
+millisecondes par trajet.
+
+Les durées sont calculées avec des vitesses par type de voie adaptées à la
+circulation de Lomé (réglables par ``TNV_ROUTAGE_VITESSES``). Aucun service
+de calcul d'itinéraire externe n'est utilisé.
+"""
+import bz2
+import gzip
+import heapq
+import math
+import os
+import threading
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+
+from .distances import haversine_m
+
+# Vitesses moyennes constatées par type de voie (km/h)
+VITESSES_KMH = {
+    'motorway': 60, 'motorway_link': 40,
+    'trunk': 45, 'trunk_link': 35,
+    'primary': 35, 'primary_link': 30,
+    'secondary': 30, 'secondary_link': 25,
+    'tertiary': 25, 'tertiary_link': 20,
+    'unclassified': 20,
+    'residential': 18,
+    'living_street': 10,
+    'service': 12,
+    'track': 12,
+    'road': 20,
+}
+# Vitesse entre un point demandé et le nœud du réseau le plus proche (km/h)
+VITESSE_RACCORD_KMH = 10
+# Au-delà, un point est considéré hors du réseau (mètres)
+RACCORD_MAX_M = 2000
+# Nœuds explorés au plus par une recherche de témoin pendant la contraction
+LIMITE_TEMOIN = 60
+
+
+def vitesses():
+    return {**VITESSES_KMH, **getattr(settings, 'TNV_ROUTAGE_VITESSES', {})}
+
+
+# Lecture de l'extrait OpenStreetMap
+
+def _ouvrir(chemin):
+    if chemin.endswith('.gz'):
+        return gzip.open(chemin, 'rb')
+    if chemin.endswith('.bz2'):
+        return bz2.open(chemin, 'rb')
+    return open(chemin, 'rb')
+
+
+def _vitesse_voie(tags, table):
+    vitesse = table.get(tags.get('highway'))
+    if vitesse is None or tags.get('access') in ('no', 'private'):
+        return None
+    maxspeed = tags.get('maxspeed', '').split(' ')[0]
+    if maxspeed.isdigit():
+        # La limitation n'est qu'un plafond : la circulation reste plus lente
+        vitesse = min(vitesse, int(maxspeed))
+    return vitesse
+
+
+def _sens(tags):
+    """(sens direct, sens inverse) autorisés pour une voie"""
+    oneway = tags.get('oneway')
+    if oneway == '-1':
+        return False, True
+    if oneway in ('yes', 'true', '1'):
+        return True, False
+    if oneway in ('no', 'false', '0'):
+        return True, True
+    if tags.get('junction') in ('roundabout', 'circular') or tags.get('highway') == 'motorway':
+        return True, False
+    return True, True
+
+
+def lire_osm(chemin, table_vitesses=None):
+    """
+    Lit les voies carrossables d'un extrait OSM. Retourne (lats, lngs, arcs)
+    où ``arcs`` est une liste (origine, destination, duree_s, distance_m)
+    sur des indices de nœuds compacts.
+    """
+    table_vitesses = table_vitesses or vitesses()
+    coordonnees = {}
+    voies = []
+    with _ouvrir(chemin) as fichier:
+        for _, element in ET.iterparse(fichier, events=('end',)):
+            if element.tag == 'node':
+                coordonnees[int(element.get('id'))] = (float(element.get('lat')), float(element.get('lon')))
+                element.clear()
+            elif element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+                vitesse = _vitesse_voie(tags, table_vitesses)
+                if vitesse:
+                    noeuds = [int(nd.get('ref')) for nd in element.iter('nd')]
+                    voies.append((noeuds, vitesse, _sens(tags)))
+                element.clear()
+            elif element.tag == 'relation':
+                element.clear()
+
+    indices = {}
+    lats, lngs, arcs = [], [], []
+
+    def indice(osm_id):
+        if osm_id not in indices:
+            indices[osm_id] = len(lats)
+            lat, lng = coordonnees[osm_id]
+            lats.append(lat)
+            lngs.append(lng)
+        return indices[osm_id]
+
+    for noeuds, vitesse, (direct, inverse) in voies:
+        noeuds = [osm_id for osm_id in noeuds if osm_id in coordonnees]
+        for a, b in zip(noeuds, noeuds[1:]):
+            if a == b:
+                continue
+            distance = haversine_m(*coordonnees[a], *coordonnees[b])
+            duree = distance / (vitesse / 3.6)
+            u, v = indice(a), indice(b)
+            if direct:
+                arcs.append((u, v, duree, distance))
+            if inverse:
+                arcs.append((v, u, duree, distance))
+    return np.array(lats), np.array(lngs), arcs
+
+
+# Contraction hiérarchique
+
+def _temoin(sortants, source, exclu, cible_max, limite):
+    """Dijkstra local depuis source sans passer par exclu, borné en coût et en nœuds"""
+    couts = {source: 0.0}
+    tas = [(0.0, source)]
+    explores = 0
+    while tas and explores < limite:
+        cout, noeud = heapq.heappop(tas)
+        if cout > couts.get(noeud, math.inf):
+            continue
+        if cout > cible_max:
+            break
+        explores += 1
+        for voisin, (poids, _) in sortants[noeud].items():
+            if voisin == exclu:
+                continue
+            nouveau = cout + poids
+            if nouveau < couts.get(voisin, math.inf):
+                couts[voisin] = nouveau
+                heapq.heappush(tas, (nouveau, voisin))
+    return couts
+
+
+def _raccourcis(sortants, entrants, noeud, limite=LIMITE_TEMOIN):
+    """Raccourcis nécessaires pour contracter un nœud : [(u, w, poids, distance)]"""
+    raccourcis = []
+    successeurs = sortants[noeud]
+    if not successeurs:
+        return raccourcis
+    for u, (poids_u, distance_u) in entrants[noeud].items():
+        cible_max = poids_u + max(poids for poids, _ in successeurs.values())
+        couts = _temoin(sortants, u, noeud, cible_max, limite)
+        for w, (poids_w, distance_w) in successeurs.items():
+            if w == u:
+                continue
+            poids = poids_u + poids_w
+            if couts.get(w, math.inf) > poids:
+                raccourcis.append((u, w, poids, distance_u + distance_w))
+    return raccourcis
+
+
+def contracter(nombre_noeuds, arcs):
+    """
+    Ordonne les nœuds par contraction (différence d'arcs, voisins déjà
+    contractés et profondeur dans la hiérarchie) et retourne (rangs, aretes) où ``aretes`` contient les arcs
+    d'origine et les raccourcis : {(u, v): (duree_s, distance_m)}.
+    """
+    sortants = [dict() for _ in range(nombre_noeuds)]
+    entrants = [dict() for _ in range(nombre_noeuds)]
+    aretes = {}
+    for u, v, duree, distance in arcs:
+        if (u, v) not in aretes or aretes[(u, v)][0] > duree:
+            aretes[(u, v)] = (duree, distance)
+            sortants[u][v] = (duree, distance)
+            entrants[v][u] = (duree, distance)
+
+    voisins_contractes = [0] * nombre_noeuds
+    niveaux = [0] * nombre_noeuds
+
+    def priorite(noeud):
+        raccourcis = _raccourcis(sortants, entrants, noeud)
+        return (
+            2 * (len(raccourcis) - len(sortants[noeud]) - len(entrants[noeud])) +
+            voisins_contractes[noeud] + niveaux[noeud]
+        )
+
+    tas = [(priorite(noeud), noeud) for noeud in range(nombre_noeuds)]
+    heapq.heapify(tas)
+    rangs = np.full(nombre_noeuds, -1, dtype=np.int64)
+    rang = 0
+    while tas:
+        _, noeud = heapq.heappop(tas)
+        # Mise à jour paresseuse : la priorité a pu changer depuis l'insertion
+        actuelle = priorite(noeud)
+        if tas and actuelle > tas[0][0]:
+            heapq.heappush(tas, (actuelle, noeud))
+            continue
+
+        for u, w, poids, distance in _raccourcis(sortants, entrants, noeud):
+            if (u, w) not in aretes or aretes[(u, w)][0] > poids:
+                aretes[(u, w)] = (poids, distance)
+                sortants[u][w] = (poids, distance)
+                entrants[w][u] = (poids, distance)
+
+        for voisin in set(sortants[noeud]) | set(entrants[noeud]):
+            voisins_contractes[voisin] += 1
+            niveaux[voisin] = max(niveaux[voisin], niveaux[noeud] + 1)
+        for v in sortants[noeud]:
+            del entrants[v][noeud]
+        for u in entrants[noeud]:
+            del sortants[u][noeud]
+        sortants[noeud] = {}
+        entrants[noeud] = {}
+        rangs[noeud] = rang
+        rang += 1
+    return rangs, aretes
+
+
+def _csr(nombre_noeuds, origines, cibles, durees, distances):
+    ordre = np.argsort(origines, kind='stable')
+    debuts = np.zeros(nombre_noeuds + 1, dtype=np.int64)
+    np.add.at(debuts, np.asarray(origines, dtype=np.int64) + 1, 1)
+    return (
+        np.cumsum(debuts),
+        np.asarray(cibles, dtype=np.int64)[ordre],
+        np.asarray(durees, dtype=float)[ordre],
+        np.asarray(distances, dtype=float)[ordre],
+    )
+
+
+def preparer(chemin_osm, chemin_sortie, table_vitesses=None):
+    """Lit un extrait OSM, le contracte et enregistre le graphe. Retourne ses dimensions."""
+    lats, lngs, arcs = lire_osm(chemin_osm, table_vitesses)
+    n = len(lats)
+    rangs, aretes = contracter(n, arcs)
+
+    montants, descendants = ([], [], [], []), ([], [], [], [])
+    for (u, v), (duree, distance) in aretes.items():
+        if rangs[v] > rangs[u]:
+            # Parcouru depuis u par la recherche avant
+            cible, valeurs = montants, (u, v, duree, distance)
+        else:
+            # Parcouru depuis v par la recherche arrière
+            cible, valeurs = descendants, (v, u, duree, distance)
+        for liste, valeur in zip(cible, valeurs):
+            liste.append(valeur)
+
+    avant = _csr(n, *montants)
+    arriere = _csr(n, *descendants)
+    np.savez_compressed(
+        chemin_sortie,
+        lats=lats, lngs=lngs,
+        avant_debuts=avant[0], avant_cibles=avant[1], avant_durees=avant[2], avant_distances=avant[3],
+        arriere_debuts=arriere[0], arriere_cibles=arriere[1], arriere_durees=arriere[2],
+        arriere_distances=arriere[3],
+    )
+    return {'noeuds': n, 'arcs': len(arcs), 'aretes': len(aretes)}
+
+
+# Requêtes
+
+class GrapheRoutier:
+    """Graphe contracté chargé en mémoire, interrogé par recherches bidirectionnelles"""
+
+    def __init__(self, donnees):
+        self.lats = donnees['lats']
+        self.lngs = donnees['lngs']
+        self._avant = self._listes(donnees, 'avant')
+        self._arriere = self._listes(donnees, 'arriere')
+
+        # Recherche du nœud le plus proche sur une projection plane locale
+        from scipy.spatial import cKDTree
+        self._cos_lat = math.cos(math.radians(float(self.lats.mean())))
+        self._arbre = cKDTree(self._projeter(self.lats, self.lngs))
+
+    @classmethod
+    def charger(cls, chemin):
+        with np.load(chemin) as donnees:
+            return cls({cle: donnees[cle] for cle in donnees.files})
+
+    @staticmethod
+    def _listes(donnees, sens):
+        # Listes Python : bien plus rapides que NumPy pour un parcours élément par élément
+        debuts = donnees[f'{sens}_debuts'].tolist()
+        cibles = donnees[f'{sens}_cibles'].tolist()
+        durees = donnees[f'{sens}_durees'].tolist()
+        distances = donnees[f'{sens}_distances'].tolist()
+        return [
+            list(zip(cibles[a:b], durees[a:b], distances[a:b]))
+            for a, b in zip(debuts, debuts[1:])
+        ]
+
+    def _projeter(self, lats, lngs):
+        return np.column_stack((
+            np.radians(lngs) * self._cos_lat * 6371008.8,
+            np.radians(lats) * 6371008.8,
+        ))
+
+    def __len__(self):
+        return len(self.lats)
+
+    def raccorder(self, lats, lngs):
+        """Nœuds les plus proches et temps de raccordement (s) ; nœud -1 si hors réseau"""
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lngs = np.atleast_1d(np.asarray(lngs, dtype=float))
+        ecarts, noeuds = self._arbre.query(self._projeter(lats, lngs))
+        noeuds = np.where(ecarts <= RACCORD_MAX_M, noeuds, -1)
+        return noeuds, ecarts, ecarts / (VITESSE_RACCORD_KMH / 3.6)
+
+    @staticmethod
+    def _montee(adjacence, opposee, depart):
+        """
+        Espace de recherche montant : {nœud: (duree_s, distance_m)}. Un nœud
+        atteint plus vite par un nœud plus haut de la hiérarchie n'est pas
+        développé (« stall-on-demand ») : son coût n'est pas le plus court.
+        """
+        resultats = {}
+        tas = [(0.0, 0.0, depart)]
+        while tas:
+            duree, distance, noeud = heapq.heappop(tas)
+            if noeud in resultats:
+                continue
+            resultats[noeud] = (duree, distance)
+            if any(
+                voisin in resultats and resultats[voisin][0] + poids < duree
+                for voisin, poids, _ in opposee[noeud]
+            ):
+                continue
+            for voisin, poids, longueur in adjacence[noeud]:
+                if voisin not in resultats:
+                    heapq.heappush(tas, (duree + poids, distance + longueur, voisin))
+        return resultats
+
+    def _entre_noeuds(self, source, cible):
+        if source == cible:
+            return 0.0, 0.0
+        avant = self._montee(self._avant, self._arriere, source)
+        arriere = self._montee(self._arriere, self._avant, cible)
+        meilleur = (math.inf, math.inf)
+        for noeud, (duree, distance) in avant.items():
+            retour = arriere.get(noeud)
+            if retour is not None and duree + retour[0] < meilleur[0]:
+                meilleur = (duree + retour[0], distance + retour[1])
+        return meilleur
+
+    def trajet(self, lat1, lng1, lat2, lng2):
+        """(distance_m, duree_s) par la route, ou None si un point est hors réseau ou inaccessible"""
+        noeuds, ecarts, raccords = self.raccorder([lat1, lat2], [lng1, lng2])
+        if (noeuds < 0).any():
+            return None
+        duree, distance = self._entre_noeuds(int(noeuds[0]), int(noeuds[1]))
+        if math.isinf(duree):
+            return None
+        return distance + float(ecarts.sum()), duree + float(raccords.sum())
+
+    def matrice(self, sources, cibles):
+        """
+        Durées (s) et distances (m) de chaque source vers chaque cible,
+        sources et cibles étant des couples (lats, lngs). Méthode des seaux :
+        une recherche arrière par cible, une recherche avant par source.
+        Les couples inaccessibles valent +inf.
+        """
+        s_noeuds, s_ecarts, s_raccords = self.raccorder(*sources)
+        c_noeuds, c_ecarts, c_raccords = self.raccorder(*cibles)
+        durees = np.full((len(s_noeuds), len(c_noeuds)), np.inf)
+        distances = np.full_like(durees, np.inf)
+
+        seaux = defaultdict(list)
+        for j, noeud in enumerate(c_noeuds.tolist()):
+            if noeud < 0:
+                continue
+            for passage, (duree, distance) in self._montee(self._arriere, self._avant, noeud).items():
+                seaux[passage].append((j, duree, distance))
+
+        for i, noeud in enumerate(s_noeuds.tolist()):
+            if noeud < 0:
+                continue
+            ligne_durees, ligne_distances = durees[i], distances[i]
+            for passage, (duree, distance) in self._montee(self._avant, self._arriere, noeud).items():
+                for j, duree_retour, distance_retour in seaux.get(passage, ()):
+                    if duree + duree_retour < ligne_durees[j]:
+                        ligne_durees[j] = duree + duree_retour
+                        ligne_distances[j] = distance + distance_retour
+
+        durees += s_raccords[:, np.newaxis] + c_raccords[np.newaxis, :]
+        distances += s_ecarts[:, np.newaxis] + c_ecarts[np.newaxis, :]
+        return durees, distances
+
+    def un_vers_plusieurs(self, lat, lng, lats, lngs):
+        durees, distances = self.matrice(([lat], [lng]), (lats, lngs))
+        return durees[0], distances[0]
+
+
+_graphe = None
+_verrou = threading.Lock()
+
+
+def graphe():
+    """
+    Graphe routier de TNV_ROUTAGE_GRAPHE, chargé une fois par processus.
+    None si aucun graphe n'est configuré : les appelants reviennent alors
+    à la distance à vol d'oiseau.
+    """
+    global _graphe
+    chemin = getattr(settings, 'TNV_ROUTAGE_GRAPHE', None)
+    if not chemin or not os.path.exists(chemin):
+        return None
+    if _graphe is None:
+        with _verrou:
+            if _graphe is None:
+                _graphe = GrapheRoutier.charger(chemin)
+    return _graphe
+
+
+def trajet_points(point1, point2):
+    """(distance_m, duree_s) par la route entre deux Point GEOS, None si indisponible"""
+    reseau = graphe()
+    if reseau is None or point1 is None or point2 is None:
+        return None
+    return reseau.trajet(point1.y, point1.x, point2.y, point2.x)
@@ -0,0 +1,7 @@
+# routing.py
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'ws/livraisons/(?P<livraison_id>\d+)/suivi/$', consumers.SuiviLivraisonConsumer.as_asgi()),
+]
@@ -1,7 +1,9 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.utils import timezone
-from .models import Livraison, NotificationLivreur, Livreur
+from .models import Livraison, NotificationLivreur, Livreur, transition_livraison
+from .index_spatial import grille_livreurs
+from . import demande, eta, geofences, geometrie, regroupement, statistiques, suivi, synchro
 from clients.models import Commande
 
 
@@ -11,41 +13,58 @@ def creer_livraison_automatiquement(sender, instance, created, **kwargs):
     Crée automatiquement une livraison lorsqu'une commande est validée
     """
     if instance.statut == 'validee' and not hasattr(instance, 'livraison'):
-        # Créer une livraison automatiquement
-        livraison = Livraison.objects.create(
-            commande=instance,
-            statut='attribuee',
-            date_attribution=timezone.now(),
-            cout_livraison=500.00,  # Coût par défaut
-            instructions_speciales=instance.instructions_livraison
-        )
-        
-        # Calculer les coordonnées si disponibles
-        if instance.latitude_livraison and instance.longitude_livraison:
-            from django.contrib.gis.geos import Point
-            livraison.adresse_livraison_point = Point(
-                instance.longitude_livraison,
-                instance.latitude_livraison
-            )
-        
-        if instance.commercant and instance.commercant.latitude and instance.commercant.longitude:
-            from django.contrib.gis.geos import Point
-            livraison.boutique_point = Point(
-                instance.commercant.longitude,
-                instance.commercant.latitude
-            )
-        
-        livraison.save()
+        # Créer la livraison avec ses points (adresse de remise, boutique)
+        livraison, creee = geometrie.livraison_pour_commande(instance)
+        if not creee:
+            return
         
-        # Notifier les livreurs disponibles à proximité
-        notifier_livreurs_proches(livraison)
+        # Regrouper avec les autres commandes de la boutique ; les livreurs
+        # à proximité sont notifiés à la clôture du lot
+        regroupement.ajouter(livraison)
+
+
+@receiver(post_save, sender=Commande)
+def compter_demande(sender, instance, created, **kwargs):
+    """Ajoute la nouvelle commande à la carte de la demande"""
+    if created:
+        demande.compter(instance)
+
+
+def _statut_inchange(update_fields):
+    """Sauvegarde partielle ne touchant pas au statut (preuves, estimations...)"""
+    return update_fields is not None and 'statut' not in update_fields
+
+
+@receiver([post_save, transition_livraison], sender=Livraison)
+def diffuser_statut_livraison(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Tient à jour les livraisons suivies et les zones d'arrivée du livreur,
+    et prévient les abonnés du suivi en direct
+    """
+    if _statut_inchange(update_fields):
+        return
+    
+    def diffuser():
+        if instance.livreur_id:
+            suivi.invalider(instance.livreur_id)
+            geofences.invalider(instance.livreur_id)
+        if instance.statut != 'en_cours':
+            eta.oublier(instance.id)
+        if not created and instance.livreur_id:
+            suivi.publier_statut(instance)
+    
+    # Après la validation : une transition annulée par un rollback (voir
+    # terminer_livraison) n'est jamais annoncée ; immédiat hors transaction
+    transaction.on_commit(diffuser)
 
 
-@receiver(post_save, sender=Livraison)
-def notifier_changement_statut_livraison(sender, instance, created, **kwargs):
+@receiver([post_save, transition_livraison], sender=Livraison)
+def notifier_changement_statut_livraison(sender, instance, created, update_fields=None, **kwargs):
     """
     Notifie les changements de statut de livraison
     """
+    if _statut_inchange(update_fields):
+        return
     if not created and instance.livreur:
         # Créer une notification pour le livreur
         type_notification = {
@@ -77,6 +96,34 @@ def notifier_changement_statut_livraison(sender, instance, created, **kwargs):
             )
 
 
+@receiver(transition_livraison, sender=Livraison)
+def cumuler_statistiques_journalieres(sender, instance, **kwargs):
+    """Reporte l'acceptation ou la fin de la livraison sur la journée du livreur"""
+    if instance.statut == 'acceptee':
+        statistiques.noter_acceptation(instance)
+    elif instance.statut == 'terminee':
+        statistiques.noter_livraison_terminee(instance)
+
+
+@receiver(post_save, sender=Livreur)
+def synchroniser_index_livreur(sender, instance, **kwargs):
+    """
+    Tient l'index spatial à jour (position, disponibilité, mise en ligne)
+    """
+    grille_livreurs.synchroniser_livreur(instance)
+
+
+@receiver(post_delete, sender=Livraison)
+def noter_suppression_livraison(sender, instance, **kwargs):
+    """Signale la suppression aux listes synchronisées par curseur"""
+    synchro.noter_suppression(instance.id)
+
+
+@receiver(post_delete, sender=Livreur)
+def retirer_livreur_index(sender, instance, **kwargs):
+    grille_livreurs.retirer(instance.id)
+
+
 def notifier_livreurs_proches(livraison):
     """
     Notifie les livreurs disponibles à proximité d'une nouvelle livraison
@@ -84,26 +131,25 @@ def notifier_livreurs_proches(livraison):
     if not livraison.boutique_point:
         return
     
-    # Chercher les livreurs disponibles et en ligne à proximité
-    livreurs_proches = Livreur.objects.filter(
-        est_disponible=True,
-        est_en_ligne=True,
-        position_actuelle__isnull=False
-    ).filter(
-        position_actuelle__distance_lte=(livraison.boutique_point, 10000)  # 10km
-    ).annotate(
-        distance=models.functions.Distance('position_actuelle', livraison.boutique_point)
-    ).order_by('distance')[:5]  # Limiter aux 5 plus proches
+    # Les 5 livreurs disponibles et en ligne les plus proches, dans un rayon de 10 km
+    livreurs_proches = grille_livreurs.proches(
+        livraison.boutique_point.y,
+        livraison.boutique_point.x,
+        rayon_km=10,
+        k=5
+    )
     
-    for livreur in livreurs_proches:
-        NotificationLivreur.objects.create(
-            livreur=livreur,
+    NotificationLivreur.objects.bulk_create([
+        NotificationLivreur(
+            livreur_id=livreur_id,
             type_notification='nouvelle_livraison',
             titre='Nouvelle livraison disponible',
             message=f"Une nouvelle livraison est disponible près de votre position: {livraison.commande.reference}",
             donnees_supplementaires={
                 'livraison_id': livraison.id,
                 'commande_id': livraison.commande.id,
-                'distance_km': round(livreur.distance.m / 1000, 1)
+                'distance_km': round(distance / 1000, 1)
             }
-        )
\ No newline at end of file
+        )
+        for livreur_id, distance in livreurs_proches
+    ])
@@ -0,0 +1,236 @@
+"""
+Statistiques des livreurs.
+
+Les agrégats de ``Livreur`` (livraisons terminées, revenus, évaluations et
+sommes par critère, note moyenne) sont tenus à jour par des UPDATE F() au
+fil des événements, dans la transaction qui les produit (voir
+``Livraison.terminer_livraison`` et ``EvaluationLivreur.save``). La
+réconciliation les recalcule en bloc à partir des livraisons et des
+évaluations, pour détecter et corriger une dérive (modifications hors
+modèle, suppressions en masse...).
+
+L'activité jour par jour est cumulée de la même façon dans
+``StatistiqueJournaliereLivreur`` (acceptations, livraisons terminées,
+revenus, distance, évaluations) : une série de 30 jours se lit en une
+requête de 30 lignes au plus. La commande
+``reconstruire_statistiques_journalieres`` la recalcule depuis l'historique.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest, TruncDate
+from django.utils import timezone
+
+from .models import EvaluationLivreur, Livraison, Livreur, StatistiqueJournaliereLivreur
+
+CHAMPS_AGREGATS = (
+    'nombre_livraisons', 'revenus_total', 'nombre_evaluations', 'somme_notes',
+    'somme_ponctualite', 'somme_professionalisme', 'somme_securite', 'note_moyenne',
+)
+
+
+def agregats_attendus():
+    """{livreur_id: {champ: valeur}} recalculés par deux requêtes groupées"""
+    attendus = {}
+    livraisons = Livraison.objects.filter(
+        statut='terminee', livreur__isnull=False
+    ).values('livreur_id').annotate(
+        nombre=Count('id'), revenus=Sum('cout_livraison')
+    ).order_by()
+    for ligne in livraisons:
+        attendus.setdefault(ligne['livreur_id'], {}).update({
+            'nombre_livraisons': ligne['nombre'],
+            'revenus_total': ligne['revenus'] or Decimal('0.00'),
+        })
+
+    evaluations = EvaluationLivreur.objects.filter(
+        livraison__livreur__isnull=False
+    ).values('livraison__livreur_id').annotate(
+        nombre=Count('id'),
+        notes=Sum('note'),
+        ponctualite=Sum('ponctualite'),
+        professionalisme=Sum('professionalisme'),
+        securite=Sum('securite'),
+    ).order_by()
+    for ligne in evaluations:
+        attendus.setdefault(ligne['livraison__livreur_id'], {}).update({
+            'nombre_evaluations': ligne['nombre'],
+            'somme_notes': ligne['notes'],
+            'somme_ponctualite': ligne['ponctualite'],
+            'somme_professionalisme': ligne['professionalisme'],
+            'somme_securite': ligne['securite'],
+            'note_moyenne': round(Decimal(ligne['notes']) / ligne['nombre'], 2),
+        })
+    return attendus
+
+
+def reconcilier(corriger=False):
+    """
+    Compare les agrégats stockés aux agrégats recalculés. Retourne
+    {livreur_id: {champ: (stocké, attendu)}} des écarts ; avec ``corriger``,
+    les livreurs en écart sont réécrits en un ``bulk_update``.
+    """
+    zero = {
+        'nombre_livraisons': 0, 'revenus_total': Decimal('0.00'), 'nombre_evaluations': 0,
+        'somme_notes': 0, 'somme_ponctualite': 0, 'somme_professionalisme': 0,
+        'somme_securite': 0, 'note_moyenne': Decimal('0.00'),
+    }
+
+    ecarts = {}
+    a_corriger = []
+    with transaction.atomic():
+        livreurs = Livreur.objects.only('id', *CHAMPS_AGREGATS).order_by('id')
+        if corriger:
+            # Verrouiller avant de recalculer : un incrément concurrent attend la correction
+            livreurs = livreurs.select_for_update()
+        livreurs = list(livreurs)
+        attendus = agregats_attendus()
+        for livreur in livreurs:
+            attendu = {**zero, **attendus.get(livreur.id, {})}
+            differences = {
+                champ: (getattr(livreur, champ), attendu[champ])
+                for champ in CHAMPS_AGREGATS
+                if Decimal(getattr(livreur, champ)) != Decimal(attendu[champ])
+            }
+            if differences:
+                ecarts[livreur.id] = differences
+                if corriger:
+                    for champ, (_, valeur) in differences.items():
+                        setattr(livreur, champ, valeur)
+                    a_corriger.append(livreur)
+        if a_corriger:
+            Livreur.objects.bulk_update(a_corriger, CHAMPS_AGREGATS, batch_size=500)
+    return ecarts
+
+
+def _incrementer_jour(livreur_id, jour, **increments):
+    """
+    Ajoute les increments à la journée du livreur, créée au besoin. Les
+    compteurs ne descendent pas sous zéro : une journée absente ou déjà
+    dérivée (purge, historique antérieur à la table) n'est pas rendue
+    négative, la reconstruction la corrigera.
+    """
+    valeurs = {
+        champ: F(champ) + valeur if valeur >= 0 else Greatest(F(champ) + valeur, 0)
+        for champ, valeur in increments.items()
+    }
+    journees = StatistiqueJournaliereLivreur.objects.filter(livreur_id=livreur_id, jour=jour)
+    if journees.update(**valeurs):
+        return
+    increments = {champ: valeur for champ, valeur in increments.items() if valeur > 0}
+    if not increments:
+        # Rien à retirer d'une journée qui n'existe pas
+        return
+    try:
+        with transaction.atomic():
+            StatistiqueJournaliereLivreur.objects.create(livreur_id=livreur_id, jour=jour, **increments)
+    except IntegrityError:
+        # Créée entre-temps par une transition concurrente
+        journees.update(**valeurs)
+
+
+def noter_acceptation(livraison):
+    if livraison.livreur_id:
+        _incrementer_jour(
+            livraison.livreur_id,
+            timezone.localdate(livraison.date_acceptation or timezone.now()),
+            nombre_livraisons=1,
+        )
+
+
+def noter_livraison_terminee(livraison):
+    if livraison.livreur_id:
+        _incrementer_jour(
+            livraison.livreur_id,
+            timezone.localdate(livraison.date_fin_livraison or timezone.now()),
+            livraisons_terminees=1,
+            revenus=livraison.cout_livraison,
+            distance_km=livraison.distance_estimee or 0,
+        )
+
+
+def noter_evaluation(livreur_id, date_evaluation, ecart_nombre, ecart_note):
+    _incrementer_jour(
+        livreur_id,
+        timezone.localdate(date_evaluation),
+        nombre_evaluations=ecart_nombre,
+        somme_notes=ecart_note,
+    )
+
+
+def serie_journaliere(livreur, jours=30):
+    """
+    Activité des ``jours`` derniers jours (aujourd'hui compris), un élément
+    par jour, y compris les jours sans activité
+    """
+    aujourd_hui = timezone.localdate()
+    debut = aujourd_hui - timedelta(days=jours - 1)
+    journees = {
+        journee.jour: journee
+        for journee in StatistiqueJournaliereLivreur.objects.filter(livreur=livreur, jour__gte=debut)
+    }
+    resultat = []
+    for decalage in range(jours):
+        jour = debut + timedelta(days=decalage)
+        journee = journees.get(jour) or StatistiqueJournaliereLivreur(livreur=livreur, jour=jour)
+        resultat.append(journee)
+    return resultat
+
+
+def reconstruire_journees(depuis=None):
+    """
+    Recalcule les journées à partir du jour ``depuis`` (tout l'historique
+    si None) avec trois requêtes groupées. Retourne le nombre de journées écrites.
+    """
+    def _filtrer(requete, champ):
+        if depuis is None:
+            return requete
+        return requete.filter(**{f"{champ}__date__gte": depuis})
+
+    journees = {}
+
+    def _journee(livreur_id, jour):
+        if (livreur_id, jour) not in journees:
+            journees[livreur_id, jour] = StatistiqueJournaliereLivreur(livreur_id=livreur_id, jour=jour)
+        return journees[livreur_id, jour]
+
+    acceptees = _filtrer(Livraison.objects.filter(
+        livreur__isnull=False, date_acceptation__isnull=False
+    ), 'date_acceptation').annotate(jour=TruncDate('date_acceptation')).values(
+        'livreur_id', 'jour'
+    ).annotate(nombre=Count('id')).order_by()
+    for ligne in acceptees:
+        _journee(ligne['livreur_id'], ligne['jour']).nombre_livraisons = ligne['nombre']
+
+    terminees = _filtrer(Livraison.objects.filter(
+        livreur__isnull=False, statut='terminee', date_fin_livraison__isnull=False
+    ), 'date_fin_livraison').annotate(jour=TruncDate('date_fin_livraison')).values(
+        'livreur_id', 'jour'
+    ).annotate(
+        nombre=Count('id'), revenus=Sum('cout_livraison'), distance=Sum('distance_estimee')
+    ).order_by()
+    for ligne in terminees:
+        journee = _journee(ligne['livreur_id'], ligne['jour'])
+        journee.livraisons_terminees = ligne['nombre']
+        journee.revenus = ligne['revenus'] or Decimal('0.00')
+        journee.distance_km = ligne['distance'] or 0
+
+    evaluations = _filtrer(EvaluationLivreur.objects.filter(
+        livraison__livreur__isnull=False
+    ), 'date_evaluation').annotate(jour=TruncDate('date_evaluation')).values(
+        'livraison__livreur_id', 'jour'
+    ).annotate(nombre=Count('id'), notes=Sum('note')).order_by()
+    for ligne in evaluations:
+        journee = _journee(ligne['livraison__livreur_id'], ligne['jour'])
+        journee.nombre_evaluations = ligne['nombre']
+        journee.somme_notes = ligne['notes']
+
+    with transaction.atomic():
+        anciennes = StatistiqueJournaliereLivreur.objects.all()
+        if depuis is not None:
+            anciennes = anciennes.filter(jour__gte=depuis)
+        anciennes.delete()
+        StatistiqueJournaliereLivreur.objects.bulk_create(journees.values(), batch_size=1000)
+    return len(journees)
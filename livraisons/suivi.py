@@ -0,0 +1,111 @@
+"""
+Diffusion en temps réel de la position du livreur aux abonnés d'une livraison.
+
+Chaque livraison acceptée ou en cours a son groupe Channels
+(``suivi_livraison_<id>``) auquel s'abonnent le client, le commerçant et le
+livreur (voir consumers.SuiviLivraisonConsumer). L'ingestion des positions
+publie dans les groupes des livraisons actives du livreur, uniquement
+lorsqu'un fix est conservé par le filtre GPS, c'est-à-dire lorsque le
+livreur s'est réellement déplacé.
+
+Les livraisons actives de chaque livreur sont gardées dans le cache et
+invalidées à chaque changement de statut.
+"""
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+
+PREFIXE = 'tnv:suivi:livreur:'
+DUREE_CACHE = 300
+STATUTS_SUIVIS = ('acceptee', 'en_cours')
+
+
+def nom_groupe(livraison_id):
+    return f"suivi_livraison_{livraison_id}"
+
+
+def _cle(livreur_id):
+    return f"{PREFIXE}{livreur_id}"
+
+
+def _couche():
+    try:
+        from channels.layers import get_channel_layer
+    except ImportError:
+        return None
+    return get_channel_layer()
+
+
+def livraisons_suivies(livreur_id):
+    """Identifiants des livraisons acceptées ou en cours du livreur"""
+    from .models import Livraison
+    ids = cache.get(_cle(livreur_id))
+    if ids is None:
+        ids = list(Livraison.objects.filter(
+            livreur_id=livreur_id,
+            statut__in=STATUTS_SUIVIS
+        ).values_list('id', flat=True))
+        cache.set(_cle(livreur_id), ids, DUREE_CACHE)
+    return ids
+
+
+def invalider(livreur_id):
+    cache.delete(_cle(livreur_id))
+
+
+def message_position(latitude, longitude, timestamp, vitesse=None):
+    return {
+        'type': 'position.livreur',
+        'latitude': latitude,
+        'longitude': longitude,
+        'timestamp': timestamp.isoformat(),
+        'vitesse': vitesse,
+    }
+
+
+def publier_position(livreur_id, latitude, longitude, timestamp, vitesse=None):
+    """Envoie la position du livreur aux abonnés de ses livraisons actives"""
+    livraison_ids = livraisons_suivies(livreur_id)
+    if not livraison_ids:
+        return 0
+    couche = _couche()
+    if couche is None:
+        return 0
+    message = message_position(latitude, longitude, timestamp, vitesse)
+    for livraison_id in livraison_ids:
+        async_to_sync(couche.group_send)(nom_groupe(livraison_id), message)
+    return len(livraison_ids)
+
+
+def publier_statut(livraison):
+    """Envoie le nouveau statut d'une livraison à ses abonnés"""
+    couche = _couche()
+    if couche is None:
+        return
+    async_to_sync(couche.group_send)(nom_groupe(livraison.id), {
+        'type': 'statut.livraison',
+        'statut': livraison.statut,
+        'statut_display': livraison.get_statut_display(),
+    })
+
+
+def publier_arrivee(livraison_id, zone, timestamp):
+    """Signale aux abonnés l'arrivée du livreur à la boutique ou à l'adresse de remise"""
+    couche = _couche()
+    if couche is None:
+        return
+    async_to_sync(couche.group_send)(nom_groupe(livraison_id), {
+        'type': 'arrivee.livraison',
+        'zone': zone,
+        'timestamp': timestamp.isoformat(),
+    })
+
+
+def publier_eta(livraison_id, estimation):
+    """Envoie la nouvelle arrivée estimée aux abonnés de la livraison"""
+    couche = _couche()
+    if couche is None:
+        return
+    async_to_sync(couche.group_send)(nom_groupe(livraison_id), {
+        'type': 'eta.livraison',
+        **estimation,
+    })
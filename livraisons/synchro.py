@@ -0,0 +1,181 @@
+"""
+Synchronisation incrémentale des listes de livraisons (carte, livraisons
+disponibles).
+
+Chaque réponse porte un ``curseur_synchro`` ; renvoyé en paramètre
+``since``, il limite la réponse suivante aux livraisons modifiées depuis
+(``date_modification``), réparties entre celles qui font partie de la
+liste et celles qui en sont sorties (acceptées par un autre livreur,
+annulées, supprimées...). Le curseur recule d'un petit chevauchement pour
+ne pas manquer une transaction validée juste après la lecture précédente :
+une même livraison peut être renvoyée deux fois, ce qui est sans effet
+côté client.
+
+Pour une liste qui dépend de la position du livreur (livraisons
+disponibles), le curseur porte aussi cette position : au-delà de
+``DEPLACEMENT_MAX_M`` depuis le curseur, distances et rayon ont changé et
+la réponse est complète.
+
+Les suppressions sont gardées une heure dans le cache, une entrée par
+livraison supprimée, recensées dans un ensemble partagé (voir registre.py) :
+deux suppressions simultanées ne s'écrasent pas. Au-delà d'une heure, ou si
+le cache a été vidé, la réponse est complète (``complet`` vaut true). La
+forme complète porte un ETag et répond 304 si rien n'a changé.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+from . import registre
+from .distances import haversine_m
+from .models import Livraison
+
+CLE_SUPPRESSIONS = 'tnv:synchro:ensemble_suppressions'
+PREFIXE_SUPPRESSION = 'tnv:synchro:suppression:'
+CLE_DEBUT = 'tnv:synchro:debut'
+# Conservation des suppressions (secondes)
+RETENTION_SUPPRESSIONS = 3600
+# Recul du curseur couvrant les transactions en vol (secondes)
+CHEVAUCHEMENT = 5
+# Au-delà de ce nombre de changements, une réponse complète est plus simple
+LIMITE_CHANGEMENTS = 500
+# Déplacement au-delà duquel une liste dépendant de la position est renvoyée complète (mètres)
+DEPLACEMENT_MAX_M = 200
+
+
+def curseur(instant=None, position=None):
+    """Curseur ``instant`` ou, pour une liste dépendant de la position, ``instant:latitude:longitude``"""
+    _debut_historique()
+    valeur = f"{(instant or timezone.now()).timestamp():.6f}"
+    if position is not None:
+        valeur += f":{position.y:.6f}:{position.x:.6f}"
+    return valeur
+
+
+def lire_depuis(donnees):
+    """Instant du paramètre ``since``, ou None. ValueError s'il est mal formé."""
+    valeur = donnees.get('since')
+    if not valeur:
+        return None
+    try:
+        return datetime.fromtimestamp(float(valeur.split(':', 1)[0]), tz=dt_timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        raise ValueError("Paramètre since invalide.")
+
+
+def deplace(donnees, position):
+    """
+    Le livreur a-t-il changé de position depuis le curseur ``since`` ? Vrai
+    aussi si l'un des deux, curseur ou livreur, n'a pas de position.
+    """
+    parties = (donnees.get('since') or '').split(':')
+    if len(parties) != 3:
+        return position is not None
+    if position is None:
+        return True
+    try:
+        latitude, longitude = float(parties[1]), float(parties[2])
+    except ValueError:
+        return True
+    return haversine_m(latitude, longitude, position.y, position.x) > DEPLACEMENT_MAX_M
+
+
+def _debut_historique():
+    debut = cache.get(CLE_DEBUT)
+    if debut is None:
+        debut = timezone.now()
+        cache.set(CLE_DEBUT, debut, None)
+    return debut
+
+
+def _cle_suppression(livraison_id):
+    return f"{PREFIXE_SUPPRESSION}{livraison_id}"
+
+
+def noter_suppression(livraison_id):
+    """Garde la trace d'une livraison supprimée pour les clients en synchronisation"""
+    _debut_historique()
+    # L'entrée d'abord, l'identifiant ensuite (voir registre.retirer_absents)
+    cache.set(_cle_suppression(livraison_id), timezone.now(), RETENTION_SUPPRESSIONS)
+    registre.ajouter(CLE_SUPPRESSIONS, livraison_id)
+
+
+def _suppressions():
+    """{livraison_id: instant} des suppressions encore conservées"""
+    identifiants = registre.membres(CLE_SUPPRESSIONS)
+    if not identifiants:
+        return {}
+    entrees = cache.get_many([_cle_suppression(identifiant) for identifiant in identifiants])
+    suppressions = {
+        identifiant: entrees[_cle_suppression(identifiant)]
+        for identifiant in identifiants
+        if _cle_suppression(identifiant) in entrees
+    }
+    expirees = identifiants - suppressions.keys()
+    if expirees:
+        registre.retirer_absents(CLE_SUPPRESSIONS, expirees, lambda ids: {
+            identifiant for identifiant in ids if cache.get(_cle_suppression(identifiant)) is not None
+        })
+    return suppressions
+
+
+def historique_disponible(depuis):
+    """Les suppressions depuis cet instant sont-elles toutes connues ?"""
+    debut = _debut_historique()
+    return depuis >= debut and depuis >= timezone.now() - timedelta(seconds=RETENTION_SUPPRESSIONS)
+
+
+def changements(livraisons, depuis):
+    """
+    Livraisons modifiées depuis ``depuis`` : (présentes, retirees) où
+    ``présentes`` est la part de ``livraisons`` (queryset de la liste) qui
+    a changé et ``retirees`` les identifiants sortis de la liste ou
+    supprimés. Retourne None si une réponse complète est nécessaire.
+    """
+    if not historique_disponible(depuis):
+        return None
+    borne = depuis - timedelta(seconds=CHEVAUCHEMENT)
+    modifiees = list(
+        Livraison.objects.filter(date_modification__gt=borne)
+        .values_list('id', flat=True)[:LIMITE_CHANGEMENTS + 1]
+    )
+    if len(modifiees) > LIMITE_CHANGEMENTS:
+        return None
+
+    presentes = list(livraisons.filter(id__in=modifiees)) if modifiees else []
+    ids_presents = {livraison.id for livraison in presentes}
+    retirees = {identifiant for identifiant in modifiees if identifiant not in ids_presents}
+    retirees.update(
+        identifiant for identifiant, instant in _suppressions().items()
+        if instant > borne
+    )
+    return presentes, sorted(retirees)
+
+
+def reponse_conditionnelle(request, donnees):
+    """
+    Réponse JSON portant un ETag calculé sur son contenu (hors curseur, qui
+    change à chaque appel), ou 304 si le client possède déjà cette version
+    """
+    contenu = json.dumps(donnees, cls=DjangoJSONEncoder).encode()
+    version = json.dumps(
+        {cle: valeur for cle, valeur in donnees.items() if cle != 'curseur_synchro'},
+        cls=DjangoJSONEncoder, sort_keys=True
+    ).encode()
+    etag = f'"{hashlib.md5(version).hexdigest()}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(contenu, content_type='application/json')
+    response['ETag'] = etag
+    # Le navigateur garde la réponse mais la revalide à chaque appel
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response
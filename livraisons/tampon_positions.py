@@ -0,0 +1,127 @@
+"""
+Tampon d'écriture différée des positions courantes des livreurs.
+
+La dernière position de chaque livreur est conservée dans le cache partagé
+et recopiée dans ``livraisons_livreur`` à intervalle régulier, en une seule
+requête UPDATE multi-lignes. Les lectures (recherche, carte, itinéraire)
+passent par le tampon et voient donc toujours la position la plus récente.
+
+Les livreurs ayant une position en tampon forment un ensemble partagé
+(voir registre.py) : un livreur ajouté pendant un vidage n'est jamais perdu.
+"""
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+
+from . import registre
+
+PREFIXE = 'tnv:position:'
+PREFIXE_VIDEE = 'tnv:position:videe:'
+CLE_LIVREURS = 'tnv:positions:ensemble_livreurs'
+CLE_VERROU = 'tnv:positions:vidage'
+# Une entrée non rafraîchie pendant une heure est abandonnée (déjà en base)
+DUREE_ENTREE = 3600
+
+
+def intervalle_vidage():
+    return getattr(settings, 'TNV_TAMPON_POSITIONS_INTERVALLE', 10)
+
+
+def _cle(livreur_id):
+    return f"{PREFIXE}{livreur_id}"
+
+
+def _cle_videe(livreur_id):
+    return f"{PREFIXE_VIDEE}{livreur_id}"
+
+
+def enregistrer(livreur_id, latitude, longitude, timestamp):
+    """Mémorise la dernière position d'un livreur si elle est plus récente"""
+    actuelle = cache.get(_cle(livreur_id))
+    if actuelle is not None and actuelle[2] >= timestamp:
+        return False
+    # L'entrée d'abord, l'identifiant ensuite (voir registre.retirer_absents)
+    cache.set(_cle(livreur_id), (latitude, longitude, timestamp), DUREE_ENTREE)
+    registre.ajouter(CLE_LIVREURS, livreur_id)
+    return True
+
+
+def positions(livreur_ids):
+    """Retourne {livreur_id: (latitude, longitude, timestamp)} pour les livreurs présents dans le tampon"""
+    livreur_ids = list(livreur_ids)
+    entrees = cache.get_many([_cle(i) for i in livreur_ids])
+    return {
+        livreur_id: entrees[_cle(livreur_id)]
+        for livreur_id in livreur_ids
+        if _cle(livreur_id) in entrees
+    }
+
+
+def appliquer(*livreurs):
+    """Remplace en mémoire la position des livreurs par celle du tampon si elle est plus récente"""
+    tampon = positions(livreur.id for livreur in livreurs)
+    for livreur in livreurs:
+        entree = tampon.get(livreur.id)
+        if entree is None:
+            continue
+        latitude, longitude, timestamp = entree
+        if (livreur.derniere_position_mise_a_jour is None or
+                timestamp > livreur.derniere_position_mise_a_jour):
+            livreur.position_actuelle = Point(longitude, latitude, srid=4326)
+            livreur.derniere_position_mise_a_jour = timestamp
+    return livreurs
+
+
+def vider():
+    """
+    Écrit en base les positions modifiées depuis le dernier vidage.
+    Retourne le nombre de livreurs mis à jour.
+    """
+    from .models import Livreur
+
+    livreur_ids = registre.membres(CLE_LIVREURS)
+    if not livreur_ids:
+        return 0
+
+    entrees = cache.get_many([_cle(i) for i in livreur_ids])
+    videes = cache.get_many([_cle_videe(i) for i in livreur_ids])
+
+    expirees = set()
+    a_ecrire = []
+    for livreur_id in livreur_ids:
+        entree = entrees.get(_cle(livreur_id))
+        if entree is None:
+            expirees.add(livreur_id)
+            continue
+        if videes.get(_cle_videe(livreur_id)) == entree[2]:
+            continue
+        latitude, longitude, timestamp = entree
+        a_ecrire.append(Livreur(
+            id=livreur_id,
+            position_actuelle=Point(longitude, latitude, srid=4326),
+            derniere_position_mise_a_jour=timestamp
+        ))
+
+    if a_ecrire:
+        Livreur.objects.bulk_update(
+            a_ecrire,
+            ['position_actuelle', 'derniere_position_mise_a_jour'],
+            batch_size=500
+        )
+        cache.set_many({
+            _cle_videe(livreur.id): livreur.derniere_position_mise_a_jour
+            for livreur in a_ecrire
+        }, DUREE_ENTREE)
+
+    if expirees:
+        registre.retirer_absents(CLE_LIVREURS, expirees, lambda ids: set(positions(ids)))
+        cache.delete_many([_cle_videe(i) for i in expirees])
+
+    return len(a_ecrire)
+
+
+def vider_si_necessaire():
+    """Vide le tampon au plus une fois par intervalle, tous processus confondus"""
+    if cache.add(CLE_VERROU, True, intervalle_vidage()):
+        return vider()
+    return 0
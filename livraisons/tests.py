@@ -1,3 +1,131 @@
-from django.test import TestCase
+import threading
+from datetime import time
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
\ No newline at end of file
+from django.contrib.auth import get_user_model
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from clients.models import Client, Commande
+from commercants.models import Commercant
+from .models import Livraison, Livreur, NotificationLivreur
+
+User = get_user_model()
+
+
+def creer_livraison_et_livreurs(nombre_livreurs):
+    """Une livraison libre, hors regroupement, et ``nombre_livreurs`` livreurs"""
+    commercant = Commercant.objects.create(
+        user=User.objects.create_user('boutique', password='motdepasse'),
+        nom_boutique='Boutique',
+        categorie='alimentation',
+        horaire_ouverture=time(8),
+        horaire_fermeture=time(20),
+    )
+    client = Client.objects.create(user=User.objects.create_user('client', password='motdepasse'))
+    # Commande non validée : la livraison est créée ici, hors regroupement
+    commande = Commande.objects.create(
+        client=client,
+        commercant=commercant,
+        total=Decimal('2500.00'),
+        adresse_livraison='Lomé',
+    )
+    livraison = Livraison.objects.create(commande=commande, statut='attribuee')
+    livreurs = [
+        Livreur.objects.create(
+            user=User.objects.create_user(f'livreur{i}', password='motdepasse'),
+            permis_conduire='permis/test.jpg',
+            carte_grise='cartes_grises/test.jpg',
+            immatriculation=f'TG-{i:04d}',
+        )
+        for i in range(nombre_livreurs)
+    ]
+    return livraison, livreurs
+
+
+@skipUnless(connection.vendor == 'postgresql', "Requêtes réellement concurrentes : PostgreSQL requis")
+class AcceptationConcurrenteTests(TransactionTestCase):
+    """Plusieurs livreurs acceptent la même livraison au même instant"""
+    NOMBRE_LIVREURS = 50
+
+    def setUp(self):
+        self.livraison, self.livreurs = creer_livraison_et_livreurs(self.NOMBRE_LIVREURS)
+
+    def _accepter_en_parallele(self, livreurs):
+        barriere = threading.Barrier(len(livreurs))
+        resultats = {}
+
+        def accepter(livreur):
+            try:
+                # Chaque livreur a lu la livraison libre avant que quiconque l'accepte
+                livraison = Livraison.objects.get(id=self.livraison.id)
+                barriere.wait()
+                resultats[livreur.id] = livraison.accepter_livraison(livreur)
+            finally:
+                connections.close_all()
+
+        fils = [threading.Thread(target=accepter, args=(livreur,)) for livreur in livreurs]
+        for fil in fils:
+            fil.start()
+        for fil in fils:
+            fil.join()
+        return resultats
+
+    def test_un_seul_livreur_obtient_la_livraison(self):
+        resultats = self._accepter_en_parallele(self.livreurs)
+
+        gagnants = [livreur_id for livreur_id, gagne in resultats.items() if gagne]
+        self.assertEqual(len(resultats), self.NOMBRE_LIVREURS)
+        self.assertEqual(len(gagnants), 1)
+
+        self.livraison.refresh_from_db()
+        self.assertEqual(self.livraison.statut, 'acceptee')
+        self.assertEqual(self.livraison.livreur_id, gagnants[0])
+        self.assertEqual(
+            NotificationLivreur.objects.filter(type_notification='livraison_acceptee').count(), 1
+        )
+
+    def test_acceptation_tardive_sans_effet(self):
+        premier, second = self.livreurs[:2]
+        tardive = Livraison.objects.get(id=self.livraison.id)
+
+        self.assertTrue(self.livraison.accepter_livraison(premier))
+        self.assertFalse(tardive.accepter_livraison(second))
+
+        self.livraison.refresh_from_db()
+        self.assertEqual(self.livraison.livreur_id, premier.id)
+        self.assertEqual(tardive.statut, 'attribuee')
+
+
+class AcceptationVueTests(TestCase):
+    """Acceptation par la vue : estimation, notifications, transitions concurrentes"""
+
+    def setUp(self):
+        self.livraison, (self.livreur,) = creer_livraison_et_livreurs(1)
+        self.client.force_login(self.livreur.user)
+        self.url = reverse('livraisons:accepter_livraison', args=[self.livraison.id])
+
+    def test_une_seule_notification_d_acceptation(self):
+        reponse = self.client.post(self.url)
+
+        self.assertTrue(reponse.json()['success'])
+        self.livraison.refresh_from_db()
+        self.assertEqual(self.livraison.statut, 'acceptee')
+        self.assertEqual(
+            NotificationLivreur.objects.filter(type_notification='livraison_acceptee').count(), 1
+        )
+
+    def test_annulation_concurrente_non_ecrasee(self):
+        def annuler(livreur):
+            # Annulation validée entre l'acceptation et l'écriture de l'estimation
+            Livraison.objects.get(id=self.livraison.id).annuler_livraison()
+
+        with mock.patch('livraisons.views.tampon_positions.appliquer', side_effect=annuler):
+            reponse = self.client.post(self.url)
+
+        self.assertTrue(reponse.json()['success'])
+        self.livraison.refresh_from_db()
+        self.assertEqual(self.livraison.statut, 'annulee')
+        self.assertEqual(self.livraison.livreur_id, self.livreur.id)
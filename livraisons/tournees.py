@@ -0,0 +1,285 @@
+"""
+Ordonnancement des arrêts d'un livreur qui transporte plusieurs commandes.
+
+Chaque livraison acceptée donne deux arrêts (collecte à la boutique puis
+remise au client), une livraison en cours un seul (la remise). L'ordre des
+arrêts est construit par insertion au moindre coût des couples collecte /
+remise, puis amélioré par 2-opt et déplacement d'arrêts, en refusant toute
+séquence qui placerait une remise avant sa collecte.
+
+Les coûts sont des durées de trajet : par la route quand le graphe routier
+est disponible, à vol d'oiseau à vitesse moyenne sinon. Le point 0 est la
+position du livreur ; la tournée est ouverte (pas de retour au départ).
+"""
+import math
+import random
+
+import numpy as np
+
+from . import routage
+from .distances import matrice
+
+# Vitesse retenue sans graphe routier (km/h)
+VITESSE_DEFAUT_KMH = 30
+
+
+def matrice_trajets(lats, lngs):
+    """Durées (s) et distances (m) entre tous les points, par la route si possible"""
+    reseau = routage.graphe()
+    if reseau is not None:
+        durees, distances = reseau.matrice((lats, lngs), (lats, lngs))
+        if np.isfinite(durees).all():
+            return durees, distances
+    distances = matrice(lats, lngs, lats, lngs)
+    return distances / (VITESSE_DEFAUT_KMH / 3.6), distances
+
+
+# Heuristique
+
+def cout_sequence(sequence, durees):
+    """Durée totale d'une séquence d'arrêts depuis le point 0"""
+    total, precedent = 0.0, 0
+    for arret in sequence:
+        total += durees[precedent][arret]
+        precedent = arret
+    return total
+
+
+def respecte_precedences(sequence, precedences):
+    """Chaque arrêt de ``precedences`` (remise -> collecte) vient après sa collecte"""
+    positions = {arret: rang for rang, arret in enumerate(sequence)}
+    return all(
+        positions[collecte] < positions[remise]
+        for remise, collecte in precedences.items()
+        if collecte in positions and remise in positions
+    )
+
+
+def _meilleure_insertion(sequence, demande, durees):
+    """
+    Insertion la moins coûteuse d'une demande (collecte éventuelle, remise)
+    dans une séquence : retourne (surcoût, position collecte, position remise).
+    """
+    collecte, remise = demande
+    chemin = [0] + sequence + [None]
+
+    def c(a, b):
+        # Tournée ouverte : rien après le dernier arrêt
+        return 0.0 if b is None else durees[a][b]
+
+    meilleur = None
+    for j in range(len(chemin) - 1):
+        a, b = chemin[j], chemin[j + 1]
+        delta_remise = c(a, remise) + c(remise, b) - c(a, b)
+        if collecte is None:
+            candidats = [(delta_remise, None, j)]
+        else:
+            # Collecte juste avant la remise, dans le même intervalle
+            candidats = [(c(a, collecte) + durees[collecte][remise] + c(remise, b) - c(a, b), j, j)]
+            for i in range(j):
+                p, q = chemin[i], chemin[i + 1]
+                candidats.append((c(p, collecte) + c(collecte, q) - c(p, q) + delta_remise, i, j))
+        for candidat in candidats:
+            if meilleur is None or candidat[0] < meilleur[0]:
+                meilleur = candidat
+    return meilleur
+
+
+def _placer(sequence, demande, i, j):
+    collecte, remise = demande
+    sequence = list(sequence)
+    sequence.insert(j, remise)
+    if collecte is not None:
+        sequence.insert(i, collecte)
+    return sequence
+
+
+def _inserer(durees, demandes):
+    """
+    Insertion au moindre coût : à chaque tour, la demande dont l'insertion
+    coûte le moins est placée.
+    """
+    sequence = []
+    restantes = list(demandes)
+    while restantes:
+        (_, i, j), demande = min(
+            ((_meilleure_insertion(sequence, demande, durees), demande) for demande in restantes),
+            key=lambda candidat: candidat[0][0]
+        )
+        sequence = _placer(sequence, demande, i, j)
+        restantes.remove(demande)
+    return sequence
+
+
+def _ameliorer(sequence, durees, demandes, precedences):
+    """
+    Recherche locale tant qu'une séquence valide moins chère existe :
+    2-opt, déplacement d'un arrêt, et réinsertion d'une demande entière
+    (collecte et remise ensemble).
+    """
+    meilleur_cout = cout_sequence(sequence, durees)
+    ameliore = True
+    while ameliore:
+        ameliore = False
+        n = len(sequence)
+        for i in range(n - 1):
+            for j in range(i + 1, n):
+                candidats = (
+                    # 2-opt : inversion du segment i..j
+                    sequence[:i] + sequence[i:j + 1][::-1] + sequence[j + 1:],
+                    # Déplacement de l'arrêt i après j, et de l'arrêt j avant i
+                    sequence[:i] + sequence[i + 1:j + 1] + [sequence[i]] + sequence[j + 1:],
+                    sequence[:i] + [sequence[j]] + sequence[i:j] + sequence[j + 1:],
+                )
+                for candidat in candidats:
+                    cout = cout_sequence(candidat, durees)
+                    if cout < meilleur_cout - 1e-9 and respecte_precedences(candidat, precedences):
+                        sequence, meilleur_cout, ameliore = candidat, cout, True
+
+        for demande in demandes:
+            reste = [arret for arret in sequence if arret not in demande]
+            _, i, j = _meilleure_insertion(reste, demande, durees)
+            candidat = _placer(reste, demande, i, j)
+            cout = cout_sequence(candidat, durees)
+            if cout < meilleur_cout - 1e-9:
+                sequence, meilleur_cout, ameliore = candidat, cout, True
+    return sequence
+
+
+def optimiser(durees, demandes, perturbations=None):
+    """
+    Séquence d'arrêts de durée minimale (heuristique). ``demandes`` est une
+    liste de couples (collecte, remise) d'indices de points, la collecte
+    valant None quand le colis est déjà à bord. ``perturbations`` borne le
+    nombre de relances de la recherche locale (par défaut deux par demande).
+    """
+    durees = np.asarray(durees).tolist()
+    precedences = {remise: collecte for collecte, remise in demandes if collecte is not None}
+    meilleure = _ameliorer(_inserer(durees, demandes), durees, demandes, precedences)
+    meilleur_cout = cout_sequence(meilleure, durees)
+
+    # Perturbations : deux demandes retirées au hasard puis réinsérées,
+    # et recherche locale depuis ce nouveau point de départ
+    generateur = random.Random(0)
+    for _ in range(perturbations if perturbations is not None else 2 * len(demandes)):
+        if len(demandes) < 3:
+            break
+        retirees = generateur.sample(demandes, 2)
+        sequence = [arret for arret in meilleure if not any(arret in demande for demande in retirees)]
+        for demande in retirees:
+            _, i, j = _meilleure_insertion(sequence, demande, durees)
+            sequence = _placer(sequence, demande, i, j)
+        sequence = _ameliorer(sequence, durees, demandes, precedences)
+        cout = cout_sequence(sequence, durees)
+        if cout < meilleur_cout - 1e-9:
+            meilleure, meilleur_cout = sequence, cout
+    return meilleure
+
+
+def sequence_naive(demandes):
+    """Référence : les demandes l'une après l'autre, dans l'ordre d'acceptation"""
+    return [arret for collecte, remise in demandes for arret in (collecte, remise) if arret is not None]
+
+
+def sequence_exacte(durees, demandes):
+    """
+    Optimum par programmation dynamique sur les sous-ensembles d'arrêts
+    (référence pour le banc d'essai, exponentiel : réservé à 12 arrêts au plus).
+    """
+    arrets = sequence_naive(demandes)
+    rang = {arret: bit for bit, arret in enumerate(arrets)}
+    prerequis = {rang[remise]: rang[collecte] for collecte, remise in demandes if collecte is not None}
+    n = len(arrets)
+    couts = {(1 << b, b): (durees[0][arrets[b]], None) for b in range(n) if b not in prerequis}
+    for taille in range(1, n):
+        for (masque, dernier), (cout, _) in list(couts.items()):
+            if bin(masque).count('1') != taille:
+                continue
+            for b in range(n):
+                if masque & (1 << b) or (b in prerequis and not masque & (1 << prerequis[b])):
+                    continue
+                cle = (masque | (1 << b), b)
+                nouveau = cout + durees[arrets[dernier]][arrets[b]]
+                if cle not in couts or nouveau < couts[cle][0]:
+                    couts[cle] = (nouveau, dernier)
+
+    plein = (1 << n) - 1
+    dernier = min((b for b in range(n) if (plein, b) in couts), key=lambda b: couts[(plein, b)][0])
+    sequence, masque = [], plein
+    while dernier is not None:
+        sequence.append(arrets[dernier])
+        masque, dernier = masque & ~(1 << dernier), couts[(masque, dernier)][1]
+    return sequence[::-1]
+
+
+# Tournée d'un livreur
+
+def planifier_tournee(livreur, livraisons):
+    """
+    Ordonne les arrêts des livraisons actives d'un livreur depuis sa
+    position. Retourne (etapes, duree_totale_s, distance_totale_m) ; chaque
+    étape indique son type, sa livraison et les cumuls à l'arrivée.
+    """
+    lats = [livreur.position_actuelle.y]
+    lngs = [livreur.position_actuelle.x]
+    arrets = [None]
+    demandes = []
+
+    def ajouter(type_arret, livraison, point):
+        lats.append(point.y)
+        lngs.append(point.x)
+        arrets.append((type_arret, livraison))
+        return len(arrets) - 1
+
+    for livraison in livraisons:
+        if not livraison.adresse_livraison_point:
+            continue
+        collecte = None
+        if livraison.statut == 'acceptee' and livraison.boutique_point:
+            collecte = ajouter('collecte', livraison, livraison.boutique_point)
+        remise = ajouter('remise', livraison, livraison.adresse_livraison_point)
+        demandes.append((collecte, remise))
+
+    if not demandes:
+        return [], 0.0, 0.0
+
+    durees, distances = matrice_trajets(lats, lngs)
+    sequence = optimiser(durees, demandes)
+
+    etapes, duree, distance, precedent = [], 0.0, 0.0, 0
+    for indice in sequence:
+        duree += float(durees[precedent][indice])
+        distance += float(distances[precedent][indice])
+        precedent = indice
+        type_arret, livraison = arrets[indice]
+        etapes.append({
+            'type': type_arret,
+            'livraison': livraison,
+            'latitude': lats[indice],
+            'longitude': lngs[indice],
+            'duree_cumulee_s': round(duree),
+            'distance_cumulee_m': round(distance),
+        })
+    return etapes, duree, distance
+
+
+def instance_aleatoire(nombre_arrets, generateur, centre=(6.1375, 1.2125), etalement_km=3.0):
+    """
+    Instance de test : position de départ et ``nombre_arrets`` arrêts tirés
+    autour du centre, en couples collecte / remise (plus une remise seule
+    si le nombre est impair). Retourne (durees, demandes).
+    """
+    etalement = etalement_km / 111.32
+    nombre_points = nombre_arrets + 1
+    lats = centre[0] + generateur.normal(0, etalement, nombre_points)
+    lngs = centre[1] + generateur.normal(0, etalement / math.cos(math.radians(centre[0])), nombre_points)
+    durees = matrice(lats, lngs, lats, lngs) / (VITESSE_DEFAUT_KMH / 3.6)
+
+    indices = iter(range(1, nombre_points))
+    demandes = []
+    if nombre_arrets % 2:
+        demandes.append((None, next(indices)))
+    for collecte, remise in zip(indices, indices):
+        demandes.append((collecte, remise))
+    return durees, demandes
+
@@ -0,0 +1,119 @@
+"""
+Simplification et encodage des trajectoires des livreurs.
+
+La simplification suit Douglas–Peucker : chaque point reçoit une
+importance (l'écart, en mètres, à partir duquel l'algorithme le retient).
+Une tolérance garde les points plus importants qu'elle ; un budget garde
+les N points les plus importants. Les extrémités sont toujours conservées.
+"""
+import math
+
+import numpy as np
+
+METRES_PAR_DEGRE_LAT = 110574.0
+METRES_PAR_DEGRE_LNG = 111320.0
+
+
+def _projeter(points):
+    """Projection équirectangulaire locale (mètres), suffisante à l'échelle d'une ville"""
+    lats = np.fromiter((p[0] for p in points), dtype=float, count=len(points))
+    lngs = np.fromiter((p[1] for p in points), dtype=float, count=len(points))
+    cos_lat = math.cos(math.radians(lats[0]))
+    return lngs * METRES_PAR_DEGRE_LNG * cos_lat, lats * METRES_PAR_DEGRE_LAT
+
+
+def _distances_segment(xs, ys, ax, ay, bx, by):
+    """Distances des points (xs, ys) au segment [a, b] en coordonnées projetées"""
+    dx, dy = bx - ax, by - ay
+    longueur2 = dx * dx + dy * dy
+    if longueur2 == 0:
+        return np.hypot(xs - ax, ys - ay)
+    t = np.clip(((xs - ax) * dx + (ys - ay) * dy) / longueur2, 0.0, 1.0)
+    return np.hypot(xs - (ax + t * dx), ys - (ay + t * dy))
+
+
+def importances(points):
+    """
+    Importance Douglas–Peucker de chaque point (mètres). Les points sont des
+    tuples dont les deux premiers éléments sont latitude et longitude.
+    """
+    n = len(points)
+    if n == 0:
+        return []
+    xs, ys = _projeter(points)
+    resultat = [0.0] * n
+    resultat[0] = resultat[-1] = math.inf
+
+    # Pile explicite : pas de récursion sur des dizaines de milliers de points
+    pile = [(0, n - 1, math.inf)]
+    while pile:
+        debut, fin, borne = pile.pop()
+        if fin <= debut + 1:
+            continue
+        distances = _distances_segment(
+            xs[debut + 1:fin], ys[debut + 1:fin],
+            xs[debut], ys[debut], xs[fin], ys[fin]
+        )
+        position = int(distances.argmax())
+        indice = debut + 1 + position
+        # Un point n'est jamais plus important que le point qui l'a fait découper
+        ecart = min(float(distances[position]), borne)
+        resultat[indice] = ecart
+        pile.append((debut, indice, ecart))
+        pile.append((indice, fin, ecart))
+    return resultat
+
+
+def simplifier(points, tolerance_m=None, max_points=None):
+    """Retourne les points conservés pour une tolérance et/ou un budget donnés"""
+    if len(points) <= 2 or (tolerance_m is None and max_points is None):
+        return list(points)
+
+    poids = importances(points)
+    seuil = -1.0
+    if tolerance_m is not None:
+        seuil = tolerance_m
+    if max_points is not None and max_points < len(points):
+        max_points = max(max_points, 2)
+        # Importance du max_points-ième point le plus important
+        seuil = max(seuil, sorted(poids, reverse=True)[max_points - 1])
+        # Les ex aequo au seuil complètent le budget dans l'ordre du trajet
+        reste = max_points - sum(1 for w in poids if w > seuil)
+        conserves = []
+        for point, w in zip(points, poids):
+            if w > seuil:
+                conserves.append(point)
+            elif w == seuil and reste > 0:
+                conserves.append(point)
+                reste -= 1
+        return conserves
+    return [p for p, w in zip(points, poids) if w > seuil]
+
+
+def _encoder_valeur(valeur):
+    valeur = ~(valeur << 1) if valeur < 0 else (valeur << 1)
+    morceaux = []
+    while valeur >= 0x20:
+        morceaux.append(chr((0x20 | (valeur & 0x1f)) + 63))
+        valeur >>= 5
+    morceaux.append(chr(valeur + 63))
+    return ''.join(morceaux)
+
+
+def encoder_polyline(points, precision=5, precedent=None):
+    """
+    Encode des points (latitude, longitude, ...) au format « encoded polyline »
+    de Google. Générateur : le résultat peut être diffusé au fil de l'eau.
+    ``precedent`` est le dernier point déjà encodé, pour poursuivre un
+    encodage commencé par un appel précédent.
+    """
+    facteur = 10 ** precision
+    precedent_lat = precedent_lng = 0
+    if precedent is not None:
+        precedent_lat = int(round(precedent[0] * facteur))
+        precedent_lng = int(round(precedent[1] * facteur))
+    for point in points:
+        lat = int(round(point[0] * facteur))
+        lng = int(round(point[1] * facteur))
+        yield _encoder_valeur(lat - precedent_lat) + _encoder_valeur(lng - precedent_lng)
+        precedent_lat, precedent_lng = lat, lng
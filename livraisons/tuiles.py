@@ -0,0 +1,228 @@
+"""
+Tuiles vectorielles (Mapbox Vector Tile) des boutiques et des livraisons
+ouvertes, pour la carte interactive.
+
+Sous PostGIS, la tuile est produite par la base (``ST_AsMVT``) ; ailleurs
+(SpatiaLite en développement), les points sont lus par l'ORM et encodés
+ici. Les deux couches ne contiennent que des données communes à tous les
+livreurs, si bien qu'une tuile est mise en cache une fois pour tous, avec
+une durée qui dépend du zoom : courte aux zooms forts, où l'on suit les
+livraisons de près, plus longue aux zooms faibles.
+"""
+import struct
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from . import carte
+
+PREFIXE = 'tnv:carte:tuile:'
+ETENDUE = 4096
+# Marge autour de la tuile, en unités de tuile (comme le tampon de ST_AsMVTGeom)
+TAMPON = 64
+
+PARAMETRES_DEFAUT = {
+    # (zoom maximal, durée de cache en secondes), par zoom croissant
+    'durees_cache': ((11, 300), (14, 60), (22, 15)),
+}
+
+
+def parametres():
+    return {**PARAMETRES_DEFAUT, **getattr(settings, 'TNV_TUILES', {})}
+
+
+def duree_cache(z, params=None):
+    params = params or parametres()
+    for zoom_max, duree in params['durees_cache']:
+        if z <= zoom_max:
+            return duree
+    return params['durees_cache'][-1][1]
+
+
+def tuile(z, x, y):
+    """Tuile z/x/y encodée, depuis le cache si possible"""
+    cle = f"{PREFIXE}{z}:{x}:{y}"
+    contenu = cache.get(cle)
+    if contenu is None:
+        if connection.vendor == 'postgresql':
+            contenu = tuile_postgis(z, x, y)
+        else:
+            contenu = encoder(tuile_couches(z, x, y), ETENDUE)
+        cache.set(cle, contenu, duree_cache(z))
+    return contenu
+
+
+# Génération par PostGIS
+
+def tuile_postgis(z, x, y):
+    from commercants.models import Commercant
+    from .models import Livraison
+
+    commercants = Commercant._meta.db_table
+    utilisateurs = Commercant._meta.get_field('user').related_model._meta.db_table
+    livraisons = Livraison._meta.db_table
+    commandes = Livraison._meta.get_field('commande').related_model._meta.db_table
+    lots = Livraison._meta.get_field('lot').related_model._meta.db_table
+    marge = TAMPON / ETENDUE
+
+    requete = f"""
+        WITH bornes AS (
+            SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom,
+                   ST_Transform(
+                       ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => %(marge)s), 4326
+                   ) AS geom_4326
+        ),
+        boutiques AS (
+            SELECT c.id, c.nom_boutique AS nom, c.categorie,
+                   ST_AsMVTGeom(
+                       ST_Transform(ST_SetSRID(ST_MakePoint(u.longitude::float8, u.latitude::float8), 4326), 3857),
+                       bornes.geom, {ETENDUE}, {TAMPON}, true
+                   ) AS geom
+            FROM {commercants} c
+            JOIN {utilisateurs} u ON u.id = c.user_id, bornes
+            WHERE c.est_actif
+              AND u.latitude IS NOT NULL AND u.longitude IS NOT NULL
+              AND ST_SetSRID(ST_MakePoint(u.longitude::float8, u.latitude::float8), 4326) && bornes.geom_4326
+        ),
+        ouvertes AS (
+            SELECT l.id, co.reference, l.cout_livraison::float8 AS cout_livraison,
+                   ST_AsMVTGeom(
+                       ST_Transform(l.adresse_livraison_point, 3857), bornes.geom, {ETENDUE}, {TAMPON}, true
+                   ) AS geom
+            FROM {livraisons} l
+            JOIN {commandes} co ON co.id = l.commande_id
+            LEFT JOIN {lots} lot ON lot.id = l.lot_id, bornes
+            WHERE l.livreur_id IS NULL AND l.statut = 'attribuee'
+              AND (l.lot_id IS NULL OR lot.statut <> 'ouvert')
+              AND l.adresse_livraison_point && bornes.geom_4326
+        )
+        SELECT COALESCE((SELECT ST_AsMVT(boutiques.*, 'boutiques', {ETENDUE}, 'geom', 'id')
+                         FROM boutiques WHERE geom IS NOT NULL), ''::bytea)
+            || COALESCE((SELECT ST_AsMVT(ouvertes.*, 'livraisons', {ETENDUE}, 'geom', 'id')
+                         FROM ouvertes WHERE geom IS NOT NULL), ''::bytea)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(requete, {'z': z, 'x': x, 'y': y, 'marge': marge})
+        return bytes(cursor.fetchone()[0])
+
+
+# Génération en Python
+
+def tuile_couches(z, x, y):
+    """
+    Couches de la tuile lues par l'ORM : {nom: [(id, latitude, longitude,
+    propriétés), ...]}
+    """
+    from commercants.models import Commercant
+    from .models import Livraison
+
+    ouest, sud, est, nord = carte.emprise_tuile(z, x, y, marge_px=TAMPON * carte.TAILLE_TUILE / ETENDUE)
+
+    boutiques = [
+        (identifiant, latitude, longitude, {'nom': nom, 'categorie': categorie})
+        for identifiant, latitude, longitude, nom, categorie in Commercant.objects.filter(
+            est_actif=True,
+            user__latitude__range=(sud, nord),
+            user__longitude__range=(ouest, est)
+        ).values_list('id', 'user__latitude', 'user__longitude', 'nom_boutique', 'categorie')
+    ]
+    livraisons = [
+        (identifiant, point.y, point.x, {'reference': reference, 'cout_livraison': float(cout)})
+        for identifiant, point, reference, cout in Livraison.objects.filter(
+            livreur__isnull=True,
+            statut='attribuee',
+            adresse_livraison_point__within=carte.polygone((ouest, sud, est, nord))
+        ).exclude(
+            lot__statut='ouvert'
+        ).values_list('id', 'adresse_livraison_point', 'commande__reference', 'cout_livraison')
+    ]
+
+    return {
+        'boutiques': _positions(boutiques, z, x, y),
+        'livraisons': _positions(livraisons, z, x, y),
+    }
+
+
+def _positions(points, z, x, y):
+    """(id, colonne, ligne, propriétés) en unités de tuile"""
+    if not points:
+        return []
+    colonnes, lignes = carte.pixels([point[1] for point in points], [point[2] for point in points], z)
+    echelle = ETENDUE / carte.TAILLE_TUILE
+    return [
+        (point[0], round((colonne - x * carte.TAILLE_TUILE) * echelle),
+         round((ligne - y * carte.TAILLE_TUILE) * echelle), point[3])
+        for point, colonne, ligne in zip(points, colonnes, lignes)
+    ]
+
+
+# Encodage protobuf (vector_tile.proto, version 2)
+
+def _varint(valeur):
+    octets = bytearray()
+    while True:
+        octet = valeur & 0x7F
+        valeur >>= 7
+        if valeur:
+            octets.append(octet | 0x80)
+        else:
+            octets.append(octet)
+            return bytes(octets)
+
+
+def _zigzag(valeur):
+    return (valeur << 1) ^ (valeur >> 63)
+
+
+def _champ(numero, type_fil, contenu):
+    if type_fil == 0:
+        return _varint(numero << 3) + _varint(contenu)
+    return _varint(numero << 3 | 2) + _varint(len(contenu)) + contenu
+
+
+def _valeur(valeur):
+    """Message Value : chaîne, double, entier ou booléen"""
+    if isinstance(valeur, bool):
+        return _champ(7, 0, int(valeur))
+    if isinstance(valeur, int):
+        return _champ(6, 0, _zigzag(valeur))
+    if isinstance(valeur, float):
+        return _varint(3 << 3 | 1) + struct.pack('<d', valeur)
+    return _champ(1, 2, str(valeur).encode('utf-8'))
+
+
+def _couche(nom, entites, etendue):
+    cles, valeurs = {}, {}
+    corps = bytearray()
+    for identifiant, colonne, ligne, proprietes in entites:
+        if not (-TAMPON <= colonne <= etendue + TAMPON and -TAMPON <= ligne <= etendue + TAMPON):
+            continue
+        etiquettes = []
+        for cle, valeur in proprietes.items():
+            if valeur is None:
+                continue
+            etiquettes.append(cles.setdefault(cle, len(cles)))
+            etiquettes.append(valeurs.setdefault((type(valeur), valeur), len(valeurs)))
+        # Un seul point : MoveTo (commande 1, répétée 1 fois) depuis l'origine
+        geometrie = _varint(9) + _varint(_zigzag(colonne)) + _varint(_zigzag(ligne))
+        entite = (
+            _champ(1, 0, identifiant)
+            + _champ(2, 2, b''.join(_varint(etiquette) for etiquette in etiquettes))
+            + _champ(3, 0, 1)
+            + _champ(4, 2, geometrie)
+        )
+        corps += _champ(2, 2, entite)
+
+    if not corps:
+        return b''
+    contenu = _champ(15, 0, 2) + _champ(1, 2, nom.encode('utf-8')) + bytes(corps)
+    contenu += b''.join(_champ(3, 2, cle.encode('utf-8')) for cle in cles)
+    contenu += b''.join(_champ(4, 2, _valeur(valeur)) for _, valeur in valeurs)
+    contenu += _champ(5, 0, etendue)
+    return _champ(3, 2, contenu)
+
+
+def encoder(couches, etendue=ETENDUE):
+    """Tuile MVT des couches {nom: [(id, colonne, ligne, propriétés), ...]}"""
+    return b''.join(_couche(nom, entites, etendue) for nom, entites in couches.items())
@@ -19,6 +19,8 @@ urlpatterns = [
     path('carte/', views.carte_interactive, name='carte'),
     path('carte/boutiques/', views.api_boutiques_carte, name='api_boutiques_carte'),
     path('carte/livraisons/', views.api_livraisons_carte, name='api_livraisons_carte'),
+    path('carte/tiles/<int:z>/<int:x>/<int:y>.mvt', views.api_tuile_carte, name='api_tuile_carte'),
+    path('carte/demande/', views.api_demande_carte, name='api_demande_carte'),
     
     # Gestion des livraisons
     path('livraisons/', views.liste_livraisons, name='liste_livraisons'),
@@ -41,10 +43,13 @@ urlpatterns = [
     
     # API Endpoints
     path('api/position/mettre-a-jour/', views.api_mettre_a_jour_position, name='api_mettre_a_jour_position'),
+    path('api/position/lot/', views.api_positions_lot, name='api_positions_lot'),
     path('api/disponibilite/', views.api_gerer_disponibilite, name='api_gerer_disponibilite'),
+    path('api/presence/', views.api_presence, name='api_presence'),
     path('api/livraisons/disponibles/', views.api_livraisons_disponibles, name='api_livraisons_disponibles'),
     path('api/livraisons/proches/', views.api_livraisons_proches, name='api_livraisons_proches'),
     path('api/itineraire/<int:livraison_id>/', views.api_itineraire, name='api_itineraire'),
+    path('api/tournee/', views.api_tournee, name='api_tournee'),
     path('api/position/historique/', views.api_historique_positions, name='api_historique_positions'),
     path('api/statistiques/', views.api_statistiques, name='api_statistiques'),
     path('api/notifications/', views.api_notifications, name='api_notifications'),
@@ -2,14 +2,11 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count, Avg, Sum
-from django.http import JsonResponse
+from django.db.models import Q, Count, Sum
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods, require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
-from django.contrib.gis.geos import Point
-from django.contrib.gis.measure import Distance
-from django.contrib.gis.db.models.functions import Distance as GISDistance
 from django.core.paginator import Paginator
 from django.urls import reverse
 import json
@@ -22,6 +19,12 @@ from .forms import (
     RechercheLivraisonForm
 )
 from .models import Livreur, Livraison, PositionLivreur, EvaluationLivreur, NotificationLivreur
+from . import carte, demande, eta, presence, regroupement, synchro, tampon_positions, tuiles
+from .positions import ingerer_positions, parser_fixes
+from .recherche import livraisons_proches, parametres_recherche
+from .statistiques import serie_journaliere
+from .tournees import planifier_tournee
+from .trajectoire import encoder_polyline, simplifier
 from clients.models import Commande
 from commercants.models import Commercant
 from django.contrib.auth import get_user_model
@@ -190,27 +193,20 @@ def livraisons_disponibles(request):
         messages.error(request, 'Vous n\'avez pas de profil livreur.')
         return redirect('livraisons:inscription')
     
-    # Livraisons sans livreur assigné
-    livraisons = Livraison.objects.filter(
-        livreur__isnull=True,
-        statut='attribuee'
-    ).select_related('commande', 'commande__client')
+    # Position la plus récente, éventuellement pas encore écrite en base
+    tampon_positions.appliquer(livreur)
     
-    # Filtrer par proximité si le livreur a une position
-    if livreur.position_actuelle:
-        livraisons_proches = []
-        for livraison in livraisons:
-            if livraison.boutique_point:
-                distance = livreur.calculer_distance(livraison.boutique_point)
-                if distance and distance <= 10000:  # 10km max
-                    livraison.distance_km = distance / 1000
-                    livraisons_proches.append(livraison)
-        
-        livraisons_proches.sort(key=lambda x: x.distance_km)
-        livraisons = livraisons_proches
+    # Rendre disponibles les lots dont la fenêtre de regroupement est écoulée
+    regroupement.cloturer_si_necessaire()
+    
+    # Livraisons sans livreur assigné, les plus proches d'abord
+    params = parametres_recherche(request.GET)
+    livraisons, curseur_suivant = livraisons_proches(livreur.position_actuelle, **params)
     
     context = {
         'livraisons': livraisons,
+        'curseur_suivant': curseur_suivant,
+        'rayon_km': params['rayon_km'],
     }
     
     return render(request, 'livraisons/livraisons_disponibles.html', context)
@@ -224,6 +220,8 @@ def detail_livraison(request, livraison_id):
         messages.error(request, 'Vous n\'avez pas de profil livreur.')
         return redirect('livraisons:inscription')
     
+    tampon_positions.appliquer(livreur)
+    
     livraison = get_object_or_404(Livraison, id=livraison_id, livreur=livreur)
     
     # Calculer l'itinéraire si nécessaire
@@ -246,24 +244,48 @@ def accepter_livraison(request, livraison_id):
     except Livreur.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Profil livreur non trouvé.'})
     
-    livraison = get_object_or_404(Livraison, id=livraison_id, livreur__isnull=True)
+    # Livraison libre, ou proposée à ce livreur par le dispatch
+    livraison = get_object_or_404(
+        Livraison,
+        Q(livreur__isnull=True) | Q(livreur=livreur, statut='attribuee'),
+        id=livraison_id
+    )
+    
+    # Un lot encore en regroupement n'est pas proposé : ses livraisons attendent sa clôture
+    if livraison.lot_id and livraison.lot.statut == 'ouvert':
+        return JsonResponse({
+            'success': False,
+            'message': 'Cette livraison est en cours de regroupement, réessayez dans quelques instants.'
+        }, status=409)
     
     try:
-        livraison.assigner_livreur(livreur)
-        livraison.accepter_livraison()
+        # Une livraison groupée engage tout son lot : une seule course
+        if livraison.lot_id and livraison.lot.statut == 'disponible':
+            acceptees = livraison.lot.accepter(livreur)
+        elif livraison.accepter_livraison(livreur):
+            acceptees = [livraison]
+        else:
+            acceptees = []
         
-        # Créer une notification
-        NotificationLivreur.objects.create(
-            livreur=livreur,
-            type_notification='livraison_acceptee',
-            titre='Livraison acceptée',
-            message=f'Vous avez accepté la livraison {livraison.id}',
-            donnees_supplementaires={'livraison_id': livraison.id}
-        )
+        # Deux livreurs qui acceptent en même temps : un seul l'emporte
+        if not acceptees:
+            return JsonResponse({
+                'success': False,
+                'message': 'Cette livraison vient d\'être acceptée par un autre livreur.'
+            }, status=409)
+        
+        # Estimation depuis la position en tampon ; la transition a déjà
+        # notifié le livreur (voir signals.py)
+        tampon_positions.appliquer(livreur)
+        for acceptee in acceptees:
+            acceptee.livreur = livreur
+            acceptee.calculer_distance_et_duree()
         
         return JsonResponse({
             'success': True,
-            'message': 'Livraison acceptée avec succès.',
+            'message': 'Livraison acceptée avec succès.' if len(acceptees) == 1
+                       else f'{len(acceptees)} livraisons groupées acceptées avec succès.',
+            'livraison_ids': [acceptee.id for acceptee in acceptees],
             'redirect_url': reverse('livraisons:detail_livraison', args=[livraison_id])
         })
         
@@ -282,7 +304,11 @@ def commencer_livraison(request, livraison_id):
     livraison = get_object_or_404(Livraison, id=livraison_id, livreur=livreur)
     
     try:
-        livraison.commencer_livraison()
+        if not livraison.commencer_livraison():
+            return JsonResponse({
+                'success': False,
+                'message': 'Seule une livraison acceptée peut être commencée.'
+            }, status=409)
         
         # Mettre à jour la position du livreur à la boutique (méthode sécurisée)
         if livraison.boutique_point:
@@ -329,22 +355,18 @@ def terminer_livraison(request, livraison_id):
     livraison = get_object_or_404(Livraison, id=livraison_id, livreur=livreur)
     
     try:
-        # Gérer les fichiers de preuve
+        # Gérer les fichiers de preuve (seules les colonnes du formulaire sont écrites)
         form = LivraisonForm(request.POST, request.FILES, instance=livraison)
         if form.is_valid():
-            form.save()
+            form.save(commit=False).save(update_fields=list(form.Meta.fields) + ['date_modification'])
         
-        livraison.terminer_livraison()
-        
-        # Créer une notification
-        NotificationLivreur.objects.create(
-            livreur=livreur,
-            type_notification='livraison_terminee',
-            titre='Livraison terminée',
-            message=f'La livraison {livraison.id} a été terminée avec succès.',
-            donnees_supplementaires={'livraison_id': livraison.id}
-        )
+        if not livraison.terminer_livraison():
+            return JsonResponse({
+                'success': False,
+                'message': 'Seule une livraison en cours peut être terminée.'
+            }, status=409)
         
+        # La transition a déjà notifié le livreur (voir signals.py)
         return JsonResponse({
             'success': True,
             'message': 'Livraison terminée avec succès.',
@@ -417,26 +439,21 @@ def statistiques(request):
         messages.error(request, 'Vous n\'avez pas de profil livreur.')
         return redirect('livraisons:inscription')
     
-    # Statistiques générales
-    total_livraisons = Livraison.objects.filter(livreur=livreur).count()
-    livraisons_terminees = Livraison.objects.filter(livreur=livreur, statut='terminee').count()
-    
-    # Revenus
-    revenus_total = Livraison.objects.filter(
-        livreur=livreur,
-        statut='terminee'
-    ).aggregate(total=Sum('cout_livraison'))['total'] or Decimal('0.00')
-    
-    # Évaluations
-    evaluations = EvaluationLivreur.objects.filter(livraison__livreur=livreur)
-    note_moyenne = evaluations.aggregate(avg=Avg('note'))['avg'] or 0
+    # Livraisons acceptées : cumul des journées ; livraisons terminées, revenus
+    # et évaluations : agrégats tenus à jour sur le livreur
+    total_livraisons = livreur.statistiques_journalieres.aggregate(
+        total=Sum('nombre_livraisons')
+    )['total'] or 0
     
     context = {
         'total_livraisons': total_livraisons,
-        'livraisons_terminees': livraisons_terminees,
-        'revenus_total': revenus_total,
-        'note_moyenne': round(note_moyenne, 1),
-        'nombre_evaluations': evaluations.count(),
+        'livraisons_terminees': livreur.nombre_livraisons,
+        'revenus_total': livreur.revenus_total,
+        'note_moyenne': round(livreur.note_moyenne, 1),
+        'nombre_evaluations': livreur.nombre_evaluations,
+        'moyenne_ponctualite': livreur.moyenne_ponctualite,
+        'moyenne_professionalisme': livreur.moyenne_professionalisme,
+        'moyenne_securite': livreur.moyenne_securite,
     }
     
     return render(request, 'livraisons/statistiques.html', context)
@@ -511,17 +528,12 @@ def api_mettre_a_jour_position(request):
     
     try:
         data = json.loads(request.body)
-        latitude = float(data.get('latitude'))
-        longitude = float(data.get('longitude'))
+        fixes = parser_fixes([data])
+        if not fixes:
+            return JsonResponse({'success': False, 'message': 'Coordonnées invalides.'})
         
-        # Mettre à jour la position du livreur
-        livreur.mettre_a_jour_position(latitude, longitude)
-        
-        # Enregistrer dans l'historique des positions
-        PositionLivreur.objects.create(
-            livreur=livreur,
-            position=Point(longitude, latitude)
-        )
+        # Mettre à jour la position du livreur et l'historique
+        ingerer_positions(livreur, fixes)
         
         return JsonResponse({
             'success': True,
@@ -531,6 +543,29 @@ def api_mettre_a_jour_position(request):
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)})
 
+@login_required
+@require_http_methods(["POST"])
+def api_positions_lot(request):
+    """API pour enregistrer un lot de positions horodatées du livreur"""
+    try:
+        livreur = request.user.livreur
+    except Livreur.DoesNotExist:
+        return JsonResponse({'success': False, 'message': 'Profil livreur non trouvé.'})
+    
+    try:
+        data = json.loads(request.body)
+        fixes = parser_fixes(data.get('positions', []))
+        resultat = ingerer_positions(livreur, fixes)
+        
+        return JsonResponse({
+            'success': True,
+            'message': 'Positions enregistrées.',
+            **resultat
+        })
+        
+    except Exception as e:
+        return JsonResponse({'success': False, 'message': str(e)})
+
 @login_required
 @require_http_methods(["POST"])
 def api_gerer_disponibilite(request):
@@ -544,166 +579,271 @@ def api_gerer_disponibilite(request):
         data = json.loads(request.body)
         livreur.est_disponible = data.get('est_disponible', False)
         livreur.est_en_ligne = data.get('est_en_ligne', False)
-        livreur.save()
+        
+        # La présence est tenue par les battements de cœur (voir presence.py)
+        if livreur.est_en_ligne:
+            presence.battement(livreur.id)
+        else:
+            presence.deconnecter(livreur.id)
+        livreur.save(update_fields=['est_disponible', 'est_en_ligne'])
         
         return JsonResponse({
             'success': True,
-            'message': 'Disponibilité mise à jour.'
+            'message': 'Disponibilité mise à jour.',
+            'intervalle_battement_s': presence.duree() // 3
         })
         
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)})
 
 @login_required
-def api_livraisons_disponibles(request):
-    """API pour obtenir les livraisons disponibles"""
+@require_POST
+def api_presence(request):
+    """Battement de cœur : garde le livreur en ligne pour la durée d'un battement"""
     try:
         livreur = request.user.livreur
     except Livreur.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Profil livreur non trouvé.'})
     
-    livraisons = Livraison.objects.filter(
-        livreur__isnull=True,
-        statut='attribuee'
-    ).select_related('commande', 'commande__client')
+    presence.battement(livreur.id)
+    presence.balayer_si_necessaire()
     
-    livraisons_data = []
-    for livraison in livraisons:
-        distance = None
-        if livreur.position_actuelle and livraison.boutique_point:
-            distance = livreur.calculer_distance(livraison.boutique_point)
-        
-        livraisons_data.append({
-            'id': livraison.id,
-            'reference_commande': livraison.commande.reference,
-            'client_nom': f"{livraison.commande.client.first_name} {livraison.commande.client.last_name}",
-            'adresse_livraison': livraison.commande.adresse_livraison,
-            'cout_livraison': float(livraison.cout_livraison),
-            'distance_metres': distance,
-            'boutique_nom': livraison.commande.commercant.nom_boutique if livraison.commande.commercant else 'Non spécifié',
-        })
+    return JsonResponse({
+        'success': True,
+        'intervalle_battement_s': presence.duree() // 3
+    })
+
+def _donnees_livraison_disponible(livraison):
+    return {
+        'id': livraison.id,
+        'reference_commande': livraison.commande.reference,
+        'client_nom': f"{livraison.commande.client.first_name} {livraison.commande.client.last_name}",
+        'adresse_livraison': livraison.commande.adresse_livraison,
+        'cout_livraison': float(livraison.cout_livraison),
+        'distance_metres': getattr(livraison, 'distance_metres', None),
+        'boutique_nom': livraison.commande.commercant.nom_boutique if livraison.commande.commercant else 'Non spécifié',
+        'lot_id': livraison.lot_id,
+    }
+
+@login_required
+def api_livraisons_disponibles(request):
+    """
+    API pour obtenir les livraisons disponibles. Avec ``since``, la première
+    page est renvoyée sous forme d'ordre (identifiants et distances de chaque
+    livraison listée), avec les seules données des livraisons modifiées
+    depuis (voir synchro.py) ; la réponse est complète si le livreur s'est
+    déplacé depuis le curseur ou si une page suivante est demandée.
+    """
+    try:
+        livreur = request.user.livreur
+    except Livreur.DoesNotExist:
+        return JsonResponse({'success': False, 'message': 'Profil livreur non trouvé.'})
     
-    # Trier par distance
-    livraisons_data.sort(key=lambda x: x['distance_metres'] if x['distance_metres'] else float('inf'))
+    try:
+        depuis = synchro.lire_depuis(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    tampon_positions.appliquer(livreur)
+    regroupement.cloturer_si_necessaire()
+    
+    params = parametres_recherche(request.GET)
+    position = livreur.position_actuelle
+    # Lu avant les données : un changement concurrent sera vu au prochain appel
+    curseur_synchro = synchro.curseur(position=position)
+    livraisons, curseur_suivant = livraisons_proches(position, **params)
+    
+    if depuis is not None and params['curseur'] is None and not synchro.deplace(request.GET, position):
+        delta = synchro.changements(
+            Livraison.objects.filter(id__in=[livraison.id for livraison in livraisons]), depuis
+        )
+        if delta is not None:
+            modifiees = {livraison.id for livraison in delta[0]}
+            return JsonResponse({
+                'success': True,
+                'complet': False,
+                'ordre': [
+                    {'id': livraison.id, 'distance_metres': getattr(livraison, 'distance_metres', None)}
+                    for livraison in livraisons
+                ],
+                'livraisons': [
+                    _donnees_livraison_disponible(livraison)
+                    for livraison in livraisons if livraison.id in modifiees
+                ],
+                'supprimees': delta[1],
+                'curseur_suivant': curseur_suivant,
+                'curseur_synchro': curseur_synchro,
+            })
     
-    return JsonResponse({
+    return synchro.reponse_conditionnelle(request, {
         'success': True,
-        'livraisons': livraisons_data
+        'complet': True,
+        'livraisons': [_donnees_livraison_disponible(livraison) for livraison in livraisons],
+        'supprimees': [],
+        'curseur_suivant': curseur_suivant,
+        'curseur_synchro': curseur_synchro,
     })
 
 @login_required
 def api_boutiques_carte(request):
-    """API pour obtenir les boutiques pour la carte"""
-    boutiques = Commercant.objects.filter(est_actif=True)
+    """
+    API des boutiques pour la carte : GeoJSON limité à l'emprise ``bbox``,
+    regroupé aux zooms faibles (voir carte.py)
+    """
+    try:
+        emprise, zoom = carte.lire_emprise(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    boutiques = Commercant.objects.filter(
+        est_actif=True,
+        user__latitude__isnull=False,
+        user__longitude__isnull=False
+    )
+    emprise = carte.emprise_alignee(emprise, zoom)
+    if emprise:
+        ouest, sud, est, nord = emprise
+        boutiques = boutiques.filter(
+            user__latitude__range=(sud, nord),
+            user__longitude__range=(ouest, est)
+        )
     
-    boutiques_data = []
-    for boutique in boutiques:
-        boutiques_data.append({
+    isoles, entites = carte.regrouper(
+        boutiques.values_list('id', 'user__latitude', 'user__longitude'), zoom
+    )
+    for boutique in Commercant.objects.filter(id__in=isoles).select_related('user'):
+        entites.append(carte.entite(boutique.latitude, boutique.longitude, {
             'id': boutique.id,
             'nom': boutique.nom_boutique,
             'categorie': boutique.get_categorie_display(),
             'adresse': boutique.adresse,
-            'latitude': float(boutique.latitude) if boutique.latitude else None,
-            'longitude': float(boutique.longitude) if boutique.longitude else None,
             'telephone': boutique.telephone,
             'horaires': f"{boutique.horaire_ouverture} - {boutique.horaire_fermeture}",
-        })
+        }))
     
-    return JsonResponse({
-        'success': True,
-        'boutiques': boutiques_data
-    })
+    return JsonResponse(carte.collection(entites, success=True))
+
+def _entite_livraison_carte(livraison, livreur):
+    proprietes = {
+        'id': livraison.id,
+        'reference_commande': livraison.commande.reference,
+        'statut': livraison.statut,
+        'statut_display': livraison.get_statut_display(),
+        'client_nom': f"{livraison.commande.client.first_name} {livraison.commande.client.last_name}",
+        'adresse_livraison': livraison.commande.adresse_livraison,
+        'cout_livraison': float(livraison.cout_livraison),
+        'est_assignee_a_livreur': livraison.livreur_id == livreur.id,
+        'boutique_nom': None,
+        'latitude_boutique': None,
+        'longitude_boutique': None,
+    }
+    if livraison.boutique_point:
+        proprietes.update({
+            'boutique_nom': livraison.commande.commercant.nom_boutique if livraison.commande.commercant else None,
+            'latitude_boutique': float(livraison.boutique_point.y),
+            'longitude_boutique': float(livraison.boutique_point.x),
+        })
+    return carte.entite(
+        livraison.adresse_livraison_point.y, livraison.adresse_livraison_point.x, proprietes
+    )
 
 @login_required
 def api_livraisons_carte(request):
-    """API pour obtenir les livraisons pour la carte"""
+    """
+    API des livraisons pour la carte : GeoJSON des adresses de remise dans
+    l'emprise ``bbox``, regroupées aux zooms faibles (voir carte.py). Sans
+    regroupement, ``since`` limite la réponse aux changements (voir synchro.py).
+    """
     try:
         livreur = request.user.livreur
     except Livreur.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Profil livreur non trouvé.'})
     
-    # Livraisons disponibles et livraisons du livreur
+    try:
+        emprise, zoom = carte.lire_emprise(request.GET)
+        depuis = synchro.lire_depuis(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    curseur_synchro = synchro.curseur()
+    
+    # Livraisons disponibles et livraisons du livreur ; lecture seule : les
+    # points sont calculés à la création (voir geometrie.py et la commande
+    # materialiser_points)
     livraisons = Livraison.objects.filter(
         Q(livreur__isnull=True, statut='attribuee') | 
-        Q(livreur=livreur)
-    ).select_related('commande', 'commande__client', 'commande__commercant')
+        Q(livreur=livreur),
+        adresse_livraison_point__isnull=False
+    ).exclude(
+        # Comme la liste des disponibles : pas de lot encore en regroupement
+        lot__statut='ouvert'
+    )
+    emprise = carte.emprise_alignee(emprise, zoom)
+    if emprise:
+        livraisons = livraisons.filter(adresse_livraison_point__within=carte.polygone(emprise))
+    livraisons = livraisons.select_related('commande', 'commande__client', 'commande__commercant')
+    
+    # Les groupes dépendent de tous les points : pas de différentiel
+    if depuis is not None and not carte.regroupement_actif(zoom):
+        delta = synchro.changements(livraisons, depuis)
+        if delta is not None:
+            presentes, retirees = delta
+            return JsonResponse(carte.collection(
+                [_entite_livraison_carte(livraison, livreur) for livraison in presentes],
+                success=True, complet=False, supprimees=retirees, curseur_synchro=curseur_synchro
+            ))
+    
+    isoles, entites = carte.regrouper(
+        (
+            (livraison_id, point.y, point.x)
+            for livraison_id, point in livraisons.values_list('id', 'adresse_livraison_point')
+        ),
+        zoom
+    )
+    entites.extend(
+        _entite_livraison_carte(livraison, livreur)
+        for livraison in livraisons.filter(id__in=isoles)
+    )
     
-    livraisons_data = []
-    for livraison in livraisons:
-        # Calculer les coordonnées si elles n'existent pas - CORRIGÉ
-        if not livraison.adresse_livraison_point:
-            try:
-                if (livraison.commande.latitude_livraison and 
-                    livraison.commande.longitude_livraison and
-                    float(livraison.commande.latitude_livraison) != 0 and 
-                    float(livraison.commande.longitude_livraison) != 0):
-                    
-                    livraison.adresse_livraison_point = Point(
-                        float(livraison.commande.longitude_livraison),
-                        float(livraison.commande.latitude_livraison)
-                    )
-                    livraison.save()
-            except (ValueError, TypeError, AttributeError) as e:
-                print(f"Erreur création point livraison: {e}")
-        
-        if not livraison.boutique_point and livraison.commande.commercant:
-            try:
-                if (livraison.commande.commercant.latitude and 
-                    livraison.commande.commercant.longitude and
-                    float(livraison.commande.commercant.latitude) != 0 and 
-                    float(livraison.commande.commercant.longitude) != 0):
-                    
-                    livraison.boutique_point = Point(
-                        float(livraison.commande.commercant.longitude),
-                        float(livraison.commande.commercant.latitude)
-                    )
-                    livraison.save()
-            except (ValueError, TypeError, AttributeError) as e:
-                print(f"Erreur création point boutique: {e}")
-        
-        # Préparer les données pour la réponse
-        livraison_dict = {
-            'id': livraison.id,
-            'reference_commande': livraison.commande.reference,
-            'statut': livraison.statut,
-            'statut_display': livraison.get_statut_display(),
-            'client_nom': f"{livraison.commande.client.first_name} {livraison.commande.client.last_name}",
-            'adresse_livraison': livraison.commande.adresse_livraison,
-            'cout_livraison': float(livraison.cout_livraison),
-            'est_assignee_a_livreur': livraison.livreur == livreur,
-        }
-        
-        # Ajouter les coordonnées seulement si elles existent
-        if livraison.adresse_livraison_point:
-            livraison_dict.update({
-                'latitude_livraison': float(livraison.adresse_livraison_point.y),
-                'longitude_livraison': float(livraison.adresse_livraison_point.x),
-            })
-        else:
-            livraison_dict.update({
-                'latitude_livraison': None,
-                'longitude_livraison': None,
-            })
-            
-        if livraison.boutique_point:
-            livraison_dict.update({
-                'boutique_nom': livraison.commande.commercant.nom_boutique if livraison.commande.commercant else None,
-                'latitude_boutique': float(livraison.boutique_point.y),
-                'longitude_boutique': float(livraison.boutique_point.x),
-            })
-        else:
-            livraison_dict.update({
-                'boutique_nom': None,
-                'latitude_boutique': None,
-                'longitude_boutique': None,
-            })
-        
-        livraisons_data.append(livraison_dict)
+    return synchro.reponse_conditionnelle(request, carte.collection(
+        entites, success=True, complet=True, supprimees=[], curseur_synchro=curseur_synchro
+    ))
+
+
+@login_required
+def api_tuile_carte(request, z, x, y):
+    """Tuile vectorielle (MVT) des boutiques et des livraisons ouvertes"""
+    if z > 22 or x >= 2 ** z or y >= 2 ** z:
+        raise Http404("Tuile inexistante.")
+    
+    response = HttpResponse(tuiles.tuile(z, x, y), content_type='application/vnd.mapbox-vector-tile')
+    response['Cache-Control'] = f"private, max-age={tuiles.duree_cache(z)}"
+    return response
+
+
+@login_required
+def api_demande_carte(request):
+    """
+    Carte de la demande : commandes des ``heures`` dernières heures par
+    cellule hexagonale dans l'emprise ``bbox`` (voir demande.py)
+    """
+    if not (request.user.is_superuser or hasattr(request.user, 'livreur')):
+        return JsonResponse({'success': False, 'message': 'Accès non autorisé.'}, status=403)
     
-    return JsonResponse({
-        'success': True,
-        'livraisons': livraisons_data
-    })
+    try:
+        emprise, _ = carte.lire_emprise(request.GET)
+        heures = demande.lire_heures(request.GET)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    entites, maximum = demande.entites(emprise, heures)
+    return JsonResponse(carte.collection(
+        entites,
+        success=True,
+        heures=heures,
+        maximum=maximum,
+        taille_cellule_m=demande.parametres()['taille_cellule_m'],
+    ))
 
 
 @login_required
@@ -714,6 +854,8 @@ def api_itineraire(request, livraison_id):
     except Livreur.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Profil livreur non trouvé.'})
     
+    tampon_positions.appliquer(livreur)
+    
     livraison = get_object_or_404(Livraison, id=livraison_id, livreur=livreur)
     
     itineraire_data = {
@@ -726,6 +868,8 @@ def api_itineraire(request, livraison_id):
         'cout_livraison': float(livraison.cout_livraison),
         'distance_estimee': livraison.distance_estimee,
         'duree_estimee': livraison.duree_estimee,
+        # Arrivée estimée d'après les dernières positions (voir eta.py)
+        'eta': eta.lire(livraison.id) if livraison.statut == 'en_cours' else None,
     }
     
     # Points de l'itinéraire
@@ -755,6 +899,55 @@ def api_itineraire(request, livraison_id):
         'itineraire': itineraire_data
     })
 
+@login_required
+def api_tournee(request):
+    """API : ordre optimisé des collectes et remises des livraisons en cours du livreur"""
+    try:
+        livreur = request.user.livreur
+    except Livreur.DoesNotExist:
+        return JsonResponse({'success': False, 'message': 'Profil livreur non trouvé.'})
+    
+    tampon_positions.appliquer(livreur)
+    if not livreur.position_actuelle:
+        return JsonResponse({'success': False, 'message': 'Position du livreur inconnue.'})
+    
+    livraisons = Livraison.objects.filter(
+        livreur=livreur,
+        statut__in=['acceptee', 'en_cours']
+    ).select_related('commande', 'commande__client', 'commande__commercant').order_by('date_acceptation', 'id')
+    
+    etapes, duree, distance = planifier_tournee(livreur, livraisons)
+    
+    etapes_data = []
+    for etape in etapes:
+        livraison = etape['livraison']
+        commercant = livraison.commande.commercant
+        if etape['type'] == 'collecte':
+            nom = commercant.nom_boutique if commercant else 'Boutique'
+            adresse = commercant.adresse if commercant else ''
+        else:
+            nom = f"{livraison.commande.client.first_name} {livraison.commande.client.last_name}"
+            adresse = livraison.commande.adresse_livraison
+        etapes_data.append({
+            'type': etape['type'],
+            'livraison_id': livraison.id,
+            'reference_commande': livraison.commande.reference,
+            'nom': nom,
+            'adresse': adresse,
+            'latitude': etape['latitude'],
+            'longitude': etape['longitude'],
+            'duree_cumulee_min': round(etape['duree_cumulee_s'] / 60),
+            'distance_cumulee_km': round(etape['distance_cumulee_m'] / 1000, 2),
+        })
+    
+    return JsonResponse({
+        'success': True,
+        'etapes': etapes_data,
+        'duree_totale_min': round(duree / 60),
+        'distance_totale_km': round(distance / 1000, 2),
+    })
+
+
 @login_required
 def api_historique_positions(request):
     """API pour obtenir l'historique des positions du livreur"""
@@ -768,21 +961,68 @@ def api_historique_positions(request):
     positions = PositionLivreur.objects.filter(
         livreur=livreur,
         timestamp__gte=depuis
-    ).order_by('timestamp')
-    
-    positions_data = []
-    for position in positions:
-        positions_data.append({
-            'latitude': position.position.y,
-            'longitude': position.position.x,
-            'timestamp': position.timestamp.isoformat(),
-            'vitesse': position.vitesse,
-        })
+    ).order_by('timestamp').values_list('position', 'timestamp', 'vitesse')
     
-    return JsonResponse({
-        'success': True,
-        'positions': positions_data
-    })
+    # Simplification optionnelle : tolérance en mètres et/ou nombre maximal de points
+    try:
+        tolerance = float(request.GET['tolerance']) if request.GET.get('tolerance') else None
+        max_points = int(request.GET['max_points']) if request.GET.get('max_points') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Paramètres de simplification invalides.'})
+    if tolerance is not None or max_points is not None:
+        # La simplification a besoin de toute la trajectoire : elle est lue ici
+        points = _points_liste(simplifier(
+            [
+                (position.y, position.x, timestamp, vitesse)
+                for position, timestamp, vitesse in positions.iterator(chunk_size=2000)
+            ],
+            tolerance_m=tolerance, max_points=max_points
+        ))
+    else:
+        points = _points_historique(positions)
+    
+    if request.GET.get('format') == 'polyline':
+        contenu = _flux_polyline(points)
+    else:
+        contenu = _flux_positions(points)
+    
+    # Itérateur asynchrone : sous ASGI (workers uvicorn), la réponse est
+    # envoyée au fil de la lecture au lieu d'être mise en mémoire tampon
+    return StreamingHttpResponse(contenu, content_type='application/json')
+
+async def _points_historique(positions):
+    """Points de la trajectoire, lus par morceaux de 2000 dans un thread (aiterator)"""
+    async for position, timestamp, vitesse in positions.aiterator(chunk_size=2000):
+        yield position.y, position.x, timestamp, vitesse
+
+async def _points_liste(points):
+    for point in points:
+        yield point
+
+async def _flux_positions(points):
+    """Réponse JSON des positions, produite au fil de l'itération"""
+    yield '{"success": true, "positions": ['
+    separateur = ''
+    async for latitude, longitude, timestamp, vitesse in points:
+        yield separateur + json.dumps({
+            'latitude': latitude,
+            'longitude': longitude,
+            'timestamp': timestamp.isoformat(),
+            'vitesse': vitesse,
+        })
+        separateur = ','
+    yield ']}'
+
+async def _flux_polyline(points):
+    """Réponse JSON contenant la trajectoire au format encoded polyline"""
+    yield '{"success": true, "format": "polyline", "polyline": "'
+    precedent = None
+    async for point in points:
+        morceau = ''.join(encoder_polyline([point], precedent=precedent))
+        precedent = point
+        # Les caractères de l'encodage (63 à 126) incluent '\\'
+        yield morceau.replace('\\', '\\\\')
+    yield '"}'
 
 @login_required
 def api_statistiques(request):
@@ -792,40 +1032,33 @@ def api_statistiques(request):
     except Livreur.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Profil livreur non trouvé.'})
     
-    # Statistiques des 30 derniers jours
-    depuis = timezone.now() - timedelta(days=30)
-    
-    livraisons_periode = Livraison.objects.filter(
-        livreur=livreur,
-        date_attribution__gte=depuis
-    )
-    
-    livraisons_terminees_periode = livraisons_periode.filter(statut='terminee')
-    
-    # Revenus
-    revenus_periode = livraisons_terminees_periode.aggregate(
-        total=Sum('cout_livraison')
-    )['total'] or Decimal('0.00')
-    
-    # Évolution des livraisons par jour
-    evolution = []
-    for i in range(30):
-        jour = timezone.now() - timedelta(days=29-i)
-        count = livraisons_periode.filter(
-            date_attribution__date=jour.date()
-        ).count()
-        evolution.append({
-            'date': jour.strftime('%d/%m'),
-            'nombre': count
-        })
+    # Statistiques des 30 derniers jours : une ligne cumulée par jour (voir statistiques.py)
+    journees = serie_journaliere(livreur, jours=30)
+    nombre_evaluations = sum(journee.nombre_evaluations for journee in journees)
+    
+    evolution = [
+        {
+            'date': journee.jour.strftime('%d/%m'),
+            'nombre': journee.nombre_livraisons,
+            'terminees': journee.livraisons_terminees,
+            'revenus': float(journee.revenus),
+            'distance_km': round(journee.distance_km, 2),
+            'note_moyenne': float(journee.note_moyenne) if journee.note_moyenne is not None else None,
+        }
+        for journee in journees
+    ]
     
     return JsonResponse({
         'success': True,
         'statistiques': {
-            'total_livraisons': livraisons_periode.count(),
-            'livraisons_terminees': livraisons_terminees_periode.count(),
-            'revenus': float(revenus_periode),
+            'total_livraisons': sum(journee.nombre_livraisons for journee in journees),
+            'livraisons_terminees': sum(journee.livraisons_terminees for journee in journees),
+            'revenus': float(sum((journee.revenus for journee in journees), Decimal('0.00'))),
+            'distance_km': round(sum(journee.distance_km for journee in journees), 2),
             'note_moyenne': float(livreur.note_moyenne),
+            'note_moyenne_periode': round(
+                sum(journee.somme_notes for journee in journees) / nombre_evaluations, 2
+            ) if nombre_evaluations else None,
             'evolution': evolution
         }
     })
@@ -893,7 +1126,11 @@ def annuler_livraison(request, livraison_id):
     livraison = get_object_or_404(Livraison, id=livraison_id, livreur=livreur)
     
     try:
-        livraison.annuler_livraison()
+        if not livraison.annuler_livraison():
+            return JsonResponse({
+                'success': False,
+                'message': 'Cette livraison est déjà terminée ou annulée.'
+            }, status=409)
         
         # Créer une notification
         NotificationLivreur.objects.create(
@@ -920,21 +1157,15 @@ def api_livraisons_proches(request):
     except Livreur.DoesNotExist:
         return JsonResponse({'success': False, 'message': 'Profil livreur non trouvé.'})
     
+    tampon_positions.appliquer(livreur)
+    regroupement.cloturer_si_necessaire()
+    
     if not livreur.position_actuelle:
         return JsonResponse({'success': False, 'message': 'Position actuelle du livreur non définie.'})
     
-    # Rechercher les livraisons dans un rayon de 10 km
-    rayon_km = 10
-    livraisons = Livraison.objects.filter(
-        livreur__isnull=True,
-        statut='attribuee',
-        boutique_point__distance_lte=(
-            livreur.position_actuelle,
-            Distance(km=rayon_km)
-        )
-    ).annotate(
-        distance=GISDistance('boutique_point', livreur.position_actuelle)
-    ).order_by('distance')
+    # Rechercher les livraisons dans le rayon demandé (10 km par défaut)
+    params = parametres_recherche(request.GET)
+    livraisons, curseur_suivant = livraisons_proches(livreur.position_actuelle, **params)
     
     livraisons_data = []
     for livraison in livraisons:
@@ -944,34 +1175,32 @@ def api_livraisons_proches(request):
             'client_nom': f"{livraison.commande.client.first_name} {livraison.commande.client.last_name}",
             'adresse_livraison': livraison.commande.adresse_livraison,
             'cout_livraison': float(livraison.cout_livraison),
-            'distance_metres': livraison.distance.m,
+            'distance_metres': livraison.distance_metres,
             'boutique_nom': livraison.commande.commercant.nom_boutique if livraison.commande.commercant else 'Non spécifié',
+            'lot_id': livraison.lot_id,
         })
     
     return JsonResponse({
         'success': True,
-        'livraisons': livraisons_data
+        'livraisons': livraisons_data,
+        'curseur_suivant': curseur_suivant
     })
 
-# suivi livraison en temps réel via websocket
-from channels.generic.websocket import AsyncWebsocketConsumer
-import asyncio
-import json
-
 @login_required
 def suivi_livraison(request, livraison_id):
-    """Vue pour le suivi en temps réel via WebSocket"""
-    try:
-        livreur = request.user.livreur
-    except Livreur.DoesNotExist:
-        messages.error(request, 'Vous n\'avez pas de profil livreur.')
-        return redirect('livraisons:inscription')
-    
-    livraison = get_object_or_404(Livraison, id=livraison_id, livreur=livreur)
+    """Suivi en temps réel d'une livraison (WebSocket) pour le livreur, le client et le commerçant"""
+    livraison = get_object_or_404(
+        Livraison.objects.select_related('livreur__user', 'commande__client', 'commande__commercant'),
+        Q(livreur__user=request.user) |
+        Q(commande__client__user=request.user) |
+        Q(commande__commercant__user=request.user),
+        id=livraison_id
+    )
     
     context = {
         'livraison': livraison,
-        'livreur': livreur,
+        'livreur': livraison.livreur,
+        'est_livreur': livraison.livreur is not None and livraison.livreur.user_id == request.user.id,
     }
     
-    return render(request, 'livraisons/suivi_livraison.html', context)
\ No newline at end of file
+    return render(request, 'livraisons/suivi_livraison.html', context)
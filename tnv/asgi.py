@@ -2,6 +2,9 @@
 ASGI config for tnv project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go through Django, WebSocket connections through the Channels
+consumers of the clients and livraisons apps, with the session user in the
+scope and the Origin header checked against ALLOWED_HOSTS.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +16,24 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tnv.settings')
 
-application = get_asgi_application()
+# Initialiser Django avant d'importer les consumers (modèles)
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+
+import clients.routing
+import livraisons.routing
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(
+        AuthMiddlewareStack(
+            URLRouter(
+                clients.routing.websocket_urlpatterns
+                + livraisons.routing.websocket_urlpatterns
+            )
+        )
+    ),
+})
@@ -16,6 +16,7 @@ ALLOWED_HOSTS = os.environ.get('ALLOWED_HOSTS', 'localhost,127.0.0.1,.onrender.c
 
 # Application definition
 INSTALLED_APPS = [
+    'daphne',  # runserver en ASGI (WebSocket en développement)
     'tnv',
     'core.apps.CoreConfig',
     'django.contrib.admin',
@@ -64,6 +65,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'tnv.wsgi.application'
+ASGI_APPLICATION = 'tnv.asgi.application'
 
 # Configuration de la base de données pour la production
 if os.environ.get('DATABASE_URL'):
@@ -95,6 +97,110 @@ if not DEBUG:
 # Vous devrez utiliser PostgreSQL avec PostGIS en production
 # DATABASES['default']['ENGINE'] = 'django.contrib.gis.db.backends.postgis'
 
+# Cache partagé entre les processus (Redis en production)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Intervalle (secondes) entre deux écritures en base des positions des livreurs
+TNV_TAMPON_POSITIONS_INTERVALLE = int(os.environ.get('TNV_TAMPON_POSITIONS_INTERVALLE', 10))
+
+# Durée de conservation de l'historique des positions (voir gerer_partitions_positions)
+TNV_RETENTION_POSITIONS_JOURS = int(os.environ.get('TNV_RETENTION_POSITIONS_JOURS', 90))
+
+# Filtrage des positions GPS avant l'historique (voir livraisons/filtre_gps.py)
+TNV_FILTRE_GPS = {
+    'distance_min_m': 15,
+    'intervalle_min_s': 2,
+    'intervalle_max_s': 60,
+}
+
+# Attribution globale des livraisons (voir livraisons/dispatch.py)
+TNV_DISPATCH = {
+    'intervalle_s': int(os.environ.get('TNV_DISPATCH_INTERVALLE', 15)),
+    'rayon_max_km': 10,
+    'capacite': 2,
+    'delai_proposition_s': 90,
+}
+
+# Couche Channels : Redis en production, partagée entre les workers ASGI ;
+# en mémoire sinon (un seul processus : développement et tests)
+if os.environ.get('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': [os.environ.get('REDIS_URL')],
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
+
+# Suivi en direct des livraisons (voir livraisons/consumers.py)
+# Écart minimal entre deux positions envoyées à un même abonné (secondes)
+TNV_SUIVI_INTERVALLE_MIN_S = 2
+
+# Zones d'arrivée des livraisons actives (voir livraisons/geofences.py) ;
+# en mode automatique, l'arrivée commence ou termine la livraison sans le livreur
+TNV_GEOFENCES = {
+    'rayon_m': 75,
+    'automatique': os.environ.get('TNV_GEOFENCE_AUTO', 'False') == 'True',
+}
+
+# Arrivée estimée des livraisons en cours (voir livraisons/eta.py)
+TNV_ETA = {
+    'distance_min_m': 100,
+    'intervalle_max_s': 60,
+    'ecart_min_s': 30,
+}
+
+# Durée de vie d'un battement de cœur des livreurs (voir livraisons/presence.py)
+TNV_PRESENCE_TTL_S = int(os.environ.get('TNV_PRESENCE_TTL_S', 90))
+
+# Regroupement des points de la carte interactive (voir livraisons/carte.py)
+TNV_CARTE = {
+    'taille_cellule_px': 60,
+    'zoom_max_regroupement': 16,
+}
+
+# Tuiles vectorielles de la carte (voir livraisons/tuiles.py) :
+# (zoom maximal, durée de cache en secondes)
+TNV_TUILES = {
+    'durees_cache': ((11, 300), (14, 60), (22, 15)),
+}
+
+# Regroupement des commandes d'une même boutique (voir livraisons/regroupement.py)
+TNV_REGROUPEMENT = {
+    'fenetre_s': int(os.environ.get('TNV_FENETRE_REGROUPEMENT_S', 120)),
+    'rayon_km': 2.0,
+    'taille_max': 4,
+}
+
+# Carte de la demande (voir livraisons/demande.py)
+TNV_DEMANDE = {
+    'taille_cellule_m': 400,
+    'heures_max': 24,
+    'retention_jours': 30,
+}
+
+# Graphe routier hors ligne produit par preparer_routage (voir livraisons/routage.py)
+TNV_ROUTAGE_GRAPHE = os.environ.get('TNV_ROUTAGE_GRAPHE', str(BASE_DIR / 'donnees' / 'routage_lome.npz'))
+
 LEAFLET_CONFIG = {
     'DEFAULT_CENTER': (6.1375, 1.2125),
     'DEFAULT_ZOOM': 12,